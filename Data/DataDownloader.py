@@ -1,7 +1,53 @@
 import argparse
-import requests
-import zipfile
+import hashlib
 import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BASE_URL = "https://data.binance.vision/data"
+INTERVAL_DATA_TYPES = ["klines", "markPriceKlines", "indexPriceKlines", "premiumIndexKlines"]
+NO_INTERVAL_DATA_TYPES = ["trades", "aggTrades", "bookDepth", "bookTicker", "metrics"]
+
+_thread_local = threading.local()
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+def build_url(market="futures", contract="um", freq="daily", data_type="klines",
+              interval="15m", symbol="BTCUSDT", date="2024-03-30", base_url=BASE_URL):
+    """
+    Binance历史数据zip文件的url, 参数含义见download_and_unzip
+    """
+    if market == "spot":
+        if data_type in INTERVAL_DATA_TYPES:
+            return f"{base_url}/spot/{freq}/{data_type}/{symbol}/{interval}/{symbol}-{interval}-{date}.zip"
+        elif data_type in NO_INTERVAL_DATA_TYPES:
+            return f"{base_url}/spot/{freq}/{data_type}/{symbol}/{symbol}-{data_type}-{date}.zip"
+        else:
+            raise ValueError(f"Data type '{data_type}' is not available for spot market.")
+    elif market == "futures":
+        if data_type in INTERVAL_DATA_TYPES:
+            return f"{base_url}/futures/{contract}/{freq}/{data_type}/{symbol}/{interval}/{symbol}-{interval}-{date}.zip"
+        elif data_type in NO_INTERVAL_DATA_TYPES:
+            return f"{base_url}/futures/{contract}/{freq}/{data_type}/{symbol}/{symbol}-{data_type}-{date}.zip"
+        else:
+            raise ValueError(f"Data type '{data_type}' is not supported.")
+    elif market == "option":
+        if data_type == "BVOLIndex":
+            return f"{base_url}/option/{freq}/BVOLIndex/{symbol}/{symbol}-BVOLIndex-{date}.zip"
+        else:
+            raise ValueError("Invalid data type. Only support BVOLIndex.")
+    else:
+        raise ValueError("Invalid market type. Choose 'spot', 'futures'.")
+
 
 def download_and_unzip(market="futures", contract="um", freq="daily", data_type="klines", 
                        interval="15m", symbol="BTCUSDT", date="2024-03-30", 
@@ -19,31 +65,7 @@ def download_and_unzip(market="futures", contract="um", freq="daily", data_type=
     """
 
     # Construct the URL based on data type
-    base_url = "https://data.binance.vision/data"
-    interval_list = ["klines", "markPriceKlines", "indexPriceKlines", "premiumIndexKlines"]
-    no_interval_list = ["trades", "aggTrades", "bookDepth", "bookTicker", "metrics"]
-
-    if market == "spot":
-        if data_type in interval_list:
-            url = f"{base_url}/spot/{freq}/{data_type}/{symbol}/{interval}/{symbol}-{interval}-{date}.zip"
-        elif data_type in no_interval_list:
-            url = f"{base_url}/spot/{freq}/{data_type}/{symbol}/{symbol}-{data_type}-{date}.zip"
-        else:
-            raise ValueError(f"Data type '{data_type}' is not available for spot market.")
-    elif market == "futures":
-        if data_type in interval_list:
-            url = f"{base_url}/futures/{contract}/{freq}/{data_type}/{symbol}/{interval}/{symbol}-{interval}-{date}.zip"
-        elif data_type in no_interval_list:
-            url = f"{base_url}/futures/{contract}/{freq}/{data_type}/{symbol}/{symbol}-{data_type}-{date}.zip"
-        else:
-            raise ValueError(f"Data type '{data_type}' is not supported.")
-    elif market == "option":
-        if data_type == "BVOLIndex":
-            url = f"{base_url}/option/{freq}/BVOLIndex/{symbol}/{symbol}-BVOLIndex-{date}.zip"
-        else:
-            raise ValueError("Invalid data type. Only support BVOLIndex.")
-    else:
-        raise ValueError("Invalid market type. Choose 'spot', 'futures'.")
+    url = build_url(market, contract, freq, data_type, interval, symbol, date)
 
     os.makedirs(extract_to, exist_ok=True)
     file_name = os.path.join(extract_to, url.split("/")[-1]) 
@@ -65,6 +87,128 @@ def download_and_unzip(market="futures", contract="um", freq="daily", data_type=
     else:
         print(f"Failed to download {file_name}. Check if the date and parameters are correct.")
 
+
+def _session():
+    """每个线程一个requests.Session, 复用连接"""
+    if not hasattr(_thread_local, "session"):
+        _thread_local.session = requests.Session()
+    return _thread_local.session
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fetch_checksum(url, timeout=30):
+    """
+    读取 {url}.CHECKSUM, 格式为 "<sha256>  <文件名>"
+    :return: sha256, 没有CHECKSUM文件时返回None
+    """
+    response = _session().get(f"{url}.CHECKSUM", timeout=timeout)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.text.split()[0].lower()
+
+
+def download_verified(url, dest_dir, verify_checksum=True, retries=3, timeout=60):
+    """
+    下载zip并与.CHECKSUM比对, 先写入.part文件, 校验通过后再改名
+    目标zip已存在且校验通过时直接返回(断点续传时跳过)
+    :return: zip路径, 服务器上不存在该文件(404)时返回None
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    zip_path = os.path.join(dest_dir, url.split("/")[-1])
+    expected = fetch_checksum(url, timeout) if verify_checksum else None
+    if os.path.exists(zip_path) and (expected is None or sha256_file(zip_path) == expected):
+        return zip_path
+
+    for attempt in range(1, retries + 1):
+        part_path = f"{zip_path}.part"
+        try:
+            with _session().get(url, stream=True, timeout=timeout) as response:
+                if response.status_code == 404:
+                    return None
+                response.raise_for_status()
+                digest = hashlib.sha256()
+                with open(part_path, "wb") as f:
+                    for chunk in response.iter_content(1 << 16):
+                        f.write(chunk)
+                        digest.update(chunk)
+            if expected is not None and digest.hexdigest() != expected:
+                raise ChecksumError(f"checksum mismatch for {url}")
+            os.replace(part_path, zip_path)
+            return zip_path
+        except (requests.RequestException, ChecksumError):
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            if attempt == retries:
+                raise
+            time.sleep(min(2 ** (attempt - 1), 10))
+
+
+def extract_zip(zip_path, extract_to):
+    """
+    解压后删除zip; 先解压到临时目录再逐个改名, 中断时不会留下不完整的csv
+    :return: 解压出的文件路径
+    """
+    tmp_dir = tempfile.mkdtemp(prefix=".extract-", dir=extract_to)
+    try:
+        with zipfile.ZipFile(zip_path, "r") as zip_ref:
+            names = zip_ref.namelist()
+            zip_ref.extractall(tmp_dir)
+        paths = []
+        for name in names:
+            path = os.path.join(extract_to, os.path.basename(name))
+            os.replace(os.path.join(tmp_dir, name), path)
+            paths.append(path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.remove(zip_path)
+    return paths
+
+
+def download_archives(tasks, market="futures", contract="um", data_type="klines", interval="15m",
+                      symbol="BTCUSDT", extract_to=".", max_workers=8, base_url=BASE_URL,
+                      verify_checksum=True, retries=3):
+    """
+    用线程池并发下载并解压多个zip
+    解压出的csv已存在的任务直接跳过, 中断后重新运行只下载缺少的文件
+    :param tasks: [(freq, date)], freq为'daily'或'monthly'
+    :return: (csv路径列表(按任务顺序), 服务器上不存在的任务, {失败的任务: 异常})
+    """
+    os.makedirs(extract_to, exist_ok=True)
+
+    def run(task):
+        freq, date = task
+        url = build_url(market, contract, freq, data_type, interval, symbol, date, base_url=base_url)
+        csv_path = os.path.join(extract_to, url.split("/")[-1][:-len(".zip")] + ".csv")
+        if os.path.exists(csv_path):
+            return [csv_path]
+        zip_path = download_verified(url, extract_to, verify_checksum, retries)
+        if zip_path is None:
+            return None
+        return [p for p in extract_zip(zip_path, extract_to) if p.endswith(".csv")]
+
+    files, missing, failed = [], [], dict()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(run, task) for task in tasks]
+        for task, future in zip(tasks, futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                failed[task] = e
+                continue
+            if result is None:
+                missing.append(task)
+            else:
+                files.extend(result)
+    return files, missing, failed
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Download and extract Binance historical data.")
     
@@ -5,10 +5,95 @@ Date: 7-7-2020
 """
 
 from abc import ABCMeta,abstractmethod
+from datetime import datetime
+import hashlib
+import json
+import os
+from itertools import islice
+from queue import Queue, Empty
+from threading import Thread, Event, Lock
 import pymongo
-from pymongo.errors import ConnectionFailure,OperationFailure
+from pymongo.errors import ConnectionFailure,OperationFailure,BulkWriteError,CollectionInvalid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from Utils.DataStructure import MONGODATA
 
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_MAX_POOL_SIZE = 50
+DEFAULT_MIN_POOL_SIZE = 0
+
+# 进程内共享的MongoClient, (host, port) -> client
+_MONGO_CLIENTS = dict()
+_MONGO_CHECKED = set()
+_MONGO_LOCK = Lock()
+
+
+def get_mongo_client(host="localhost", port=27017, max_pool_size=DEFAULT_MAX_POOL_SIZE,
+                     min_pool_size=DEFAULT_MIN_POOL_SIZE, check=False):
+    """
+    获取进程内共享的MongoClient,同一(host, port)只创建一个带连接池的client
+    client为lazy连接,第一次真正读写时才建立连接;check=True时用server_info()检查一次链接状态
+    """
+    key = (host, int(port))
+    with _MONGO_LOCK:
+        client = _MONGO_CLIENTS.get(key)
+        if client is None:
+            client = pymongo.MongoClient(host=host, port=int(port),
+                                         maxPoolSize=max_pool_size,
+                                         minPoolSize=min_pool_size,
+                                         connect=False)
+            _MONGO_CLIENTS[key] = client
+
+        if check and key not in _MONGO_CHECKED:
+            try:
+                client.server_info()
+            except Exception:
+                raise ConnectionFailure("链接Mongo数据库失败")
+            _MONGO_CHECKED.add(key)
+    return client
+
+
+def close_mongo_clients():
+    """
+    关闭进程内所有共享的MongoClient
+    """
+    with _MONGO_LOCK:
+        for client in _MONGO_CLIENTS.values():
+            client.close()
+        _MONGO_CLIENTS.clear()
+        _MONGO_CHECKED.clear()
+
+
+def insert_many_batched(collection, docs, batch_size=DEFAULT_BATCH_SIZE, ordered=False):
+    """
+    分批insert_many,避免单次写入超过BSON/消息大小限制
+    docs可以是list或任意可迭代对象(如csv.DictReader),按batch_size切块写入
+    ordered=False时单条失败(如重复_id)不会中断同批次其余文档的写入
+    :return: 成功写入的文档数
+    """
+    inserted = 0
+    errors = []
+    it = iter(docs)
+    while True:
+        chunk = list(islice(it, batch_size))
+        if not chunk:
+            break
+        try:
+            result = collection.insert_many(chunk, ordered=ordered)
+            inserted += len(result.inserted_ids)
+        except BulkWriteError as e:
+            inserted += e.details.get('nInserted', 0)
+            errors.extend(e.details.get('writeErrors', []))
+            if ordered:
+                break
+    if errors:
+        raise BulkWriteError({'nInserted': inserted, 'writeErrors': errors})
+    return inserted
+
+
 class DataHandlerBase(object):
 
     __metaclass__ = ABCMeta
@@ -25,23 +110,24 @@ class MongoDBHandler(DataHandlerBase):
         self.config = config
         self.host = self.config["DB"]["Mongo_Host"]
         self.port = int(self.config["DB"]["Mongo_Port"])
+        self.batch_size = int(self.config["DB"].get("Mongo_Batch_Size", DEFAULT_BATCH_SIZE))
+        self.queue_size = int(self.config["DB"].get("Mongo_Queue_Size", DEFAULT_QUEUE_SIZE))
+        self.max_pool_size = int(self.config["DB"].get("Mongo_Max_Pool_Size", DEFAULT_MAX_POOL_SIZE))
+        self.min_pool_size = int(self.config["DB"].get("Mongo_Min_Pool_Size", DEFAULT_MIN_POOL_SIZE))
         self.client = None
         self.__connection = False
 
     def Connect_DB(self):
         """
-        链接MongoDB
+        链接MongoDB, 使用进程内共享的client, 链接状态每个进程只检查一次
         :return:
         """
-        try:
-            if not self.client and not self.__connection:
-                self.client = pymongo.MongoClient(host=self.host,
-                                                  port=self.port)
-                # 检查链接状态
-                self.client.server_info()
-                self.__connection = True
-        except:
-            raise ConnectionFailure("链接Mongo数据库失败")
+        if not self.client and not self.__connection:
+            self.client = get_mongo_client(self.host, self.port,
+                                           max_pool_size=self.max_pool_size,
+                                           min_pool_size=self.min_pool_size,
+                                           check=True)
+            self.__connection = True
 
     def on_collections_query(self,db:MONGODATA):
         """
@@ -80,9 +166,9 @@ class MongoDBHandler(DataHandlerBase):
         except:
             raise OperationFailure("DB插入单条数据失败")
 
-    def on_insert_many(self,db:MONGODATA):
+    def on_insert_many(self,db:MONGODATA,batch_size=None):
         """
-        插入多条数据
+        插入多条数据,按batch_size分批无序写入
         """
         try:
             my_db = self.client[db.DB]
@@ -93,7 +179,7 @@ class MongoDBHandler(DataHandlerBase):
             if len(data) == 0:
                 return
 
-            my_col.insert_many(data)
+            insert_many_batched(my_col, data, batch_size or self.batch_size, ordered=False)
             return True
         except:
             raise OperationFailure("DB插入多条数据失败")
@@ -244,14 +330,407 @@ class MongoDBHandler(DataHandlerBase):
 
     def disconnected(self):
         """
-        关闭与数据库的链接
+        断开与数据库的链接
+        client为进程内共享,这里只释放引用,由close_mongo_clients()统一关闭
         """
         self.__connection = False
-        if self.client:
-            self.client.close()
         self.client = None
 
 
+class MongoBatchWriter(object):
+    """
+    后台批量写入MongoDB(write-behind)
+    回测线程put文档到有界队列,后台线程按(DB, COL)攒批并无序insert_many;
+    队列满时put阻塞,形成backpressure,避免内存无限增长
+    """
+    _STOP = object()
+
+    def __init__(self, handler: MongoDBHandler, batch_size=None, queue_size=None, flush_interval=1.0):
+        self.handler = handler
+        self.batch_size = int(batch_size or handler.batch_size)
+        self.flush_interval = flush_interval
+        self.queue = Queue(maxsize=int(queue_size or handler.queue_size))
+        self.inserted = 0
+        self.errors = []
+        self.__pending = dict()  # (DB, COL) -> list
+        self.__thread = None
+
+    def start(self):
+        """
+        启动后台写入线程
+        """
+        if self.__thread is None:
+            self.__thread = Thread(target=self._run, name="mongo-batch-writer", daemon=True)
+            self.__thread.start()
+
+    def put(self, db: str, col: str, data: dict):
+        """
+        写入单条文档,队列满时阻塞
+        """
+        self.queue.put((db, col, data))
+
+    def put_many(self, db: str, col: str, data):
+        """
+        写入多条文档
+        """
+        for item in data:
+            self.queue.put((db, col, item))
+
+    def flush(self):
+        """
+        阻塞直到当前队列中的文档全部写入; 后台线程没有运行时(未start或已close)直接返回
+        """
+        if self.__thread is None or not self.__thread.is_alive():
+            return
+        done = Event()
+        self.queue.put(done)
+        done.wait()
+
+    def close(self):
+        """
+        写完剩余文档并停止后台线程
+        :return: 成功写入的文档数
+        """
+        if self.__thread is not None:
+            self.queue.put(self._STOP)
+            self.__thread.join()
+            self.__thread = None
+        return self.inserted
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except Empty:
+                self._write_pending()
+                continue
+
+            if item is self._STOP:
+                self._write_pending()
+                break
+
+            if isinstance(item, Event):
+                self._write_pending()
+                item.set()
+                continue
+
+            db, col, data = item
+            batch = self.__pending.setdefault((db, col), [])
+            batch.append(data)
+            if len(batch) >= self.batch_size:
+                self._write(db, col, batch)
+                self.__pending[(db, col)] = []
+
+    def _write_pending(self):
+        for (db, col), batch in self.__pending.items():
+            if batch:
+                self._write(db, col, batch)
+        self.__pending = dict()
+
+    def _write(self, db, col, batch):
+        try:
+            my_col = self.handler.client[db][col]
+            self.inserted += insert_many_batched(my_col, batch, self.batch_size, ordered=False)
+        except BulkWriteError as e:
+            self.inserted += e.details.get('nInserted', 0)
+            self.errors.extend(e.details.get('writeErrors', []))
+        except Exception as e:
+            self.errors.append({'DB': db, 'COL': col, 'errmsg': str(e)})
+
+
+class MongoResultStore(object):
+    """
+    回测结果统一存储: 所有run的position/account写入同一个collection,而不是每个run一组collection
+    文档结构与原collection相同,另加 ts(datetime) 和 meta: {run_id, symbol, kind}
+    优先创建time-series collection(timeField=ts, metaField=meta),
+    不支持时(MongoDB<5.0等)退化为普通collection;两种情况都建立(run_id, symbol, kind, ts)复合索引,
+    跨run比较只需一次索引查询
+    run信息(user, strategy, bt_time, 参数等)另存在 {col}_runs 中
+    """
+    INDEX = [("meta.run_id", 1), ("meta.symbol", 1), ("meta.kind", 1), ("ts", 1)]
+    TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+    def __init__(self, handler: MongoDBHandler, db: str, col: str, timeseries=True, granularity="minutes"):
+        self.handler = handler
+        self.db = db
+        self.col = col
+        self.runs_col = f"{col}_runs"
+        self.timeseries = timeseries
+        self.granularity = granularity
+        self.collection = None
+        self.runs = None
+
+    def ensure_collection(self):
+        """
+        创建collection和索引(已存在则直接使用)
+        """
+        my_db = self.handler.client[self.db]
+        if self.timeseries and self.col not in my_db.list_collection_names():
+            try:
+                my_db.create_collection(self.col, timeseries={"timeField": "ts", "metaField": "meta",
+                                                              "granularity": self.granularity})
+            except (OperationFailure, CollectionInvalid, NotImplementedError):
+                # 不支持time-series collection, 使用普通collection + 复合索引
+                pass
+        self.collection = my_db[self.col]
+        self.collection.create_index(self.INDEX)
+        self.runs = my_db[self.runs_col]
+        self.runs.create_index("run_id", unique=True)
+        return self.collection
+
+    @staticmethod
+    def make_run_id(user, strategy, bt_time):
+        """
+        run_id与原collection名后缀一致: user|strategy|bt_time
+        """
+        return f"{user}|{strategy}|{bt_time}"
+
+    @classmethod
+    def to_datetime(cls, timestamp, default=None):
+        if isinstance(timestamp, datetime):
+            return timestamp
+        try:
+            return datetime.strptime(str(timestamp), cls.TIME_FORMAT)
+        except ValueError:
+            return default
+
+    @classmethod
+    def to_document(cls, run_id, symbol, kind, record: dict, default_ts=None):
+        """
+        将position/account记录转换成统一存储的文档
+        init记录的timestamp不是有效时间,ts使用default_ts(一般为lookback_time)
+        """
+        doc = dict(record)
+        doc["ts"] = cls.to_datetime(record.get("timestamp"), default_ts)
+        doc["meta"] = {"run_id": run_id, "symbol": symbol, "kind": kind}
+        return doc
+
+    def register_run(self, run_id, info: dict):
+        """
+        记录run的元信息
+        """
+        self.runs.replace_one({"run_id": run_id}, dict(info, run_id=run_id), upsert=True)
+
+    def load(self, run_id, symbol, kind, records, default_ts=None, batch_size=None):
+        """
+        批量写入一个run中某个symbol/kind的全部记录
+        :return: 成功写入的文档数
+        """
+        docs = (self.to_document(run_id, symbol, kind, r, default_ts) for r in records)
+        return insert_many_batched(self.collection, docs, batch_size or self.handler.batch_size, ordered=False)
+
+    def query(self, run_ids=None, symbols=None, kinds=None, start=None, end=None, fields=None):
+        """
+        按run_id/symbol/kind/时间范围查询, 单次索引查询返回DataFrame
+        返回的列包含 run_id, symbol, kind, ts 以及fields(默认全部字段)
+        """
+        req = dict()
+        if run_ids is not None:
+            req["meta.run_id"] = {"$in": list(run_ids)}
+        if symbols is not None:
+            req["meta.symbol"] = {"$in": list(symbols)}
+        if kinds is not None:
+            req["meta.kind"] = {"$in": list(kinds)}
+        if start is not None or end is not None:
+            req["ts"] = dict()
+            if start is not None:
+                req["ts"]["$gte"] = self.to_datetime(start, start)
+            if end is not None:
+                req["ts"]["$lte"] = self.to_datetime(end, end)
+
+        projection = {"_id": 0}
+        if fields is not None:
+            projection.update({"meta": 1, "ts": 1})
+            projection.update({f: 1 for f in fields})
+
+        cursor = self.collection.find(req, projection).sort(self.INDEX)
+        rows = []
+        for doc in cursor:
+            meta = doc.pop("meta")
+            doc.update(meta)
+            rows.append(doc)
+
+        columns = ["run_id", "symbol", "kind", "ts"]
+        df = pd.DataFrame(rows)
+        if df.empty:
+            return pd.DataFrame(columns=columns + list(fields or []))
+        return df[columns + [c for c in df.columns if c not in columns]]
+
+    def list_runs(self, req=None):
+        """
+        查询run元信息
+        """
+        return pd.DataFrame(list(self.runs.find(req or {}, {"_id": 0})))
+
+
+class ParquetResultStore(object):
+    """
+    本地parquet回测结果存储
+    结果按 results/run_id=.../symbol=.../kind=.../part-0.parquet 分区写入(hive分区),
+    每个run在 catalog/ 下另存一行元信息(config hash, 参数, 指标, 运行耗时),
+    用pyarrow.dataset可以一次扫描多个run,不需要逐个打开csv
+    """
+    TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+    # 每个run都不同的配置项,不参与config hash
+    HASH_EXCLUDE = ("bt_time",)
+    PARTITIONING = ds.partitioning(pa.schema([("run_id", pa.string()), ("symbol", pa.string()),
+                                              ("kind", pa.string())]), flavor="hive")
+
+    def __init__(self, root="./bt_result/store"):
+        self.root = root
+        self.results_dir = os.path.join(root, "results")
+        self.catalog_dir = os.path.join(root, "catalog")
+
+    @staticmethod
+    def make_run_id(user, strategy, bt_time):
+        """
+        run_id作为分区目录名,不使用'|'
+        """
+        return f"{user}_{strategy}_{bt_time}"
+
+    @classmethod
+    def config_hash(cls, config: dict, params: dict = None):
+        """
+        配置+策略参数的hash,相同配置的多次run具有相同的hash
+        """
+        payload = {k: v for k, v in config.items() if k not in cls.HASH_EXCLUDE}
+        payload = json.dumps({"config": payload, "params": params or {}}, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def to_table(records):
+        """
+        position/account记录转换成arrow table
+        init记录的timestamp类型与其他记录不同,统一转成str
+        """
+        df = records if isinstance(records, pd.DataFrame) else pd.DataFrame(list(records))
+        if "timestamp" in df.columns:
+            df = df.assign(timestamp=df["timestamp"].astype(str))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+    def partition_dir(self, run_id, symbol, kind):
+        return os.path.join(self.results_dir, f"run_id={run_id}", f"symbol={symbol}", f"kind={kind}")
+
+    def write(self, run_id, symbol, kind, records):
+        """
+        写入一个run中某个symbol/kind的全部记录, 重复写入时覆盖
+        :return: 写入的行数
+        """
+        table = self.to_table(records)
+        out_dir = self.partition_dir(run_id, symbol, kind)
+        os.makedirs(out_dir, exist_ok=True)
+        pq.write_table(table, os.path.join(out_dir, "part-0.parquet"))
+        return table.num_rows
+
+    def write_run(self, run_id, frames: dict):
+        """
+        :param frames: {(symbol, kind): records}
+        :return: 写入的总行数
+        """
+        return sum(self.write(run_id, symbol, kind, records) for (symbol, kind), records in frames.items())
+
+    @staticmethod
+    def compute_metrics(frames: dict):
+        """
+        由position记录计算run的汇总指标
+        每个symbol的long/short在同一timestamp上的total_pnl求和,得到pnl曲线
+        """
+        curves = []
+        for (symbol, kind), records in frames.items():
+            if kind not in ("long", "short"):
+                continue
+            df = records if isinstance(records, pd.DataFrame) else pd.DataFrame(list(records))
+            if df.empty or "total_pnl" not in df.columns:
+                continue
+            # 同一timestamp多次更新取最后一次
+            curves.append(df.iloc[1:].groupby("timestamp")["total_pnl"].last().rename((symbol, kind)))
+
+        metrics = {"total_pnl": 0.0, "max_drawdown": 0.0, "n_bars": 0}
+        if not curves:
+            return metrics
+        pnl = pd.concat(curves, axis=1).sort_index().ffill().fillna(0.0).sum(axis=1)
+        if pnl.empty:
+            return metrics
+        metrics["total_pnl"] = float(pnl.iloc[-1])
+        metrics["max_drawdown"] = float((pnl.cummax() - pnl).max())
+        metrics["n_bars"] = int(len(pnl))
+        return metrics
+
+    def register_run(self, run_id, config: dict, params: dict = None, metrics: dict = None, wall_time=None):
+        """
+        写入catalog中run的元信息, 每个run一个文件,多个进程同时回测时互不覆盖
+        """
+        row = {
+            "run_id": run_id,
+            "user": config.get("user"),
+            "strategy": config.get("strategy_name"),
+            "bt_time": config.get("bt_time"),
+            "start_time": config.get("start_time"),
+            "end_time": config.get("end_time"),
+            "symbols": json.dumps(list(config.get("TradingSymbols", [])), default=str),
+            "config_hash": self.config_hash(config, params),
+            "params": json.dumps(params or {}, sort_keys=True, default=str),
+            "metrics": json.dumps(metrics or {}, sort_keys=True, default=str),
+            "wall_time": float(wall_time) if wall_time is not None else None,
+            "created_at": datetime.strftime(datetime.now(), self.TIME_FORMAT),
+        }
+        os.makedirs(self.catalog_dir, exist_ok=True)
+        pq.write_table(pa.Table.from_pylist([row]), os.path.join(self.catalog_dir, f"{run_id}.parquet"))
+        return row
+
+    def catalog(self):
+        """
+        读取全部run的元信息, params/metrics解析为dict, metrics另外展开成 metric_* 列
+        """
+        if not os.path.isdir(self.catalog_dir):
+            return pd.DataFrame()
+        files = sorted(f for f in os.listdir(self.catalog_dir) if f.endswith(".parquet"))
+        if not files:
+            return pd.DataFrame()
+        df = pd.concat([pq.read_table(os.path.join(self.catalog_dir, f)).to_pandas() for f in files], ignore_index=True)
+        df["symbols"] = df["symbols"].map(json.loads)
+        df["params"] = df["params"].map(json.loads)
+        df["metrics"] = df["metrics"].map(json.loads)
+        metrics = pd.DataFrame(df["metrics"].tolist(), index=df.index).add_prefix("metric_")
+        return pd.concat([df, metrics], axis=1)
+
+    def dataset(self):
+        """
+        全部结果的pyarrow dataset, run_id/symbol/kind为分区列
+        position和account的字段不同,schema取全部文件schema的并集
+        """
+        dataset = ds.dataset(self.results_dir, format="parquet", partitioning=self.PARTITIONING)
+        schemas = [fragment.physical_schema for fragment in dataset.get_fragments()]
+        try:
+            schema = pa.unify_schemas(schemas + [self.PARTITIONING.schema], promote_options="permissive")
+        except TypeError:
+            # pyarrow<14没有promote_options, 只能合并同名同类型的字段
+            schema = pa.unify_schemas(schemas + [self.PARTITIONING.schema])
+        return ds.dataset(self.results_dir, schema=schema, format="parquet", partitioning=self.PARTITIONING)
+
+    def scan(self, run_ids=None, symbols=None, kinds=None, columns=None):
+        """
+        按run_id/symbol/kind过滤扫描结果,只读取命中的分区
+        返回的列包含 run_id, symbol, kind 以及columns(默认全部字段)
+        """
+        keys = ["run_id", "symbol", "kind"]
+        if not os.path.isdir(self.results_dir):
+            return pd.DataFrame(columns=keys + list(columns or []))
+
+        expr = None
+        for field, values in zip(keys, (run_ids, symbols, kinds)):
+            if values is None:
+                continue
+            cond = ds.field(field).isin([str(v) for v in values])
+            expr = cond if expr is None else expr & cond
+
+        dataset = self.dataset()
+        if columns is not None:
+            columns = keys + [c for c in columns if c not in keys]
+        df = dataset.to_table(columns=columns, filter=expr).to_pandas()
+        return df[keys + [c for c in df.columns if c not in keys]]
+
+
 class CSVHandler(DataHandlerBase):
     def __init__(self):
         """
@@ -0,0 +1,169 @@
+"""
+预处理后的bar缓存: 每个symbol的数据存成一组连续的.npy数组, 回测时用np.load(mmap_mode='r')直接映射
+
+{cache_dir}/{symbol}/{key}/
+    meta.json           列名, dtype, 行数, 源文件信息
+    ts.npy              int64, open_time / fundingTime(毫秒)
+    timestamp.npy       'YYYY-mm-dd HH:MM:SS'(定长unicode)
+    {column}.npy        其它列, 数值列保持原类型, 可以转成数字的字符串列(fundingRate等)转成float64
+
+key由源文件(基础文件和增量片段)的路径, mtime和size计算, 源文件变化后自动重建
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from Data import parquet_fragments
+from Data.catalog import DataCatalog, KINDS, symbol_kind
+
+CACHE_VERSION = 1
+TS_COLUMN = "ts"
+
+
+def source_key(path):
+    """源数据集(基础文件 + 片段)的路径/mtime/size的hash"""
+    digest = hashlib.sha1(f"v{CACHE_VERSION}".encode())
+    for file in parquet_fragments.dataset_files(path):
+        stat = os.stat(file)
+        digest.update(f"{os.path.abspath(file)}|{stat.st_mtime_ns}|{stat.st_size}".encode())
+    return digest.hexdigest()[:16]
+
+
+def _timestamp_strings(column):
+    """timestamp列统一成'YYYY-mm-dd HH:MM:SS'字符串"""
+    if pa.types.is_timestamp(column.type) or pa.types.is_date(column.type):
+        column = pc.strftime(pc.cast(column, pa.timestamp("s"), safe=False), format="%Y-%m-%d %H:%M:%S")
+    elif not pa.types.is_string(column.type) and not pa.types.is_large_string(column.type):
+        column = column.cast(pa.string())
+    return np.asarray(column.to_numpy(zero_copy_only=False), dtype=str)
+
+
+def _column_array(column):
+    if pa.types.is_integer(column.type) or pa.types.is_floating(column.type) or pa.types.is_boolean(column.type):
+        return column.to_numpy()
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        try:
+            return column.cast(pa.float64()).to_numpy()
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            return np.asarray(column.to_numpy(zero_copy_only=False), dtype=str)
+    return np.asarray(column.to_numpy(zero_copy_only=False))
+
+
+def table_to_arrays(table, key):
+    """
+    Arrow Table -> {列名: 连续的numpy数组}, 额外增加int64的ts列
+    :return: (列名列表(与源文件相同的顺序), 数组字典)
+    """
+    arrays = {TS_COLUMN: np.ascontiguousarray(table[key].to_numpy().astype(np.int64))}
+    for name in table.column_names:
+        column = table[name].combine_chunks() if table.num_rows else table[name]
+        arrays[name] = _timestamp_strings(column) if name == "timestamp" else _column_array(column)
+    return list(table.column_names), arrays
+
+
+class BarCache(object):
+    """
+    symbol -> mmap的numpy数组
+    路径由DataCatalog解析; 缓存不存在或源文件变化时从parquet重建
+    """
+
+    def __init__(self, cache_dir, catalog=None):
+        self.cache_dir = cache_dir
+        self.catalog = catalog or DataCatalog()
+
+    @classmethod
+    def from_config(cls, config, catalog=None):
+        """config['bar_cache_dir']为空时不使用缓存, 返回None"""
+        cache_dir = config.get('bar_cache_dir')
+        if not cache_dir:
+            return None
+        return cls(cache_dir, catalog or DataCatalog.from_config(config))
+
+    def directory(self, symbol):
+        return os.path.join(self.cache_dir, symbol, source_key(self.catalog.path(symbol)))
+
+    def build(self, symbol):
+        """
+        从parquet重建symbol的缓存, 先写临时目录再改名, 并删除该symbol的旧缓存
+        多个进程同时重建时, 其它进程已经生成的完整缓存(有meta.json)视为成功
+        """
+        path = self.catalog.path(symbol)
+        key = KINDS[symbol_kind(symbol)][0]
+        directory = self.directory(symbol)
+        table = parquet_fragments.read_table(path, key=key)
+        columns, arrays = table_to_arrays(table, key)
+        timestamp = arrays["timestamp"]
+
+        symbol_dir = os.path.dirname(directory)
+        os.makedirs(symbol_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=".build-", dir=symbol_dir)
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), array, allow_pickle=False)
+            meta = {
+                "version": CACHE_VERSION,
+                "symbol": symbol,
+                "source": path,
+                "key": key,
+                "columns": columns,
+                "rows": int(len(timestamp)),
+                "sorted": bool(np.all(timestamp[1:] >= timestamp[:-1])),
+            }
+            with open(os.path.join(tmp_dir, "meta.json"), 'w') as f:
+                json.dump(meta, f)
+            if not self._complete(directory):
+                # 没有meta.json的目录不是由改名生成的(不完整), 直接删除
+                shutil.rmtree(directory, ignore_errors=True)
+                try:
+                    os.replace(tmp_dir, directory)
+                except OSError:
+                    # 其它进程先完成了改名(目录非空)
+                    if not self._complete(directory):
+                        raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        for name in os.listdir(symbol_dir):
+            old = os.path.join(symbol_dir, name)
+            if old != directory and not name.startswith(".build-"):
+                shutil.rmtree(old, ignore_errors=True)
+        return directory
+
+    @staticmethod
+    def _complete(directory):
+        return os.path.exists(os.path.join(directory, "meta.json"))
+
+    def load(self, symbol):
+        """
+        :return: (meta, {列名: np.memmap}), 包含ts列
+        """
+        directory = self.directory(symbol)
+        meta_path = os.path.join(directory, "meta.json")
+        if not os.path.exists(meta_path):
+            self.build(symbol)
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r', allow_pickle=False)
+                  for name in [TS_COLUMN] + meta["columns"]}
+        return meta, arrays
+
+    def window(self, symbol, start, end):
+        """
+        timestamp在[start, end]内的数据('YYYY-mm-dd HH:MM:SS', 与直接读parquet时的过滤相同)
+        timestamp有序时用二分查找切片(不复制)
+        :return: (列名列表, {列名: 数组})
+        """
+        meta, arrays = self.load(symbol)
+        timestamp = arrays["timestamp"]
+        if meta["sorted"]:
+            lo = int(np.searchsorted(timestamp, start, side='left'))
+            hi = int(np.searchsorted(timestamp, end, side='right'))
+            return meta["columns"], {name: array[lo:hi] for name, array in arrays.items()}
+        index = np.where((timestamp >= start) & (timestamp <= end))[0]
+        return meta["columns"], {name: array[index] for name, array in arrays.items()}
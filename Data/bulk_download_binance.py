@@ -3,9 +3,14 @@ import datetime
 import os
 import shutil
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 
-from Data.DataDownloader import download_and_unzip
-from Data.download_funding_rate import download_all_funding
+from Data.DataDownloader import BASE_URL, download_archives
+from Data.download_funding_rate import download_funding_many, funding_file
+from Data import parquet_fragments
 
 """
 This script is supposed to be running manually when we want to add one type 
@@ -14,6 +19,12 @@ of one contract that does not already exist.
 example command to use:
 assume you are in MFB dir, and venv is also in current dir
 sudo -u vpnjob env PYTHONPATH=. ./venv/bin/python3 ./Data/bulk_download_binance.py --start_date 2019-12-01 --symbols BTCUSDT BTCUSDC
+
+keep existing files current (only archives after the last stored open_time are fetched and appended as fragments):
+sudo -u vpnjob env PYTHONPATH=. ./venv/bin/python3 ./Data/bulk_download_binance.py --update --symbols BTCUSDT BTCUSDC
+
+merge the appended fragments back into one parquet file:
+sudo -u vpnjob env PYTHONPATH=. ./venv/bin/python3 ./Data/bulk_download_binance.py --mode compact --symbols BTCUSDT BTCUSDC
 """
 
 COLUMNS = [
@@ -22,136 +33,237 @@ COLUMNS = [
     "taker_buy_volume", "taker_buy_quote_volume", "ignore"
 ]
 
+# 与之前pandas推断出的类型一致, 增量片段可以直接和旧文件拼接
+KLINE_SCHEMA = pa.schema([
+    ("open_time", pa.int64()), ("open", pa.float64()), ("high", pa.float64()), ("low", pa.float64()),
+    ("close", pa.float64()), ("volume", pa.float64()), ("close_time", pa.int64()),
+    ("quote_volume", pa.float64()), ("count", pa.int64()), ("taker_buy_volume", pa.float64()),
+    ("taker_buy_quote_volume", pa.float64()), ("ignore", pa.int64()),
+])
+ROW_GROUP_SIZE = 1 << 17
+
 def daterange(start_date, end_date):
     for n in range(int((end_date - start_date).days) + 1):
         yield start_date + datetime.timedelta(n)
 
-def load_csv_with_optional_header(path, expected_columns):
+def has_header(path, expected_columns):
+    """2022年以后的压缩包csv带表头, 之前的没有"""
     with open(path, 'r') as f:
         first_line = f.readline()
-        f.seek(0)
+    return any(col in first_line for col in expected_columns)
 
-        if any(col in first_line for col in expected_columns):
-            return pd.read_csv(f)
-        else:
-            return pd.read_csv(f, header=None, names=expected_columns)
+def load_csv_with_optional_header(path, expected_columns):
+    if has_header(path, expected_columns):
+        return pd.read_csv(path)
+    else:
+        return pd.read_csv(path, header=None, names=expected_columns)
 
-def download_history_range(market, contract, data_type, interval, symbol, start, end, extract_to):
-    temp_dir = "/tmp/binance_dl"
-    os.makedirs(temp_dir, exist_ok=True)
 
-    current = start
+def read_csv_typed(path, schema=KLINE_SCHEMA, block_size=1 << 22):
+    """
+    用pyarrow.csv.open_csv按显式schema分批读取一个csv(不推断类型)
+    :return: pa.Table, 按schema列顺序
+    """
+    read_options = pa_csv.ReadOptions(column_names=schema.names, skip_rows=int(has_header(path, schema.names)),
+                                      block_size=block_size, use_threads=False)
+    convert_options = pa_csv.ConvertOptions(column_types=dict(zip(schema.names, schema.types)))
+    reader = pa_csv.open_csv(path, read_options=read_options, convert_options=convert_options)
+    return pa.Table.from_batches(list(reader), schema=schema)
+
+
+def add_timestamp(table, time_column="open_time"):
+    """timestamp列: 毫秒时间戳 -> 'YYYY-mm-dd HH:MM:SS', 与pd.to_datetime(..., unit='ms').astype(str)一致"""
+    seconds = pc.divide(table[time_column], 1000).cast(pa.timestamp("s"))
+    return table.append_column("timestamp", pc.strftime(seconds, format="%Y-%m-%d %H:%M:%S"))
+
+
+def iter_csv_tables(files, schema=KLINE_SCHEMA, time_column="open_time"):
+    """
+    逐个压缩包读取csv, 每次只在内存中保留一个文件
+    files需按时间顺序排列; 每个表按time_column排序, 并去掉不晚于已输出数据的行, 保证整体严格递增
+    """
+    last = None
+    for path in files:
+        table = read_csv_typed(path, schema).sort_by(time_column)
+        if last is not None:
+            table = table.filter(pc.greater(table[time_column], last))
+        if table.num_rows == 0:
+            continue
+        last = table[time_column][-1]
+        yield add_timestamp(table, time_column)
+
 
-    all_files = []
+def csv_to_parquet(files, out_path, schema=KLINE_SCHEMA, time_column="open_time", row_group_size=ROW_GROUP_SIZE):
+    """
+    流式把多个csv写入一个parquet: ParquetWriter按row_group_size攒满一个row group再写, 内存与历史长度无关
+    先写临时文件再改名
+    :return: 写入的行数
+    """
+    tmp_path = f"{out_path}.tmp"
+    rows, pending = 0, []
+    writer = None
+    try:
+        for table in iter_csv_tables(files, schema, time_column):
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            pending.append(table)
+            buffered = sum(t.num_rows for t in pending)
+            if buffered >= row_group_size:
+                merged = pa.concat_tables(pending)
+                full = buffered - buffered % row_group_size
+                writer.write_table(merged.slice(0, full), row_group_size=row_group_size)
+                pending = [merged.slice(full)]
+            rows += table.num_rows
+        if writer is None:
+            return 0
+        if pending and sum(t.num_rows for t in pending):
+            writer.write_table(pa.concat_tables(pending), row_group_size=row_group_size)
+        writer.close()
+        writer = None
+        os.replace(tmp_path, out_path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return rows
+
+def history_tasks(start, end):
+    """
+    完整的月份按月下载, 最后不足一个月的部分按天下载
+    :return: [(freq, date)]
+    """
+    tasks = []
+    current = start
     while current < end:
         next_month = (current.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
-
         if next_month < end:
-            # Monthly download
-            year_month_str = current.strftime("%Y-%m")
-            try:
-                print(f"Downloading monthly: {year_month_str}")
-                download_and_unzip(
-                    market=market,
-                    contract=contract,
-                    freq='monthly',
-                    data_type=data_type,
-                    interval=interval,
-                    symbol=symbol,
-                    date=year_month_str,
-                    extract_to=temp_dir
-                )
-                for f in os.listdir(temp_dir):
-                    if f.startswith(f"{symbol}-{interval}-{year_month_str}") and f.endswith(".csv"):
-                        all_files.append(os.path.join(temp_dir, f))
-            except Exception as e:
-                print(f"Skipping {year_month_str} (monthly): {e}")
+            tasks.append(('monthly', current.strftime("%Y-%m")))
             current = next_month
         else:
-            # Final partial month — fallback to daily
-            date_str = current.strftime("%Y-%m-%d")
-            try:
-                print(f"Downloading daily: {date_str}")
-                download_and_unzip(
-                    market=market,
-                    contract=contract,
-                    freq='daily',
-                    data_type=data_type,
-                    interval=interval,
-                    symbol=symbol,
-                    date=date_str,
-                    extract_to=temp_dir
-                )
-                for f in os.listdir(temp_dir):
-                    if f.startswith(f"{symbol}-{interval}-{date_str}") and f.endswith(".csv"):
-                        all_files.append(os.path.join(temp_dir, f))
-            except Exception as e:
-                print(f"Skipping {date_str} (daily): {e}")
+            tasks.append(('daily', current.strftime("%Y-%m-%d")))
             current += datetime.timedelta(days=1)
+    return tasks
 
-    try:
-        if all_files:
-            all_files.sort()
-            dfs = [load_csv_with_optional_header(f, COLUMNS) for f in all_files]
-            combined = pd.concat(dfs)
-            combined['timestamp'] = pd.to_datetime(combined['open_time'], unit='ms').astype(str)
-            output_dir = os.path.join(extract_to, data_type, interval, symbol)
-            os.makedirs(output_dir, exist_ok=True)
-
-            out_path = os.path.join(output_dir, f"BinanceU_{symbol}_perp.parquet")
-            combined.to_parquet(out_path, index=False)
-            print(f"Combined data saved to: {out_path}")
-        else:
-            print("No files were successfully downloaded.")
-    finally:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-            print(f"Cleaned up temp directory: {temp_dir}")
 
-def download_bvol_daily(market, data_type, symbol, start, end, extract_to):
-    temp_dir = "/tmp/binance_dl"
-    os.makedirs(temp_dir, exist_ok=True)
+def symbol_temp_dir(temp_root, *keys):
+    """每个symbol/数据类型单独的下载目录, 同时下载多个symbol时互不影响; 中断后重新运行会复用已下载的文件"""
+    return os.path.join(temp_root, "-".join(str(k) for k in keys))
 
-    current = start
 
-    all_files = []
-    while current < end:
-        date_str = current.strftime("%Y-%m-%d")
-        try:
-            print(f"Downloading daily: {date_str}")
-            download_and_unzip(
-                market=market,
-                freq='daily',
-                data_type=data_type,
-                symbol=symbol,
-                date=date_str,
-                extract_to=temp_dir
-            )
-            for f in os.listdir(temp_dir):
-                if f.startswith(f"{symbol}-BVOLIndex-{date_str}") and f.endswith(".csv"):
-                    all_files.append(os.path.join(temp_dir, f))
-        except Exception as e:
-            print(f"Skipping {date_str} (daily): {e}")
-        current += datetime.timedelta(days=1)
+def _download_all(tasks, temp_dir, max_workers, base_url, verify_checksum, **kwargs):
+    files, missing, failed = download_archives(tasks, extract_to=temp_dir, max_workers=max_workers,
+                                               base_url=base_url, verify_checksum=verify_checksum, **kwargs)
+    for freq, date in missing:
+        print(f"Skipping {date} ({freq}): not found")
+    for (freq, date), e in failed.items():
+        print(f"Failed {date} ({freq}): {e}")
+    return sorted(files), failed
 
-    try:
-        if all_files:
-            all_files.sort()
-            dfs = [pd.read_csv(f) for f in all_files]
-            combined = pd.concat(dfs)
-            combined['timestamp'] = pd.to_datetime(combined['calc_time'], unit='ms').astype(str)
-            output_dir = os.path.join(extract_to, data_type, symbol)
-            os.makedirs(output_dir, exist_ok=True)
-
-            out_path = os.path.join(output_dir, f"BinanceU_{symbol}.parquet")
-            combined.to_parquet(out_path, index=False)
-            print(f"Combined data saved to: {out_path}")
+
+def kline_file(extract_to, data_type, interval, symbol):
+    return os.path.join(extract_to, data_type, interval, symbol, f"BinanceU_{symbol}_perp.parquet")
+
+
+INTERVAL_MS = {"s": 1000, "m": 60000, "h": 3600000, "d": 86400000, "w": 604800000}
+
+
+def interval_ms(interval):
+    """'1m' / '15m' / '4h' / '1d' -> 毫秒, 无法识别时返回1"""
+    unit = interval[-1:]
+    if unit not in INTERVAL_MS or not interval[:-1].isdigit():
+        return 1
+    return int(interval[:-1]) * INTERVAL_MS[unit]
+
+
+def update_start(path, start, key="open_time", interval="1m"):
+    """
+    增量更新的起始日期: 已有数据下一根bar所在的那一天(按天/月的压缩包只能整天下载, 重复的行按open_time去掉)
+    """
+    last = parquet_fragments.max_value(path, key) if parquet_fragments.exists(path) else None
+    if last is None:
+        return start
+    next_bar = datetime.datetime.fromtimestamp((last + interval_ms(interval)) / 1000, tz=datetime.timezone.utc)
+    next_day = next_bar.replace(hour=0, minute=0, second=0, microsecond=0)
+    return next_day if start is None else max(start, next_day)
+
+
+def download_history_range(market, contract, data_type, interval, symbol, start, end, extract_to,
+                           max_workers=8, base_url=BASE_URL, verify_checksum=True, temp_root="/tmp/binance_dl",
+                           update=False, row_group_size=ROW_GROUP_SIZE):
+    """
+    update=True时只下载已有数据之后的压缩包, 新数据作为片段追加(见Data/parquet_fragments.py), 否则整体重写
+    csv逐个流式转换为parquet(csv_to_parquet), 不会把整个历史读入内存
+    """
+    out_path = kline_file(extract_to, data_type, interval, symbol)
+    if update:
+        start = update_start(out_path, start, interval=interval)
+        if start is None:
+            raise ValueError(f"{out_path} has no data yet, --start_date is required for the first download")
+        if start >= end:
+            print(f"{out_path} is up to date")
+            return out_path
+
+    temp_dir = symbol_temp_dir(temp_root, market, contract, data_type, interval, symbol)
+    all_files, failed = _download_all(history_tasks(start, end), temp_dir, max_workers, base_url, verify_checksum,
+                                      market=market, contract=contract, data_type=data_type,
+                                      interval=interval, symbol=symbol)
+    if failed:
+        # 保留已下载的文件, 重新运行时只下载失败的部分
+        print(f"{len(failed)} files failed, keep {temp_dir} for resume")
+        return None
+
+    if all_files:
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+        if update:
+            # 增量部分只有最近几天的数据, 直接合并成一个片段
+            combined = pa.concat_tables(list(iter_csv_tables(all_files)))
+            rows = parquet_fragments.append_fragment(out_path, combined, key="open_time")
+            print(f"Appended {rows} rows to: {out_path}")
         else:
-            print("No files were successfully downloaded.")
-    finally:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-            print(f"Cleaned up temp directory: {temp_dir}")
+            rows = csv_to_parquet(all_files, out_path, row_group_size=row_group_size)
+            # 整体重写后旧的增量片段已经包含在内
+            shutil.rmtree(parquet_fragments.fragment_dir(out_path), ignore_errors=True)
+            print(f"Combined {rows} rows saved to: {out_path}")
+    else:
+        print("No files were successfully downloaded.")
+        if not update:
+            out_path = None
+
+    if os.path.exists(temp_dir):
+        shutil.rmtree(temp_dir)
+        print(f"Cleaned up temp directory: {temp_dir}")
+    return out_path
+
+def download_bvol_daily(market, data_type, symbol, start, end, extract_to,
+                        max_workers=8, base_url=BASE_URL, verify_checksum=True, temp_root="/tmp/binance_dl"):
+    temp_dir = symbol_temp_dir(temp_root, market, data_type, symbol)
+    tasks = [('daily', day.strftime("%Y-%m-%d")) for day in daterange(start, end) if day < end]
+    all_files, failed = _download_all(tasks, temp_dir, max_workers, base_url, verify_checksum,
+                                      market=market, data_type=data_type, symbol=symbol)
+    if failed:
+        print(f"{len(failed)} files failed, keep {temp_dir} for resume")
+        return None
+
+    out_path = None
+    if all_files:
+        dfs = [pd.read_csv(f) for f in all_files]
+        combined = pd.concat(dfs)
+        combined['timestamp'] = pd.to_datetime(combined['calc_time'], unit='ms').astype(str)
+        output_dir = os.path.join(extract_to, data_type, symbol)
+        os.makedirs(output_dir, exist_ok=True)
+
+        out_path = os.path.join(output_dir, f"BinanceU_{symbol}.parquet")
+        combined.to_parquet(out_path, index=False)
+        print(f"Combined data saved to: {out_path}")
+    else:
+        print("No files were successfully downloaded.")
+
+    if os.path.exists(temp_dir):
+        shutil.rmtree(temp_dir)
+        print(f"Cleaned up temp directory: {temp_dir}")
+    return out_path
 
 
 if __name__ == "__main__":
@@ -164,14 +276,32 @@ if __name__ == "__main__":
         "--symbols", nargs="+", default=["BTCUSDT"], 
         help="List of symbols to process (e.g. --symbols BTCUSDT ETHUSDT BNBUSDT)"
     )
-    parser.add_argument("--start_date", required=True, help="Start date (YYYY-MM-DD)")
+    parser.add_argument("--start_date", default=None, help="Start date (YYYY-MM-DD), optional with --update")
     parser.add_argument("--end_date", default=None, help="End date (YYYY-MM-DD)")
     parser.add_argument("--extract_to", default="/srv/data/BinanceU/")
-    parser.add_argument("--mode", default="all", choices=['klines', "bvol", 'funding', 'all'], help="Data type to download")
+    parser.add_argument("--mode", default="all", choices=['klines', "bvol", 'funding', 'all', 'compact'],
+                        help="Data type to download, or 'compact' to merge appended fragments of klines and funding")
+    parser.add_argument("--update", action="store_true",
+                        help="Only fetch data after the last stored timestamp and append it as a fragment")
+    parser.add_argument("--max_workers", type=int, default=8, help="Number of concurrent downloads")
+    parser.add_argument("--temp_root", default="/tmp/binance_dl", help="Per-symbol download dirs are created here")
+    parser.add_argument("--row_group_size", type=int, default=ROW_GROUP_SIZE, help="Rows per parquet row group")
 
     args = parser.parse_args()
 
-    start = datetime.datetime.strptime(args.start_date, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+    if args.mode == "compact":
+        for symbol in args.symbols:
+            for path, key in [(kline_file(args.extract_to, args.data_type, args.interval, symbol), "open_time"),
+                              (funding_file(symbol), "fundingTime")]:
+                rows = parquet_fragments.compact(path, key=key, row_group_size=args.row_group_size)
+                if rows is not None:
+                    print(f"Compacted {path}: {rows} rows")
+        raise SystemExit(0)
+
+    if args.start_date is None and not args.update:
+        parser.error("--start_date is required unless --update is given")
+    start = None if args.start_date is None else \
+        datetime.datetime.strptime(args.start_date, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
     if args.end_date is None:
         end = datetime.datetime.now(datetime.timezone.utc)
     else:
@@ -187,16 +317,13 @@ if __name__ == "__main__":
                 symbol=symbol,
                 start=start,
                 end=end,
-                extract_to=args.extract_to
+                extract_to=args.extract_to,
+                max_workers=args.max_workers,
+                temp_root=args.temp_root,
+                update=args.update,
+                row_group_size=args.row_group_size
             )
 
-        if args.mode in ["funding", "all"]:
-            download_all_funding(
-                symbol=symbol,
-                start=start,
-                end=end
-            )
-        
         if args.mode == "bvol":
             download_bvol_daily(
                 market=args.market,
@@ -204,5 +331,17 @@ if __name__ == "__main__":
                 symbol=symbol,
                 start=start,
                 end=end,
-                extract_to=args.extract_to
+                extract_to=args.extract_to,
+                max_workers=args.max_workers,
+                temp_root=args.temp_root
             )
+
+    if args.mode in ["funding", "all"]:
+        # 所有symbol并发拉取, 共用一个限速器
+        download_funding_many(
+            symbols=args.symbols,
+            start=start,
+            end=end,
+            update=args.update,
+            max_workers=args.max_workers
+        )
@@ -0,0 +1,273 @@
+"""
+数据目录(catalog): 扫描一次数据根目录, 把每个数据集的覆盖范围写入一个小的索引文件
+
+{root}/{exchange}/klines/1m/{pair}/{symbol}.parquet     kline, key = open_time
+{root}/{exchange}/funding/{symbol}.parquet              funding, key = fundingTime
+
+每个数据集(基础文件 + 增量片段, 见Data/parquet_fragments.py)记录:
+symbol, kind, 路径, 最小/最大时间, 行数, 每个row group的边界, 缺失的区间(gap), 内容hash, 以及文件的mtime/size
+回测启动时直接读取索引: 解析路径, 检查覆盖范围, 只读取与回测区间重叠的row group
+
+用法: PYTHONPATH=. python Data/catalog.py --root /srv/data
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from Data import parquet_fragments
+from Utils.util import split_symbol
+
+DATA_ROOT = "/srv/data"
+CATALOG_FILE = "catalog.json"
+CATALOG_VERSION = 1
+# kind -> (key, 相邻两条数据的正常间隔(毫秒), 超过则记为gap)
+KINDS = {
+    "kline": ("open_time", 60 * 1000),
+    "funding": ("fundingTime", 8 * 3600 * 1000),
+}
+
+
+def default_path(symbol, root=DATA_ROOT):
+    """没有catalog时按约定的目录结构拼接路径"""
+    parse_symbol = split_symbol(symbol)
+    if parse_symbol['tag'] == 'funding':
+        return f"{root}/{parse_symbol['exchange']}/funding/{symbol}.parquet"
+    return f"{root}/{parse_symbol['exchange']}/klines/1m/{parse_symbol['pair']}/{symbol}.parquet"
+
+
+def symbol_kind(symbol):
+    return "funding" if split_symbol(symbol)['tag'] == 'funding' else "kline"
+
+
+def to_ms(timestamp):
+    """'YYYY-mm-dd HH:MM:SS'(UTC) -> 毫秒时间戳"""
+    return int(pd.Timestamp(timestamp).value // 10 ** 6)
+
+
+def to_str(ms):
+    return pd.to_datetime(ms, unit='ms').strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _stat(files):
+    return [[os.path.basename(f), os.path.getmtime(f), os.path.getsize(f)] for f in files]
+
+
+def _content_hash(files):
+    digest = hashlib.sha256()
+    for file in files:
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_dataset(path, symbol, kind):
+    """
+    扫描一个数据集, 只读取key列
+    :return: catalog条目(dict), 数据集为空时返回None
+    """
+    key, interval = KINDS[kind]
+    files = parquet_fragments.dataset_files(path)
+    row_groups = []
+    for file in files:
+        metadata = pq.ParquetFile(file).metadata
+        index = metadata.schema.to_arrow_schema().get_field_index(key)
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            stats = row_group.column(index).statistics
+            if stats is None or not stats.has_min_max:
+                column = pq.ParquetFile(file).read_row_group(i, columns=[key])[key].to_numpy()
+                low, high = (int(column.min()), int(column.max())) if len(column) else (None, None)
+            else:
+                low, high = int(stats.min), int(stats.max)
+            row_groups.append({"file": os.path.basename(file), "index": i, "rows": row_group.num_rows,
+                               "min": low, "max": high})
+
+    keys = parquet_fragments.read_table(path, key=key, columns=[key])[key].to_numpy().astype(np.int64)
+    if len(keys) == 0:
+        return None
+    keys = np.unique(keys)
+    diff = np.diff(keys)
+    gap_index = np.where(diff > interval)[0]
+    return {
+        "symbol": symbol,
+        "kind": kind,
+        "path": path,
+        "key": key,
+        "interval": interval,
+        "min": int(keys[0]),
+        "max": int(keys[-1]),
+        "start": to_str(int(keys[0])),
+        "end": to_str(int(keys[-1])),
+        "rows": int(len(keys)),
+        "row_groups": row_groups,
+        # [上一条数据的时间, 下一条数据的时间]
+        "gaps": [[int(keys[i]), int(keys[i + 1])] for i in gap_index],
+        "hash": _content_hash(files),
+        "files": _stat(files),
+    }
+
+
+def discover(root=DATA_ROOT):
+    """:return: [(symbol, kind, path)]"""
+    datasets = []
+    for path in sorted(glob.glob(os.path.join(root, "*", "klines", "1m", "*", "*.parquet"))):
+        datasets.append((os.path.basename(path)[:-len(".parquet")], "kline", path))
+    for path in sorted(glob.glob(os.path.join(root, "*", "funding", "*.parquet"))):
+        datasets.append((os.path.basename(path)[:-len(".parquet")], "funding", path))
+    return datasets
+
+
+def is_fresh(entry):
+    """数据集的文件列表, mtime和size都与建索引时一致"""
+    path = entry["path"]
+    files = parquet_fragments.dataset_files(path)
+    return _stat(files) == entry["files"]
+
+
+def build_catalog(root=DATA_ROOT, index_path=None, rescan=False):
+    """
+    扫描root并写入索引文件; 已有索引中文件没有变化的数据集直接复用, 不重新读取
+    :return: DataCatalog
+    """
+    index_path = index_path or os.path.join(root, CATALOG_FILE)
+    previous = DataCatalog.load(index_path).entries if os.path.exists(index_path) and not rescan else dict()
+    entries = dict()
+    for symbol, kind, path in discover(root):
+        entry = previous.get(symbol)
+        if entry is None or entry["path"] != path or not is_fresh(entry):
+            entry = scan_dataset(path, symbol, kind)
+        if entry is not None:
+            entries[symbol] = entry
+
+    catalog = DataCatalog(entries, root=root, index_path=index_path)
+    catalog.save()
+    return catalog
+
+
+class DataCatalog(object):
+    """
+    读取catalog索引, 解析数据路径/检查覆盖范围/裁剪row group
+    索引中没有的symbol按默认目录结构解析路径, 读取时退回到整个文件
+    """
+
+    def __init__(self, entries=None, root=DATA_ROOT, index_path=None):
+        self.entries = entries or dict()
+        self.root = root
+        self.index_path = index_path or os.path.join(root, CATALOG_FILE)
+
+    @classmethod
+    def load(cls, index_path, root=None):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if index.get("version") != CATALOG_VERSION:
+            raise ValueError(f"unsupported catalog version in {index_path}: {index.get('version')}")
+        return cls(index["entries"], root=root or index["root"], index_path=index_path)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        config['data_root'] 数据根目录, config['data_catalog'] 索引文件(默认{data_root}/catalog.json)
+        索引不存在时返回空的catalog, 行为与之前按固定路径读取相同
+        """
+        root = config.get('data_root', DATA_ROOT)
+        index_path = config.get('data_catalog') or os.path.join(root, CATALOG_FILE)
+        if os.path.exists(index_path):
+            return cls.load(index_path, root=root)
+        return cls(root=root, index_path=index_path)
+
+    def save(self):
+        index = {"version": CATALOG_VERSION, "root": self.root, "entries": self.entries}
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def symbols(self, kind=None):
+        return [s for s, e in self.entries.items() if kind is None or e["kind"] == kind]
+
+    def entry(self, symbol):
+        return self.entries.get(symbol)
+
+    def path(self, symbol):
+        entry = self.entries.get(symbol)
+        return entry["path"] if entry is not None else default_path(symbol, self.root)
+
+    def overlaps(self, symbol, start, end):
+        """数据集与[start, end]是否有交集; 不在catalog中或文件已变化时返回True(交给读取时处理)"""
+        entry = self.entries.get(symbol)
+        if entry is None or not is_fresh(entry):
+            return True
+        return entry["start"] <= end and entry["end"] >= start
+
+    def validate(self, symbols, start, end):
+        """
+        检查每个symbol在[start, end]内的覆盖情况, 只读索引; 文件已变化的数据集索引不可信, 只检查文件是否存在
+        :return: 问题描述列表, 为空表示全部覆盖且没有gap
+        """
+        start_ms, end_ms = to_ms(start), to_ms(end)
+        issues = []
+        for symbol in symbols:
+            entry = self.entries.get(symbol)
+            if entry is None or not is_fresh(entry):
+                if not os.path.exists(self.path(symbol)):
+                    issues.append(f"{symbol}: 数据文件不存在 {self.path(symbol)}")
+                continue
+            tolerance = entry["interval"]
+            if entry["min"] - tolerance > start_ms or entry["max"] + tolerance < end_ms:
+                issues.append(f"{symbol}: 数据范围[{entry['start']}, {entry['end']}]没有覆盖[{start}, {end}]")
+            gaps = [g for g in entry["gaps"] if g[1] > start_ms and g[0] < end_ms]
+            if gaps:
+                first = gaps[0]
+                issues.append(f"{symbol}: [{start}, {end}]内有{len(gaps)}处缺失, "
+                              f"第一处 {to_str(first[0])} -> {to_str(first[1])}")
+        return issues
+
+    def row_groups(self, symbol, start, end):
+        """
+        与[start, end]重叠的row group
+        :return: {文件路径: [row group序号]}, 不在catalog中或文件已变化时返回None
+        """
+        entry = self.entries.get(symbol)
+        if entry is None or not is_fresh(entry):
+            return None
+        start_ms, end_ms = to_ms(start), to_ms(end)
+        directory = {os.path.basename(f): f for f in parquet_fragments.dataset_files(entry["path"])}
+        selection = dict()
+        for rg in entry["row_groups"]:
+            if rg["min"] is None or rg["max"] < start_ms or rg["min"] > end_ms:
+                continue
+            selection.setdefault(directory[rg["file"]], []).append(rg["index"])
+        return selection
+
+    def read_table(self, symbol, start=None, end=None, columns=None):
+        """
+        读取symbol的数据(包含增量片段), 给出start/end时只读取重叠的row group
+        返回的行仍可能超出[start, end], 由调用方按timestamp过滤
+        """
+        path = self.path(symbol)
+        key = KINDS[symbol_kind(symbol)][0]
+        selection = None if start is None or end is None else self.row_groups(symbol, start, end)
+        if selection is None:
+            return parquet_fragments.read_table(path, key=key, columns=columns)
+        return parquet_fragments.read_row_groups(path, selection, key=key, columns=columns)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan the data root and write the data catalog.")
+    parser.add_argument("--root", default=DATA_ROOT)
+    parser.add_argument("--index", default=None, help="Catalog file, default {root}/catalog.json")
+    parser.add_argument("--rescan", action="store_true", help="Rescan every dataset even if unchanged")
+    args = parser.parse_args()
+
+    catalog = build_catalog(args.root, args.index, rescan=args.rescan)
+    for symbol, entry in sorted(catalog.entries.items()):
+        print(f"{symbol:40s} {entry['kind']:8s} {entry['start']} -> {entry['end']} "
+              f"rows={entry['rows']} row_groups={len(entry['row_groups'])} gaps={len(entry['gaps'])}")
+    print(f"Catalog saved to: {catalog.index_path}")
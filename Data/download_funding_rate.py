@@ -1,11 +1,61 @@
 import requests
 import pandas as pd
+import threading
 import time
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
-def get_funding_history(symbol, start_time=None, end_time=None, limit=1000):
-    url = "https://fapi.binance.com/fapi/v1/fundingRate"
+from Data import parquet_fragments
+from Data.DataDownloader import _session
+
+FAPI_URL = "https://fapi.binance.com"
+# /fapi/v1/fundingRate 与 /fapi/v1/fundingInfo 共用 500次/5分钟/IP 的限制
+# 桶容量 + 5分钟内补充的令牌数 = 500, 任意5分钟窗口内都不会超过限制
+FUNDING_RATE_LIMIT = (480 / 300, 20)
+RETRY_STATUS = (418, 429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶: 每秒补充rate个令牌, 最多积累capacity个
+    acquire先预约令牌(余额可以为负), 再在锁外等待到预约的时刻, 并发请求按到达顺序排队
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """:return: 等待的秒数"""
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+
+class FundingFetchError(RuntimeError):
+    pass
+
+
+def get_funding_history(symbol, start_time=None, end_time=None, limit=1000, base_url=FAPI_URL,
+                        limiter=None, retries=5, timeout=30):
+    """
+    拉取一页资金费率
+    429/418(超限)和5xx按Retry-After或指数退避重试, 其它错误直接抛出FundingFetchError
+    :param limiter: TokenBucket, 每个请求消耗一个令牌
+    """
     params = {
         "symbol": symbol,
         "limit": limit
@@ -15,41 +65,115 @@ def get_funding_history(symbol, start_time=None, end_time=None, limit=1000):
     if end_time is not None:
         params["endTime"] = end_time
 
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Error {response.status_code}: {response.text}")
-        return []
+    for attempt in range(1, retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            response = _session().get(f"{base_url}/fapi/v1/fundingRate", params=params, timeout=timeout)
+        except requests.RequestException as e:
+            if attempt == retries:
+                raise FundingFetchError(f"{symbol}: {e}") from e
+            time.sleep(min(2 ** (attempt - 1), 30))
+            continue
+        if response.status_code == 200:
+            return response.json()
+        if response.status_code not in RETRY_STATUS or attempt == retries:
+            raise FundingFetchError(f"{symbol}: error {response.status_code}: {response.text}")
+        retry_after = response.headers.get("Retry-After")
+        time.sleep(float(retry_after) if retry_after else min(2 ** (attempt - 1), 30))
 
 
-def download_all_funding(symbol: str, start: datetime, end: datetime):
-    if end is None:
-        end = datetime.now(timezone.utc).date()
-
-    start_time = int(start.timestamp() * 1000)  # Binance futures start
-    end_time = int(end.timestamp() * 1000)
-    funding_path = "/srv/data/BinanceU/funding"
-    os.makedirs(funding_path, exist_ok=True)
-    out_path = f"{funding_path}/Funding_BinanceU_{symbol}_perp.parquet"
+def fetch_funding(symbol, start_time, end_time, limit=1000, **kwargs):
+    """按fundingTime翻页拉取[start_time, end_time]内的全部资金费率"""
     all_data = []
-
     while start_time < end_time:
-        data = get_funding_history(symbol, start_time=start_time, end_time=end_time)
+        data = get_funding_history(symbol, start_time=start_time, end_time=end_time, limit=limit, **kwargs)
         if not data:
             break
 
         all_data.extend(data)
-        last_time = int(data[-1]['fundingTime'])
-
-        # Avoid tight looping, and move to next batch
-        start_time = last_time + 1
-        time.sleep(0.2)
-
-    if all_data:
-        df = pd.DataFrame(all_data)
-        df['timestamp'] = pd.to_datetime(df['fundingTime'], unit='ms').dt.strftime("%Y-%m-%d %H:%M:%S")
-        df.to_parquet(out_path, index=False)
-        print(f"Saved {len(df)} funding rate records to: {out_path}")
-    else:
-        print("No funding data retrieved.")
+        # move to next batch
+        start_time = int(data[-1]['fundingTime']) + 1
+        if len(data) < limit:
+            break
+    return all_data
+
+
+FUNDING_PATH = "/srv/data/BinanceU/funding"
+
+
+def funding_file(symbol, funding_path=FUNDING_PATH):
+    return f"{funding_path}/Funding_BinanceU_{symbol}_perp.parquet"
+
+
+def funding_start_time(out_path, start, update):
+    """起始时间(毫秒): update=True时取已有数据最后一个fundingTime之后"""
+    start_time = None if start is None else int(start.timestamp() * 1000)  # Binance futures start
+    if update and parquet_fragments.exists(out_path):
+        last = parquet_fragments.max_value(out_path, "fundingTime")
+        if last is not None:
+            start_time = int(last) + 1 if start_time is None else max(start_time, int(last) + 1)
+    return 0 if start_time is None else start_time
+
+
+def save_funding(out_path, all_data, update):
+    """:return: 写入的行数"""
+    if not all_data:
+        print(f"No funding data retrieved for {out_path}.")
+        return 0
+    df = pd.DataFrame(all_data)
+    df['timestamp'] = pd.to_datetime(df['fundingTime'], unit='ms').dt.strftime("%Y-%m-%d %H:%M:%S")
+    if update:
+        rows = parquet_fragments.append_fragment(out_path, df, key="fundingTime")
+        print(f"Appended {rows} funding rate records to: {out_path}")
+        return rows
+    df.to_parquet(out_path, index=False)
+    # 整体重写后旧的增量片段已经包含在内
+    shutil.rmtree(parquet_fragments.fragment_dir(out_path), ignore_errors=True)
+    print(f"Saved {len(df)} funding rate records to: {out_path}")
+    return len(df)
+
+
+def download_all_funding(symbol: str, start: datetime, end: datetime, update=False, funding_path=FUNDING_PATH,
+                         limiter=None, base_url=FAPI_URL, retries=5):
+    """
+    update=True时从已有数据的最后一个fundingTime之后开始拉取, 新数据作为片段追加(见Data/parquet_fragments.py)
+    :return: 写入的行数
+    """
+    if end is None:
+        end = datetime.now(timezone.utc)
+    if limiter is None:
+        limiter = TokenBucket(*FUNDING_RATE_LIMIT)
+
+    os.makedirs(funding_path, exist_ok=True)
+    out_path = funding_file(symbol, funding_path)
+    start_time = funding_start_time(out_path, start, update)
+    end_time = int(end.timestamp() * 1000)
+    all_data = fetch_funding(symbol, start_time, end_time, limiter=limiter, base_url=base_url, retries=retries)
+    return save_funding(out_path, all_data, update)
+
+
+def download_funding_many(symbols, start=None, end=None, update=True, funding_path=FUNDING_PATH, max_workers=4,
+                          limiter=None, base_url=FAPI_URL, retries=5):
+    """
+    并发拉取多个symbol的资金费率, 所有线程共用一个令牌桶, 总请求频率不超过FUNDING_RATE_LIMIT
+    单个symbol失败不影响其它symbol
+    :return: ({symbol: 写入的行数}, {symbol: 异常})
+    """
+    if limiter is None:
+        limiter = TokenBucket(*FUNDING_RATE_LIMIT)
+
+    def run(symbol):
+        return download_all_funding(symbol, start, end, update=update, funding_path=funding_path,
+                                    limiter=limiter, base_url=base_url, retries=retries)
+
+    written, failed = dict(), dict()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {symbol: pool.submit(run, symbol) for symbol in symbols}
+        for symbol, future in futures.items():
+            try:
+                written[symbol] = future.result()
+            except Exception as e:
+                print(f"Failed funding {symbol}: {e}")
+                failed[symbol] = e
+    return written, failed
@@ -0,0 +1,162 @@
+"""
+追加写入的parquet数据集: 基础文件 + 同名.d目录下的增量片段
+
+/srv/data/BinanceU/klines/1m/BTCUSDT/BinanceU_BTCUSDT_perp.parquet        基础文件
+/srv/data/BinanceU/klines/1m/BTCUSDT/BinanceU_BTCUSDT_perp.parquet.d/    增量片段
+    part-{第一个key}-{最后一个key}.parquet
+
+增量更新只写新的片段, 读取时按key(open_time / fundingTime)去重排序; compact把片段合并回基础文件
+"""
+import os
+import glob
+from io import BytesIO
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+FRAGMENT_SUFFIX = ".d"
+
+
+def fragment_dir(path):
+    return f"{path}{FRAGMENT_SUFFIX}"
+
+
+def list_fragments(path):
+    """按写入顺序(文件名中的key)排列的片段路径"""
+    def first_key(fragment):
+        return int(os.path.basename(fragment).split("-")[1])
+    return sorted(glob.glob(os.path.join(fragment_dir(path), "part-*.parquet")), key=first_key)
+
+
+def dataset_files(path):
+    return ([path] if os.path.exists(path) else []) + list_fragments(path)
+
+
+def exists(path):
+    return len(dataset_files(path)) > 0
+
+
+def max_value(path, key="open_time"):
+    """
+    数据集中key的最大值, 只读取parquet的row group统计信息
+    :return: 数据集不存在或为空时返回None
+    """
+    result = None
+    for file in dataset_files(path):
+        metadata = pq.ParquetFile(file).metadata
+        index = metadata.schema.to_arrow_schema().get_field_index(key)
+        for i in range(metadata.num_row_groups):
+            stats = metadata.row_group(i).column(index).statistics
+            if stats is None or not stats.has_min_max:
+                # 没有统计信息时读取该列
+                column = pq.read_table(file, columns=[key])[key]
+                value = pc.max(column).as_py()
+            else:
+                value = stats.max
+            if value is not None and (result is None or value > result):
+                result = value
+    return result
+
+
+def _write_atomic(table, path, **kwargs):
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def append_fragment(path, table, key="open_time"):
+    """
+    追加新数据: 只保留key大于现有最大值的行(批内按key去重),写成一个新片段; 数据集不存在时直接写基础文件
+    :param table: pa.Table或pd.DataFrame
+    :return: 写入的行数
+    """
+    if not isinstance(table, pa.Table):
+        table = pa.Table.from_pandas(table, preserve_index=False)
+    last = max_value(path, key)
+    if last is not None:
+        table = table.filter(pc.greater(table[key], pa.scalar(last, table.schema.field(key).type)))
+        # 片段与基础文件保持相同的schema, 读取时可以直接拼接
+        table = table.cast(_base_schema(path), safe=False)
+    table = _dedup(table, key)
+    if table.num_rows == 0:
+        return 0
+
+    if not exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        _write_atomic(table, path)
+    else:
+        os.makedirs(fragment_dir(path), exist_ok=True)
+        first, last = pc.min(table[key]).as_py(), pc.max(table[key]).as_py()
+        _write_atomic(table, os.path.join(fragment_dir(path), f"part-{first}-{last}.parquet"))
+    return table.num_rows
+
+
+def _base_schema(path):
+    files = dataset_files(path)
+    if not files:
+        return None
+    return pq.read_schema(files[0]).remove_metadata()
+
+
+def _dedup(table, key):
+    """按key去重(保留最后出现的行)并排序"""
+    if table.num_rows == 0:
+        return table
+    table = table.append_column("__row", pa.array(range(table.num_rows), pa.int64()))
+    last_rows = table.group_by(key).aggregate([("__row", "max")])["__row_max"]
+    table = table.take(last_rows).drop_columns(["__row"])
+    return table.sort_by(key)
+
+
+def read_table(path, key="open_time", columns=None):
+    """
+    读取基础文件和全部片段; 没有片段时与直接读取基础文件相同(不排序不去重)
+    """
+    fragments = list_fragments(path)
+    if not fragments:
+        with open(path, 'rb') as f:
+            return pq.ParquetFile(BytesIO(f.read())).read(columns=columns, use_threads=False)
+
+    schema = _base_schema(path)
+    tables = [pq.read_table(file, columns=columns, use_threads=False).cast(
+        schema if columns is None else pa.schema([schema.field(c) for c in columns]), safe=False)
+        for file in dataset_files(path)]
+    table = pa.concat_tables(tables)
+    if key in table.column_names:
+        table = _dedup(table, key)
+    return table
+
+
+def read_row_groups(path, selection, key="open_time", columns=None):
+    """
+    只读取选中的row group(例如按catalog里记录的边界裁剪时间范围)
+    :param selection: {文件路径: [row group序号]}, 文件为基础文件或片段
+    """
+    schema = _base_schema(path)
+    if columns is not None:
+        schema = pa.schema([schema.field(c) for c in columns])
+    tables = [pq.ParquetFile(file).read_row_groups(indices, columns=columns, use_threads=False).cast(
+        schema, safe=False) for file, indices in selection.items() if indices]
+    if not tables:
+        return schema.empty_table()
+    table = pa.concat_tables(tables)
+    if len(tables) > 1 and key in table.column_names:
+        table = _dedup(table, key)
+    return table
+
+
+def compact(path, key="open_time", row_group_size=None):
+    """
+    把片段合并回基础文件(去重排序)并删除片段
+    :return: 合并后的行数, 没有片段时返回None
+    """
+    fragments = list_fragments(path)
+    if not fragments:
+        return None
+    table = read_table(path, key=key)
+    _write_atomic(table, path, row_group_size=row_group_size)
+    for fragment in fragments:
+        os.remove(fragment)
+    os.rmdir(fragment_dir(path))
+    return table.num_rows
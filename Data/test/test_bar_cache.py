@@ -0,0 +1,122 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from Data import parquet_fragments
+from Data.bar_cache import BarCache
+from Data.catalog import DataCatalog, default_path, to_ms
+from Utils.util import parse_pyarrow_table
+
+KLINE = "BinanceU_BTCUSDT_perp"
+FUNDING = "Funding_BinanceU_BTCUSDT_perp"
+START = to_ms("2024-01-01 00:00:00")
+
+
+def write_klines(root, n, offset=0):
+    path = default_path(KLINE, str(root))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open_time = START + (offset + np.arange(n, dtype=np.int64)) * 60000
+    df = pd.DataFrame({"open_time": open_time, "open": np.linspace(1, 2, n), "close": np.linspace(2, 3, n),
+                       "count": np.arange(n), "timestamp": pd.to_datetime(open_time, unit="ms").astype(str)})
+    df.to_parquet(path, index=False)
+    return path
+
+
+def make_cache(tmp_path):
+    return BarCache(str(tmp_path / "cache"), DataCatalog(root=str(tmp_path / "data")))
+
+
+def test_cache_matches_parquet_and_is_mmapped(tmp_path):
+    path = write_klines(tmp_path / "data", 500)
+    cache = make_cache(tmp_path)
+    meta, arrays = cache.load(KLINE)
+    assert meta["columns"] == ["open_time", "open", "close", "count", "timestamp"]
+    assert meta["rows"] == 500 and meta["sorted"]
+    assert isinstance(arrays["close"], np.memmap)
+    assert arrays["ts"].dtype == np.int64 and arrays["count"].dtype == np.int64
+
+    expected = parse_pyarrow_table(pq.read_table(path))
+    for name in meta["columns"]:
+        np.testing.assert_array_equal(arrays[name], expected[name])
+
+
+def test_window_matches_timestamp_filter(tmp_path):
+    path = write_klines(tmp_path / "data", 500)
+    cache = make_cache(tmp_path)
+    start, end = "2024-01-01 01:00:00", "2024-01-01 02:30:00"
+    columns, window = cache.window(KLINE, start, end)
+    expected = pd.read_parquet(path)
+    expected = expected[(expected["timestamp"] >= start) & (expected["timestamp"] <= end)]
+    assert len(window["timestamp"]) == len(expected) == 91
+    np.testing.assert_array_equal(window["open_time"], expected["open_time"].to_numpy())
+    assert cache.window(KLINE, "2025-01-01 00:00:00", "2025-01-02 00:00:00")[1]["close"].shape == (0,)
+
+
+def test_rebuild_when_source_changes(tmp_path):
+    data = tmp_path / "data"
+    path = write_klines(data, 100)
+    cache = make_cache(tmp_path)
+    first = cache.directory(KLINE)
+    assert cache.load(KLINE)[0]["rows"] == 100
+
+    # 追加片段
+    parquet_fragments.append_fragment(path, pd.DataFrame({
+        "open_time": [START + 100 * 60000], "open": [9.0], "close": [9.0], "count": [100],
+        "timestamp": ["2024-01-01 01:40:00"]}))
+    assert cache.directory(KLINE) != first
+    meta, arrays = cache.load(KLINE)
+    assert meta["rows"] == 101 and arrays["close"][-1] == 9.0
+    # 旧缓存被删除
+    assert os.listdir(os.path.dirname(first)) == [os.path.basename(cache.directory(KLINE))]
+
+    # 重写源文件
+    parquet_fragments.compact(path)
+    write_klines(data, 50, offset=1000)
+    assert cache.load(KLINE)[0]["rows"] == 50
+
+
+def test_funding_strings_and_datetime_timestamps(tmp_path):
+    path = default_path(FUNDING, str(tmp_path / "data"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    funding_time = START + np.arange(3, dtype=np.int64) * 8 * 3600 * 1000 + 5
+    pq.write_table(pa.table({
+        "symbol": ["BTCUSDT"] * 3,
+        "fundingTime": funding_time,
+        "fundingRate": ["0.00010000", "-0.00002000", "0.00030000"],
+        "timestamp": pa.array(funding_time, pa.timestamp("ms")),
+    }), path)
+    cache = make_cache(tmp_path)
+    columns, window = cache.window(FUNDING, "2024-01-01 00:00:00", "2024-01-01 08:00:00")
+    assert list(window["timestamp"]) == ["2024-01-01 00:00:00", "2024-01-01 08:00:00"]
+    assert window["fundingRate"].dtype == np.float64
+    np.testing.assert_allclose(window["fundingRate"], [0.0001, -0.00002])
+    assert list(window["symbol"]) == ["BTCUSDT"] * 2
+
+
+def test_concurrent_build_keeps_existing_cache(tmp_path, monkeypatch):
+    write_klines(tmp_path / "data", 100)
+    cache = make_cache(tmp_path)
+    directory = cache.build(KLINE)
+    # 缓存已经由其它进程生成: 不删除正在使用的目录
+    inode = os.stat(os.path.join(directory, "close.npy")).st_ino
+    assert cache.build(KLINE) == directory
+    assert os.stat(os.path.join(directory, "close.npy")).st_ino == inode
+
+    # 改名时其它进程刚好完成: os.replace因目录非空失败, 视为成功
+    other = make_cache(tmp_path)
+    shutil.rmtree(directory)
+    replace = os.replace
+
+    def racing_replace(src, dst):
+        shutil.copytree(src, dst)
+        return replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", racing_replace)
+    assert other.build(KLINE) == directory
+    meta, arrays = other.load(KLINE)
+    assert meta["rows"] == 100
+    assert [name for name in os.listdir(os.path.dirname(directory))] == [os.path.basename(directory)]
@@ -0,0 +1,171 @@
+import datetime
+import hashlib
+import io
+import os
+import threading
+import zipfile
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from Data.DataDownloader import build_url, download_archives, ChecksumError
+from Data.bulk_download_binance import (download_history_range, history_tasks, csv_to_parquet,
+                                        load_csv_with_optional_header, COLUMNS, KLINE_SCHEMA)
+
+UTC = datetime.timezone.utc
+
+
+class RecordingHandler(SimpleHTTPRequestHandler):
+    """记录请求路径的静态文件服务, 模拟data.binance.vision"""
+    requests = []
+
+    def do_GET(self):
+        RecordingHandler.requests.append(self.path)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    root = tmp_path / "www"
+    root.mkdir()
+    RecordingHandler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), partial(RecordingHandler, directory=str(root)))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield root, f"http://127.0.0.1:{httpd.server_address[1]}/data"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def kline_rows(start, minutes):
+    base = int(start.timestamp() * 1000)
+    return "".join(f"{base + i * 60000},1,2,0.5,1.5,10,{base + i * 60000 + 59999},15,3,4,6,0\n"
+                   for i in range(minutes))
+
+
+def publish(root, base_url, freq, date, content, symbol="BTCUSDT", checksum=None):
+    """写入zip和.CHECKSUM到服务目录"""
+    url = build_url("futures", "um", freq, "klines", "1m", symbol, date, base_url=base_url)
+    path = root / "data" / url[len(base_url):].lstrip("/")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr(path.name[:-len(".zip")] + ".csv", content)
+    path.write_bytes(buffer.getvalue())
+    digest = checksum or hashlib.sha256(buffer.getvalue()).hexdigest()
+    (path.parent / (path.name + ".CHECKSUM")).write_text(f"{digest}  {path.name}\n")
+    return url
+
+
+def test_history_tasks_monthly_then_daily():
+    tasks = history_tasks(datetime.datetime(2024, 1, 1, tzinfo=UTC), datetime.datetime(2024, 3, 3, tzinfo=UTC))
+    assert tasks == [('monthly', '2024-01'), ('monthly', '2024-02'),
+                     ('daily', '2024-03-01'), ('daily', '2024-03-02')]
+
+
+def test_download_history_range_concurrent_and_resumable(server, tmp_path):
+    root, base_url = server
+    publish(root, base_url, "monthly", "2024-01", kline_rows(datetime.datetime(2024, 1, 1, tzinfo=UTC), 3))
+    publish(root, base_url, "daily", "2024-02-01", kline_rows(datetime.datetime(2024, 2, 1, tzinfo=UTC), 2))
+    # 2024-02-02 在服务器上不存在, 跳过
+    start = datetime.datetime(2024, 1, 1, tzinfo=UTC)
+    end = datetime.datetime(2024, 2, 3, tzinfo=UTC)
+    temp_root = str(tmp_path / "dl")
+
+    out_path = download_history_range("futures", "um", "klines", "1m", "BTCUSDT", start, end,
+                                      extract_to=str(tmp_path / "out"), max_workers=4, base_url=base_url,
+                                      temp_root=temp_root)
+    df = pd.read_parquet(out_path)
+    assert list(df.columns) == COLUMNS + ["timestamp"]
+    assert len(df) == 5
+    assert df["timestamp"].iloc[0] == "2024-01-01 00:00:00"
+    # 成功后清理下载目录
+    assert os.listdir(temp_root) == []
+
+
+def test_resume_skips_existing_files(server, tmp_path):
+    root, base_url = server
+    tasks = [("daily", "2024-02-01"), ("daily", "2024-02-02")]
+    for _, date in tasks:
+        publish(root, base_url, "daily", date, kline_rows(datetime.datetime(2024, 2, 1, tzinfo=UTC), 2))
+    dest = str(tmp_path / "BTCUSDT")
+
+    files, missing, failed = download_archives(tasks, interval="1m", extract_to=dest, base_url=base_url)
+    assert len(files) == 2 and not missing and not failed
+    first_requests = len(RecordingHandler.requests)
+    assert first_requests == 4  # zip + CHECKSUM
+
+    files_again, _, _ = download_archives(tasks, interval="1m", extract_to=dest, base_url=base_url)
+    assert files_again == files
+    assert len(RecordingHandler.requests) == first_requests
+
+
+def test_checksum_mismatch_is_reported_and_keeps_temp_dir(server, tmp_path):
+    root, base_url = server
+    publish(root, base_url, "daily", "2024-02-01", kline_rows(datetime.datetime(2024, 2, 1, tzinfo=UTC), 2),
+            checksum="0" * 64)
+    files, missing, failed = download_archives([("daily", "2024-02-01")], interval="1m",
+                                               extract_to=str(tmp_path / "dl"), base_url=base_url, retries=1)
+    assert files == [] and missing == []
+    assert isinstance(failed[("daily", "2024-02-01")], ChecksumError)
+    # 校验失败的文件不会留在下载目录里
+    assert os.listdir(tmp_path / "dl") == []
+
+    out = download_history_range("futures", "um", "klines", "1m", "BTCUSDT",
+                                 datetime.datetime(2024, 2, 1, tzinfo=UTC), datetime.datetime(2024, 2, 2, tzinfo=UTC),
+                                 extract_to=str(tmp_path / "out"), base_url=base_url, temp_root=str(tmp_path / "tmp"))
+    assert out is None
+    assert os.path.isdir(tmp_path / "tmp")
+
+
+def test_symbols_use_separate_temp_dirs(server, tmp_path):
+    root, base_url = server
+    for symbol in ("BTCUSDT", "ETHUSDT"):
+        publish(root, base_url, "daily", "2024-02-01", kline_rows(datetime.datetime(2024, 2, 1, tzinfo=UTC), 2),
+                symbol=symbol)
+    start = datetime.datetime(2024, 2, 1, tzinfo=UTC)
+    end = datetime.datetime(2024, 2, 2, tzinfo=UTC)
+    results = {}
+
+    def run(symbol):
+        results[symbol] = download_history_range("futures", "um", "klines", "1m", symbol, start, end,
+                                                 extract_to=str(tmp_path / "out"), base_url=base_url,
+                                                 temp_root=str(tmp_path / "dl"))
+
+    threads = [threading.Thread(target=run, args=(s,)) for s in ("BTCUSDT", "ETHUSDT")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for symbol, path in results.items():
+        assert symbol in path
+        assert len(pd.read_parquet(path)) == 2
+
+
+def test_csv_to_parquet_matches_pandas_conversion(tmp_path):
+    jan = tmp_path / "BTCUSDT-1m-2024-01.csv"
+    jan.write_text(kline_rows(datetime.datetime(2024, 1, 31, 23, 50, tzinfo=UTC), 10))
+    # 带表头, 行顺序打乱, 第一行与上一个文件重复
+    rows = kline_rows(datetime.datetime(2024, 1, 31, 23, 59, tzinfo=UTC), 8).splitlines()
+    feb = tmp_path / "BTCUSDT-1m-2024-02-01.csv"
+    feb.write_text(",".join(COLUMNS) + "\n" + "\n".join(rows[::-1]) + "\n")
+    files = [str(jan), str(feb)]
+
+    out_path = str(tmp_path / "out.parquet")
+    assert csv_to_parquet(files, out_path, row_group_size=4) == 17
+    metadata = pq.ParquetFile(out_path).metadata
+    assert [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)] == [4, 4, 4, 4, 1]
+    assert pq.read_schema(out_path).remove_metadata() == KLINE_SCHEMA.append(pq.read_schema(out_path).field("timestamp"))
+
+    expected = pd.concat([load_csv_with_optional_header(f, COLUMNS) for f in files])
+    expected = expected.sort_values("open_time").drop_duplicates("open_time").reset_index(drop=True)
+    expected["timestamp"] = pd.to_datetime(expected["open_time"], unit="ms").astype(str)
+    # 价格是整数时pandas会推断成int64, 写入的类型以KLINE_SCHEMA为准
+    pd.testing.assert_frame_equal(pd.read_parquet(out_path), expected, check_dtype=False)
+    assert not os.path.exists(out_path + ".tmp")
@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from Data import catalog as catalog_module
+from Data import parquet_fragments
+from Data.catalog import DataCatalog, build_catalog, default_path, to_ms
+
+KLINE = "BinanceU_BTCUSDT_perp"
+FUNDING = "Funding_BinanceU_BTCUSDT_perp"
+START = to_ms("2024-01-01 00:00:00")
+
+
+def write_klines(root, minutes, row_group_size=100, symbol=KLINE):
+    path = default_path(symbol, str(root))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open_time = START + np.asarray(minutes, dtype=np.int64) * 60000
+    table = pa.table({"open_time": open_time, "close": np.arange(len(open_time), dtype=float),
+                      "timestamp": pd.to_datetime(open_time, unit="ms").astype(str)})
+    pq.write_table(table, path, row_group_size=row_group_size)
+    return path
+
+
+def write_funding(root, n):
+    path = default_path(FUNDING, str(root))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    funding_time = START + np.arange(n, dtype=np.int64) * 8 * 3600 * 1000
+    pd.DataFrame({"fundingTime": funding_time, "fundingRate": ["0.0001"] * n,
+                  "timestamp": pd.to_datetime(funding_time, unit="ms").strftime("%Y-%m-%d %H:%M:%S")}
+                 ).to_parquet(path, index=False)
+    return path
+
+
+def test_build_catalog_records_coverage(tmp_path):
+    minutes = [m for m in range(1000) if not 500 <= m < 510]
+    path = write_klines(tmp_path, minutes)
+    write_funding(tmp_path, 10)
+
+    catalog = build_catalog(str(tmp_path))
+    assert os.path.exists(tmp_path / "catalog.json")
+    assert sorted(catalog.symbols()) == sorted([KLINE, FUNDING])
+    entry = catalog.entry(KLINE)
+    assert entry["path"] == path and entry["kind"] == "kline"
+    assert entry["start"] == "2024-01-01 00:00:00" and entry["end"] == "2024-01-01 16:39:00"
+    assert entry["rows"] == 990
+    assert len(entry["row_groups"]) == 10
+    assert entry["row_groups"][5]["min"] == START + 510 * 60000
+    assert entry["gaps"] == [[START + 499 * 60000, START + 510 * 60000]]
+    assert catalog.entry(FUNDING)["gaps"] == []
+
+    loaded = DataCatalog.from_config({"data_root": str(tmp_path)})
+    assert loaded.entries == catalog.entries
+
+
+def test_rebuild_reuses_unchanged_entries(tmp_path, monkeypatch):
+    write_klines(tmp_path, range(100))
+    write_funding(tmp_path, 3)
+    build_catalog(str(tmp_path))
+
+    scanned = []
+    scan = catalog_module.scan_dataset
+    monkeypatch.setattr(catalog_module, "scan_dataset", lambda *args: scanned.append(args[1]) or scan(*args))
+    build_catalog(str(tmp_path))
+    assert scanned == []
+
+    # 追加片段后只重新扫描该数据集
+    parquet_fragments.append_fragment(default_path(KLINE, str(tmp_path)),
+                                      pd.DataFrame({"open_time": [START + 100 * 60000], "close": [100.0],
+                                                    "timestamp": ["2024-01-01 01:40:00"]}))
+    catalog = build_catalog(str(tmp_path))
+    assert scanned == [KLINE]
+    assert catalog.entry(KLINE)["rows"] == 101
+    assert len(catalog.entry(KLINE)["files"]) == 2
+
+
+def test_validate_and_overlaps(tmp_path):
+    write_klines(tmp_path, [m for m in range(1440) if m != 700])
+    catalog = build_catalog(str(tmp_path))
+    assert catalog.validate([KLINE], "2024-01-01 00:00:00", "2024-01-01 10:00:00") == []
+    issues = catalog.validate([KLINE], "2024-01-01 00:00:00", "2024-01-02 00:00:00")
+    assert len(issues) == 1 and "缺失" in issues[0]
+    issues = catalog.validate([KLINE], "2023-12-31 00:00:00", "2024-01-01 10:00:00")
+    assert len(issues) == 1 and "没有覆盖" in issues[0]
+    assert "不存在" in catalog.validate(["BinanceU_ETHUSDT_perp"], "2024-01-01 00:00:00", "2024-01-01 10:00:00")[0]
+
+    assert catalog.overlaps(KLINE, "2024-01-01 12:00:00", "2024-01-03 00:00:00")
+    assert not catalog.overlaps(KLINE, "2024-01-02 00:00:00", "2024-01-03 00:00:00")
+
+
+def test_read_table_prunes_row_groups(tmp_path):
+    path = write_klines(tmp_path, range(1000))
+    parquet_fragments.append_fragment(path, pd.DataFrame({
+        "open_time": START + np.arange(1000, 1050, dtype=np.int64) * 60000, "close": np.zeros(50),
+        "timestamp": pd.to_datetime(START + np.arange(1000, 1050) * 60000, unit="ms").astype(str)}))
+    catalog = build_catalog(str(tmp_path))
+
+    start, end = "2024-01-01 02:00:00", "2024-01-01 04:00:00"
+    assert catalog.row_groups(KLINE, start, end) == {path: [1, 2]}
+    table = catalog.read_table(KLINE, start, end)
+    assert table.num_rows == 200
+    full = parquet_fragments.read_table(path).to_pandas()
+    expected = full[(full["timestamp"] >= start) & (full["timestamp"] <= end)]
+    selected = table.to_pandas()
+    selected = selected[(selected["timestamp"] >= start) & (selected["timestamp"] <= end)]
+    pd.testing.assert_frame_equal(selected.reset_index(drop=True), expected.reset_index(drop=True))
+
+    # 跨基础文件和片段
+    table = catalog.read_table(KLINE, "2024-01-01 16:00:00", "2024-01-01 18:00:00")
+    assert table["open_time"].to_pylist() == [START + m * 60000 for m in range(900, 1050)]
+
+    # 文件变化后索引失效, 退回整个读取
+    write_klines(tmp_path, range(1200))
+    assert catalog.row_groups(KLINE, start, end) is None
+    assert catalog.read_table(KLINE, start, end).num_rows == 1200
+
+
+def test_symbols_outside_catalog_use_default_path(tmp_path):
+    catalog = DataCatalog.from_config({"data_root": str(tmp_path)})
+    assert catalog.entries == dict()
+    assert catalog.path(FUNDING) == f"{tmp_path}/BinanceU/funding/{FUNDING}.parquet"
+    path = write_klines(tmp_path, range(10))
+    assert catalog.path(KLINE) == path
+    assert catalog.read_table(KLINE, "2024-01-01 00:00:00", "2024-01-02 00:00:00").num_rows == 10
+
+
+def test_stale_entry_does_not_hide_appended_data(tmp_path):
+    path = write_klines(tmp_path, range(1000))
+    catalog = build_catalog(str(tmp_path))
+    start, end = "2024-01-01 17:00:00", "2024-01-01 20:00:00"
+    assert not catalog.overlaps(KLINE, start, end)
+    assert "没有覆盖" in catalog.validate([KLINE], start, end)[0]
+
+    # 建索引之后增量更新追加片段
+    minutes = np.arange(1000, 1200, dtype=np.int64)
+    parquet_fragments.append_fragment(path, pd.DataFrame({
+        "open_time": START + minutes * 60000, "close": np.zeros(len(minutes)),
+        "timestamp": pd.to_datetime(START + minutes * 60000, unit="ms").astype(str)}))
+    assert catalog.overlaps(KLINE, start, end)
+    assert catalog.validate([KLINE], start, end) == []
+    table = catalog.read_table(KLINE, start, end).to_pandas()
+    assert ((table["timestamp"] >= start) & (table["timestamp"] <= end)).sum() == 180
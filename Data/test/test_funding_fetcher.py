@@ -0,0 +1,158 @@
+import json
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pandas as pd
+import pytest
+
+from Data import parquet_fragments
+from Data.download_funding_rate import (TokenBucket, download_funding_many, download_all_funding, funding_file,
+                                        FundingFetchError)
+
+HOUR8 = 8 * 3600 * 1000
+START = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class FundingHandler(BaseHTTPRequestHandler):
+    """模拟 /fapi/v1/fundingRate: 每个symbol每8小时一条, 可以预设若干次失败响应"""
+    records = dict()
+    requests = []
+    failures = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        with FundingHandler.lock:
+            FundingHandler.requests.append(query)
+            status = FundingHandler.failures.pop(0) if FundingHandler.failures else 200
+        if status != 200:
+            self.send_response(status)
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        rows = [r for r in FundingHandler.records.get(query["symbol"], [])
+                if int(query.get("startTime", 0)) <= r["fundingTime"] <= int(query.get("endTime", 1 << 62))]
+        body = json.dumps(rows[:int(query.get("limit", 1000))]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def funding_records(symbol, n, start=START):
+    return [{"symbol": symbol, "fundingTime": start + i * HOUR8, "fundingRate": f"{0.0001 * (i % 7):.8f}",
+             "markPrice": f"{40000 + i:.8f}"} for i in range(n)]
+
+
+@pytest.fixture
+def fapi():
+    FundingHandler.records = dict()
+    FundingHandler.requests = []
+    FundingHandler.failures = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FundingHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_limits_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+    waits = [bucket.acquire() for _ in range(7)]
+    assert waits[:3] == [0, 0, 0]
+    assert waits[3:] == pytest.approx([0.5] * 4)
+    assert clock.now == pytest.approx(2.0)
+    # 空闲后最多积累capacity个令牌
+    clock.now += 100
+    assert [bucket.acquire() for _ in range(4)][-1] == pytest.approx(0.5)
+
+
+def test_download_many_pages_and_appends_incrementally(fapi, tmp_path):
+    symbols = ["BTCUSDT", "ETHUSDT", "SOLUSDT"]
+    for symbol in symbols:
+        FundingHandler.records[symbol] = funding_records(symbol, 25)
+    end = datetime.fromtimestamp((START + 30 * HOUR8) / 1000, tz=timezone.utc)
+    kwargs = dict(funding_path=str(tmp_path), base_url=fapi, limiter=TokenBucket(1000, 1000))
+
+    written, failed = download_funding_many(symbols, start=datetime(2024, 1, 1, tzinfo=timezone.utc), end=end,
+                                            max_workers=3, **kwargs)
+    assert failed == dict() and written == {s: 25 for s in symbols}
+    df = pd.read_parquet(funding_file("ETHUSDT", str(tmp_path)))
+    assert df["fundingTime"].tolist() == [r["fundingTime"] for r in funding_records("ETHUSDT", 25)]
+    assert df["timestamp"].iloc[1] == "2024-01-01 08:00:00"
+
+    # 新增的记录从最后一个fundingTime之后开始拉取, 只请求一次
+    FundingHandler.records["BTCUSDT"] = funding_records("BTCUSDT", 28)
+    FundingHandler.requests = []
+    written, _ = download_funding_many(["BTCUSDT"], start=None, end=end, **kwargs)
+    assert written == {"BTCUSDT": 3}
+    assert [int(q["startTime"]) for q in FundingHandler.requests] == [START + 24 * HOUR8 + 1]
+    table = parquet_fragments.read_table(funding_file("BTCUSDT", str(tmp_path)), key="fundingTime")
+    assert table.num_rows == 28
+
+
+def test_full_download_drops_old_fragments(fapi, tmp_path):
+    FundingHandler.records["BTCUSDT"] = funding_records("BTCUSDT", 25)
+    end = datetime.fromtimestamp((START + 30 * HOUR8) / 1000, tz=timezone.utc)
+    kwargs = dict(funding_path=str(tmp_path), base_url=fapi, limiter=TokenBucket(1000, 1000))
+    out_path = funding_file("BTCUSDT", str(tmp_path))
+
+    download_all_funding("BTCUSDT", datetime(2024, 1, 1, tzinfo=timezone.utc), end, **kwargs)
+    FundingHandler.records["BTCUSDT"] = funding_records("BTCUSDT", 28)
+    download_all_funding("BTCUSDT", None, end, update=True, **kwargs)
+    assert parquet_fragments.list_fragments(out_path)
+
+    # 整体重写后片段里的旧记录不能再合并回来
+    FundingHandler.records["BTCUSDT"] = funding_records("BTCUSDT", 20)
+    assert download_all_funding("BTCUSDT", datetime(2024, 1, 1, tzinfo=timezone.utc), end, **kwargs) == 20
+    assert not parquet_fragments.list_fragments(out_path)
+    assert parquet_fragments.read_table(out_path, key="fundingTime").num_rows == 20
+
+
+def test_pagination_uses_limit(fapi, tmp_path):
+    FundingHandler.records["BTCUSDT"] = funding_records("BTCUSDT", 2500)
+    end = datetime.fromtimestamp((START + 3000 * HOUR8) / 1000, tz=timezone.utc)
+    rows = download_all_funding("BTCUSDT", datetime(2024, 1, 1, tzinfo=timezone.utc), end,
+                                funding_path=str(tmp_path), base_url=fapi, limiter=TokenBucket(1000, 1000))
+    assert rows == 2500
+    assert len(FundingHandler.requests) == 3
+
+
+def test_retries_rate_limit_and_server_errors(fapi, tmp_path, monkeypatch):
+    monkeypatch.setattr("Data.download_funding_rate.time.sleep", lambda s: None)
+    FundingHandler.records["BTCUSDT"] = funding_records("BTCUSDT", 5)
+    FundingHandler.failures = [429, 503]
+    end = datetime.fromtimestamp((START + 10 * HOUR8) / 1000, tz=timezone.utc)
+    written, failed = download_funding_many(["BTCUSDT"], start=datetime(2024, 1, 1, tzinfo=timezone.utc), end=end,
+                                            funding_path=str(tmp_path), base_url=fapi)
+    assert written == {"BTCUSDT": 5} and not failed
+    assert len(FundingHandler.requests) == 3
+
+    # 400之类的错误不重试, 只影响该symbol
+    FundingHandler.failures = [400]
+    FundingHandler.requests = []
+    written, failed = download_funding_many(["BTCUSDT"], start=datetime(2024, 1, 1, tzinfo=timezone.utc), end=end,
+                                            update=False, funding_path=str(tmp_path), base_url=fapi)
+    assert isinstance(failed["BTCUSDT"], FundingFetchError)
+    assert len(FundingHandler.requests) == 1
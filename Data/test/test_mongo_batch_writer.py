@@ -0,0 +1,156 @@
+import pytest
+import threading
+
+mongomock = pytest.importorskip("mongomock")
+
+from pymongo.errors import BulkWriteError
+from Data.DataHandlers import MongoDBHandler, MongoBatchWriter, insert_many_batched
+from Utils.DataStructure import MONGODATA
+
+CONFIG = {
+    "DB": {
+        "Mongo_Host": "localhost",
+        "Mongo_Port": "27017",
+        "Mongo_Batch_Size": 100,
+        "Mongo_Queue_Size": 50,
+    }
+}
+
+
+class CountingCollection(object):
+    """记录insert_many调用的collection包装"""
+    def __init__(self, col):
+        self.col = col
+        self.calls = []
+
+    def insert_many(self, docs, ordered=True):
+        self.calls.append((len(docs), ordered))
+        return self.col.insert_many(docs, ordered=ordered)
+
+
+@pytest.fixture
+def handler():
+    h = MongoDBHandler(CONFIG)
+    h.client = mongomock.MongoClient()
+    yield h
+    h.disconnected()
+
+
+def test_insert_many_batched_chunks_iterables(handler):
+    col = CountingCollection(handler.client["test"]["rows"])
+    rows = ({"i": i} for i in range(250))
+
+    inserted = insert_many_batched(col, rows, batch_size=100)
+
+    assert inserted == 250
+    assert col.calls == [(100, False), (100, False), (50, False)]
+    assert handler.client["test"]["rows"].count_documents({}) == 250
+
+
+def test_insert_many_batched_unordered_continues_after_duplicates(handler):
+    col = handler.client["test"]["dup"]
+    col.insert_one({"_id": 1})
+
+    with pytest.raises(BulkWriteError) as e:
+        insert_many_batched(col, [{"_id": 1}, {"_id": 2}, {"_id": 3}], batch_size=2)
+
+    assert e.value.details["nInserted"] == 2
+    assert len(e.value.details["writeErrors"]) == 1
+    assert col.count_documents({}) == 3
+
+
+def test_on_insert_many_uses_handler_batch_size(handler):
+    data = [{"i": i} for i in range(230)]
+    mongo = MONGODATA(DB="test", COL="many", Data=None, Info={"req": "insert", "data": data})
+
+    assert handler.on_insert_many(mongo)
+    assert handler.client["test"]["many"].count_documents({}) == 230
+
+
+def test_batch_writer_drains_queue_while_running(handler):
+    writer = MongoBatchWriter(handler)
+    writer.start()
+
+    for i in range(1000):
+        writer.put("test", "pos", {"i": i})
+    writer.put_many("test", "acc", [{"i": i} for i in range(10)])
+    writer.flush()
+
+    assert handler.client["test"]["pos"].count_documents({}) == 1000
+    assert handler.client["test"]["acc"].count_documents({}) == 10
+
+    writer.put("test", "pos", {"i": 1000})
+    assert writer.close() == 1011
+    assert handler.client["test"]["pos"].count_documents({}) == 1001
+    assert writer.errors == []
+
+
+def test_batch_writer_flush_without_thread_returns(handler):
+    writer = MongoBatchWriter(handler)
+    writer.flush()
+
+    writer.start()
+    writer.put("test", "pos", {"i": 0})
+    assert writer.close() == 1
+    writer.flush()
+    assert handler.client["test"]["pos"].count_documents({}) == 1
+
+
+def test_batch_writer_backpressure_blocks_when_queue_full(handler):
+    writer = MongoBatchWriter(handler, queue_size=5)
+
+    # 后台线程未启动,队列写满之后put阻塞
+    producer = threading.Thread(target=lambda: [writer.put("test", "bp", {"i": i}) for i in range(20)])
+    producer.start()
+    producer.join(timeout=0.5)
+    assert producer.is_alive()
+    assert writer.queue.full()
+
+    writer.start()
+    producer.join(timeout=5)
+    assert not producer.is_alive()
+
+    writer.close()
+    assert handler.client["test"]["bp"].count_documents({}) == 20
+
+
+def test_batch_writer_records_write_errors(handler):
+    handler.client["test"]["err"].insert_one({"_id": 1})
+    writer = MongoBatchWriter(handler, batch_size=2)
+    writer.start()
+    writer.put_many("test", "err", [{"_id": 1}, {"_id": 2}, {"_id": 3}])
+
+    assert writer.close() == 2
+    assert len(writer.errors) == 1
+    assert handler.client["test"]["err"].count_documents({}) == 3
+
+
+def test_shared_client_registry_is_lazy_and_pooled(monkeypatch):
+    from Data import DataHandlers
+
+    created = []
+
+    def fake_client(**kwargs):
+        created.append(kwargs)
+        return mongomock.MongoClient()
+
+    DataHandlers.close_mongo_clients()
+    monkeypatch.setattr(DataHandlers.pymongo, "MongoClient", fake_client)
+
+    first = MongoDBHandler(dict(CONFIG, DB=dict(CONFIG["DB"], Mongo_Max_Pool_Size=8)))
+    second = MongoDBHandler(CONFIG)
+    assert first.client is None and created == []
+
+    first.Connect_DB()
+    second.Connect_DB()
+    assert first.client is second.client
+    assert len(created) == 1
+    assert created[0]["maxPoolSize"] == 8 and created[0]["connect"] is False
+
+    # disconnected只释放引用,共享的client仍然可用
+    first.disconnected()
+    assert second.client["test"]["rows"].insert_one({"i": 1}).acknowledged
+
+    DataHandlers.close_mongo_clients()
+    assert DataHandlers.get_mongo_client("localhost", 27017) is not second.client
+    DataHandlers.close_mongo_clients()
@@ -0,0 +1,70 @@
+import pytest
+from datetime import datetime
+
+mongomock = pytest.importorskip("mongomock")
+
+from Data.DataHandlers import MongoDBHandler, MongoResultStore
+
+CONFIG = {
+    "DB": {
+        "Mongo_Host": "localhost",
+        "Mongo_Port": "27017",
+        "Mongo_Batch_Size": 100,
+    }
+}
+
+
+@pytest.fixture
+def store():
+    h = MongoDBHandler(CONFIG)
+    h.client = mongomock.MongoClient()
+    s = MongoResultStore(h, "BacktestResult", "results")
+    s.ensure_collection()
+    yield s
+    h.disconnected()
+
+
+def records(n, start_pnl=0.0):
+    return [{"timestamp": f"2022-01-01 00:{i:02d}:00", "total_pnl": start_pnl + i, "position_pnl": i} for i in range(n)]
+
+
+def test_ensure_collection_falls_back_to_indexed_collection(store):
+    # mongomock不支持time-series collection, 退化为普通collection + 复合索引
+    index = store.collection.index_information()
+    assert any(v["key"] == MongoResultStore.INDEX for v in index.values())
+    assert store.ensure_collection() is store.collection
+
+
+def test_to_document_uses_default_ts_for_init_record():
+    default = datetime(2021, 12, 31)
+    doc = MongoResultStore.to_document("r", "BTCUSD_PERP", "long", {"timestamp": "init", "volume": 0}, default)
+    assert doc["ts"] == default
+    assert doc["meta"] == {"run_id": "r", "symbol": "BTCUSD_PERP", "kind": "long"}
+    assert doc["volume"] == 0
+
+
+def test_query_across_runs_in_one_call(store):
+    run_a = MongoResultStore.make_run_id("u", "s", "a")
+    run_b = MongoResultStore.make_run_id("u", "s", "b")
+    assert store.load(run_a, "BTCUSD_PERP", "account", records(10)) == 10
+    assert store.load(run_b, "BTCUSD_PERP", "account", records(10, 100)) == 10
+    store.load(run_b, "ETHUSD_PERP", "long", records(5))
+
+    df = store.query(run_ids=[run_a, run_b], symbols=["BTCUSD_PERP"], kinds=["account"], fields=["total_pnl"])
+    assert list(df.columns) == ["run_id", "symbol", "kind", "ts", "total_pnl"]
+    assert len(df) == 20
+    assert df.groupby("run_id")["total_pnl"].max().to_dict() == {run_a: 9, run_b: 109}
+
+    df = store.query(run_ids=[run_b], start="2022-01-01 00:03:00", end="2022-01-01 00:04:00")
+    assert len(df) == 4
+    assert set(df["symbol"]) == {"BTCUSD_PERP", "ETHUSD_PERP"}
+
+    assert store.query(run_ids=["missing"], fields=["total_pnl"]).empty
+
+
+def test_register_run_upserts(store):
+    store.register_run("u|s|a", {"user": "u", "params": {"w": 1}})
+    store.register_run("u|s|a", {"user": "u", "params": {"w": 2}})
+    runs = store.list_runs()
+    assert len(runs) == 1
+    assert runs.loc[0, "params"] == {"w": 2}
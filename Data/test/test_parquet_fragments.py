@@ -0,0 +1,104 @@
+import datetime
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from Data import parquet_fragments
+from Data.bulk_download_binance import download_history_range, kline_file, update_start
+from Data.test.test_bulk_download import server, publish, kline_rows, RecordingHandler  # noqa: F401
+
+UTC = datetime.timezone.utc
+
+
+def bars(start, n):
+    open_time = [start + i * 60000 for i in range(n)]
+    return pd.DataFrame({"open_time": open_time, "close": [float(i) for i in range(start, start + n)],
+                         "timestamp": pd.to_datetime(open_time, unit="ms").astype(str)})
+
+
+def test_append_creates_base_then_fragments(tmp_path):
+    path = str(tmp_path / "BinanceU_BTCUSDT_perp.parquet")
+    assert parquet_fragments.max_value(path) is None
+    assert parquet_fragments.append_fragment(path, bars(0, 5)) == 5
+    assert os.path.exists(path) and parquet_fragments.list_fragments(path) == []
+
+    # 与已有数据重叠的两行被过滤
+    assert parquet_fragments.append_fragment(path, bars(3 * 60000, 5)) == 3
+    assert parquet_fragments.append_fragment(path, bars(0, 2)) == 0
+    assert len(parquet_fragments.list_fragments(path)) == 1
+    assert parquet_fragments.max_value(path) == 7 * 60000
+
+    table = parquet_fragments.read_table(path)
+    assert table["open_time"].to_pylist() == [i * 60000 for i in range(8)]
+    assert table.schema == pq.read_schema(path).remove_metadata()
+
+
+def test_batch_duplicates_keep_last(tmp_path):
+    path = str(tmp_path / "data.parquet")
+    parquet_fragments.append_fragment(path, bars(0, 2))
+    batch = pd.concat([bars(120000, 2), bars(120000, 1).assign(close=99.0)])
+    assert parquet_fragments.append_fragment(path, batch) == 2
+    df = parquet_fragments.read_table(path).to_pandas()
+    assert df["close"].tolist() == [0.0, 1.0, 99.0, 120001.0]
+
+
+def test_compact_merges_fragments(tmp_path):
+    path = str(tmp_path / "data.parquet")
+    for start in range(0, 30, 10):
+        parquet_fragments.append_fragment(path, bars(start * 60000, 10))
+    assert len(parquet_fragments.list_fragments(path)) == 2
+    before = parquet_fragments.read_table(path)
+
+    assert parquet_fragments.compact(path, row_group_size=8) == 30
+    assert not os.path.exists(parquet_fragments.fragment_dir(path))
+    assert pq.ParquetFile(path).metadata.num_row_groups == 4
+    assert parquet_fragments.read_table(path).equals(before)
+    assert parquet_fragments.compact(path) is None
+
+
+def test_update_start_uses_last_open_time(tmp_path):
+    path = str(tmp_path / "data.parquet")
+    start = datetime.datetime(2024, 1, 1, tzinfo=UTC)
+    assert update_start(path, start) == start
+    last = int(datetime.datetime(2024, 2, 1, 23, 59, tzinfo=UTC).timestamp() * 1000)
+    parquet_fragments.append_fragment(path, bars(last, 1))
+    assert update_start(path, start) == datetime.datetime(2024, 2, 2, tzinfo=UTC)
+    assert update_start(path, None) == datetime.datetime(2024, 2, 2, tzinfo=UTC)
+
+
+def test_update_without_data_requires_start(tmp_path):
+    with pytest.raises(ValueError, match="start_date"):
+        download_history_range("futures", "um", "klines", "1m", "BTCUSDT", None,
+                               datetime.datetime(2024, 2, 4, tzinfo=UTC), str(tmp_path / "out"),
+                               temp_root=str(tmp_path / "dl"), update=True)
+
+
+def test_update_downloads_only_new_archives(server, tmp_path):
+    root, base_url = server
+    for day in (1, 2, 3):
+        date = datetime.datetime(2024, 2, day, tzinfo=UTC)
+        publish(root, base_url, "daily", date.strftime("%Y-%m-%d"), kline_rows(date, 3))
+    extract_to = str(tmp_path / "out")
+    kwargs = dict(extract_to=extract_to, base_url=base_url, temp_root=str(tmp_path / "dl"))
+
+    out_path = download_history_range("futures", "um", "klines", "1m", "BTCUSDT",
+                                      datetime.datetime(2024, 2, 1, tzinfo=UTC),
+                                      datetime.datetime(2024, 2, 3, tzinfo=UTC), **kwargs)
+    assert out_path == kline_file(extract_to, "klines", "1m", "BTCUSDT")
+    assert len(pd.read_parquet(out_path)) == 6
+
+    RecordingHandler.requests = []
+    download_history_range("futures", "um", "klines", "1m", "BTCUSDT",
+                           datetime.datetime(2024, 1, 1, tzinfo=UTC),
+                           datetime.datetime(2024, 2, 4, tzinfo=UTC), update=True, **kwargs)
+    # 已有数据的最后一天只下载了部分bar, 重新下载该天, 之前的压缩包不再请求
+    assert RecordingHandler.requests
+    assert all("2024-02-02" in r or "2024-02-03" in r for r in RecordingHandler.requests)
+    assert len(parquet_fragments.list_fragments(out_path)) == 1
+
+    df = parquet_fragments.read_table(out_path).to_pandas()
+    assert len(df) == 9 and df["open_time"].is_unique
+    assert df["open_time"].is_monotonic_increasing
+    assert df["timestamp"].iloc[-1] == "2024-02-03 00:02:00"
@@ -0,0 +1,97 @@
+import pytest
+
+from Data.DataHandlers import ParquetResultStore
+
+CONFIG = {
+    "user": "u",
+    "strategy_name": "s",
+    "bt_time": "20240101000000",
+    "start_time": "2022-01-01 00:00:00",
+    "end_time": "2022-01-02 00:00:00",
+    "TradingSymbols": ["BTCUSD_PERP", "ETHUSD_PERP"],
+}
+
+
+def positions(symbol, n, scale=1.0):
+    # 第一条为init记录
+    rows = [{"symbol": symbol, "timestamp": "0", "total_pnl": 0.0, "source": "init"}]
+    rows += [{"symbol": symbol, "timestamp": f"2022-01-01 00:{i:02d}:00", "total_pnl": scale * i, "source": "pnl"}
+             for i in range(n)]
+    return rows
+
+
+def accounts(symbol, n):
+    rows = [{"symbol": symbol, "timestamp": 0, "margin_balance": 100.0}]
+    rows += [{"symbol": symbol, "timestamp": f"2022-01-01 00:{i:02d}:00", "margin_balance": 100.0 + i}
+             for i in range(n)]
+    return rows
+
+
+def frames(scale=1.0):
+    result = dict()
+    for symbol in CONFIG["TradingSymbols"]:
+        result[(symbol, "long")] = positions(symbol, 10, scale)
+        result[(symbol, "short")] = positions(symbol, 10, -scale / 2)
+        result[(symbol, "account")] = accounts(symbol, 10)
+    return result
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ParquetResultStore(str(tmp_path))
+
+
+def test_write_run_partitions_and_scan(store):
+    assert store.write_run("run_a", frames()) == 2 * (11 + 11 + 11)
+    store.write_run("run_b", frames(scale=2.0))
+
+    df = store.scan(kinds=["long"], symbols=["BTCUSD_PERP"], columns=["timestamp", "total_pnl"])
+    assert list(df.columns) == ["run_id", "symbol", "kind", "timestamp", "total_pnl"]
+    assert set(df["run_id"]) == {"run_a", "run_b"}
+    assert df.groupby("run_id")["total_pnl"].max().to_dict() == {"run_a": 9.0, "run_b": 18.0}
+
+    # position和account字段不同,schema取并集
+    df = store.scan(run_ids=["run_a"], symbols=["ETHUSD_PERP"])
+    assert len(df) == 33
+    assert {"total_pnl", "margin_balance"} <= set(df.columns)
+    assert df.loc[df["kind"] == "account", "total_pnl"].isna().all()
+
+
+def test_write_overwrites_partition(store):
+    store.write("run_a", "BTCUSD_PERP", "long", positions("BTCUSD_PERP", 10))
+    store.write("run_a", "BTCUSD_PERP", "long", positions("BTCUSD_PERP", 3))
+    assert len(store.scan(run_ids=["run_a"])) == 4
+
+
+def test_scan_empty_store(store):
+    assert store.scan(columns=["total_pnl"]).empty
+    assert store.catalog().empty
+
+
+def test_compute_metrics():
+    metrics = ParquetResultStore.compute_metrics(frames())
+    # 每个symbol: long 9 + short -4.5
+    assert metrics["total_pnl"] == pytest.approx(9.0)
+    assert metrics["max_drawdown"] == pytest.approx(0.0)
+    assert metrics["n_bars"] == 10
+
+    drawdown = {("BTCUSD_PERP", "long"): [{"timestamp": "0", "total_pnl": 0.0}] +
+                [{"timestamp": f"2022-01-01 00:0{i}:00", "total_pnl": v} for i, v in enumerate([1.0, 5.0, 2.0, 3.0])]}
+    assert ParquetResultStore.compute_metrics(drawdown)["max_drawdown"] == pytest.approx(3.0)
+
+
+def test_catalog_records_hash_params_metrics(store):
+    store.register_run("run_a", CONFIG, params={"window": 20}, metrics={"total_pnl": 1.0}, wall_time=1.5)
+    store.register_run("run_b", dict(CONFIG, bt_time="20240102000000"), params={"window": 20},
+                       metrics={"total_pnl": 2.0}, wall_time=2.5)
+    store.register_run("run_c", CONFIG, params={"window": 40}, metrics={"total_pnl": 3.0}, wall_time=3.5)
+
+    catalog = store.catalog().set_index("run_id")
+    assert list(catalog.index) == ["run_a", "run_b", "run_c"]
+    # bt_time不参与hash
+    assert catalog.loc["run_a", "config_hash"] == catalog.loc["run_b", "config_hash"]
+    assert catalog.loc["run_a", "config_hash"] != catalog.loc["run_c", "config_hash"]
+    assert catalog.loc["run_c", "params"] == {"window": 40}
+    assert catalog.loc["run_b", "symbols"] == CONFIG["TradingSymbols"]
+    assert catalog["metric_total_pnl"].tolist() == [1.0, 2.0, 3.0]
+    assert catalog.loc["run_b", "wall_time"] == 2.5
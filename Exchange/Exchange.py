@@ -16,7 +16,7 @@ import numpy as np  # 预加载numpy避免延迟导入问题
 import atexit
 from datetime import datetime, timedelta
 from abc import abstractmethod, ABC
-from logging import INFO
+from logging import INFO, WARNING
 from threading import Thread
 from Event_Engine import Event_Engine
 from Utils.Constant import *
@@ -24,6 +24,8 @@ from Utils.Event import *
 from Utils.decorator_functions import thread
 from Utils.DataStructure import *
 from Utils.util import *
+from Data.catalog import DataCatalog
+from Data.bar_cache import BarCache
 import csv
 
 
@@ -118,10 +120,19 @@ class Exchange_Backtest_Medium_Frequency(ExchangeBase):
         self.market_data_symbols = self.config['MARKET_DATA']
         self.trading_symbols = self.config['TradingSymbols']
         self.funding_symbols = self.config['FundingSymbols']
+        self.signal_symbols = self.config.get('SignalSymbols', [])
+        # 策略订阅的bar字段, None表示推送全部字段
+        self.fields = None
         self.tmp = {}  # 缓存每个symbol的market data
         self.flag = {}
 
         self.spot = self.cfg['CONTRACT_TYPE']['SPOT']
+        # 数据路径和覆盖范围从catalog索引读取, 没有索引时按默认目录结构
+        self.catalog = DataCatalog.from_config(self.config)
+        # 预处理后的npy缓存(mmap读取), config['bar_cache_dir']为空时直接读parquet
+        self.bar_cache = BarCache.from_config(self.config, self.catalog)
+        # 每个symbol订阅的bar周期, 不在其中的symbol推送1m bar
+        self.timeframes = parse_timeframes(self.config.get('Timeframes'), self.trading_symbols + self.signal_symbols)
 
         self.event_manager = ee
         self.slippage = float(self.config['Slippage'])
@@ -173,6 +184,11 @@ class Exchange_Backtest_Medium_Frequency(ExchangeBase):
             self.tmp[symbol] = None
             self.flag[symbol] = 1
 
+        # 启动时只读索引检查数据覆盖范围
+        for issue in self.catalog.validate(self.market_data_symbols, self.config['lookback_time'],
+                                           self.config['end_time']):
+            self.write_log(issue, WARNING)
+
     def start(self):
         self.__active = True
         self.on_init()
@@ -195,6 +211,14 @@ class Exchange_Backtest_Medium_Frequency(ExchangeBase):
             # 开始推送数据 - 单线程模式直接调用
             self._publish_data()
 
+    def subscribe(self, market_symbols, fields=None):
+        """
+        按策略的订阅只读取market_symbols, fields不为None时bar只推送这些字段(时间列等非bar字段保留)
+        需要在start之前调用
+        """
+        self.market_data_symbols = [symbol for symbol in self.market_data_symbols if symbol in market_symbols]
+        self.fields = None if fields is None else set(fields)
+
     def register_function(self):
         self.event_manager.register(Event_Type.EVENT_BUY, self.on_orders_arrived)
         self.event_manager.register(Event_Type.EVENT_SELL, self.on_orders_arrived)
@@ -206,61 +230,118 @@ class Exchange_Backtest_Medium_Frequency(ExchangeBase):
 
     def __parquet_reader_generator(self, market_symbol: str):
         parse_symbol = split_symbol(market_symbol)
-        file_path = (
-            f"/srv/data/{parse_symbol['exchange']}/funding/{market_symbol}.parquet"
-            if parse_symbol['tag'] == 'funding'
-            else f"/srv/data/{parse_symbol['exchange']}/klines/1m/{parse_symbol['pair']}/{market_symbol}.parquet"
-        )
-
-        # 关键修复：使用正确的数据访问方式
-        with open(file_path, 'rb') as f:
-            buf = f.read()
-            reader = pq.ParquetFile(BytesIO(buf))
-            arrow_table = reader.read(use_threads=False)  # 获取完整Arrow Table
+        if not self.catalog.overlaps(market_symbol, self.config['lookback_time'], self.config['end_time']):
+            # 数据与回测区间没有交集, 不打开文件
+            return
+
+        if self.bar_cache is not None:
+            columns, results = self.bar_cache.window(market_symbol, self.config['lookback_time'],
+                                                     self.config['end_time'])
+            yield from self.__publish_rows(market_symbol, columns, results)
+            return
+
+        # 关键修复：使用正确的数据访问方式(包含增量更新追加的片段; catalog中有row group边界时只读取重叠的部分)
+        arrow_table = self.catalog.read_table(market_symbol, self.config['lookback_time'],
+                                              self.config['end_time'])  # 获取Arrow Table
+        if arrow_table.num_rows == 0:
+            return
             
-            results = parse_pyarrow_table(arrow_table)
-            if parse_symbol['tag'] == 'funding':
-                # 检查timestamp的类型,并正确处理
-                sample_ts = results['timestamp'][0]
+        results = parse_pyarrow_table(arrow_table)
+        if parse_symbol['tag'] == 'funding':
+            # 检查timestamp的类型,并正确处理
+            sample_ts = results['timestamp'][0]
                 
-                # 根据类型选择正确的处理方式
-                if isinstance(sample_ts, (np.int64, np.int32, int, str)):
-                    # 如果是整数时间戳,无需转换
-                    timestamp_col = results['timestamp']
-                elif isinstance(sample_ts, np.datetime64):
-                    # 如果是numpy datetime,转换为字符串
-                    timestamp_col = np.array([pd.Timestamp(ts).strftime("%Y-%m-%d %H:%M:%S") 
-                                             for ts in results['timestamp']])
-                elif isinstance(sample_ts, datetime):
-                    # 如果是Python datetime,转换为字符串
-                    timestamp_col = np.array([ts.strftime("%Y-%m-%d %H:%M:%S") 
-                                             for ts in results['timestamp']])
-                else:
-                    # 其他类型,尝试直接转换为字符串
-                    print(f"未知类型的timestamp: {type(sample_ts)},尝试直接使用")
-                    timestamp_col = results['timestamp']
+            # 根据类型选择正确的处理方式
+            if isinstance(sample_ts, (np.int64, np.int32, int, str)):
+                # 如果是整数时间戳,无需转换
+                timestamp_col = results['timestamp']
+            elif isinstance(sample_ts, np.datetime64):
+                # 如果是numpy datetime,转换为字符串
+                timestamp_col = np.array([pd.Timestamp(ts).strftime("%Y-%m-%d %H:%M:%S") 
+                                         for ts in results['timestamp']])
+            elif isinstance(sample_ts, datetime):
+                # 如果是Python datetime,转换为字符串
+                timestamp_col = np.array([ts.strftime("%Y-%m-%d %H:%M:%S") 
+                                         for ts in results['timestamp']])
             else:
-                # 非funding数据直接使用原始timestamp
+                # 其他类型,尝试直接转换为字符串
+                print(f"未知类型的timestamp: {type(sample_ts)},尝试直接使用")
                 timestamp_col = results['timestamp']
+        else:
+            # 非funding数据直接使用原始timestamp
+            timestamp_col = results['timestamp']
             
-            results['timestamp'] = timestamp_col
-            # 预计算有效索引(避免循环内判断)
-            mask = (timestamp_col >= self.config['lookback_time']) & \
-                (timestamp_col <= self.config['end_time'])
-            valid_indices = np.where(mask)[0]
-            
-            # 批量生成结果
-            for idx in valid_indices:
-                pub_data = {}
-                for col in arrow_table.column_names:
-                    pub_data[col] = results[col][idx]
-                yield pub_data
+        results['timestamp'] = timestamp_col
+        # 预计算有效索引(避免循环内判断)
+        mask = (timestamp_col >= self.config['lookback_time']) & \
+            (timestamp_col <= self.config['end_time'])
+        valid_indices = np.where(mask)[0]
+        columns = arrow_table.column_names
+        results = {col: results[col][valid_indices] for col in columns}
+
+        # 批量生成结果
+        yield from self.__publish_rows(market_symbol, columns, results)
 
         # 显式清理
-        del arrow_table, reader, buf
+        del arrow_table
         import gc
         gc.collect()
 
+    def __publish_rows(self, market_symbol, columns, results):
+        """
+        逐行生成推送数据; 订阅了其它周期的symbol先把1m bar聚合(向量化预计算)
+        第一个周期的bar作为该symbol的行情, 更大周期的bar在完成的那一根bar中以TIMEFRAME_BARS附带
+        """
+        if split_symbol(market_symbol)['tag'] == 'funding':
+            yield from self.__publish_funding(market_symbol, columns, results)
+            return
+        if self.fields is not None:
+            columns = [col for col in columns if col not in BAR_FIELDS or col in self.fields]
+        timeframes = self.timeframes.get(market_symbol)
+        if not timeframes:
+            for idx in range(len(results['timestamp'])):
+                yield {col: results[col][idx] for col in columns}
+            return
+
+        if 'open_time' in results:
+            open_time = results['open_time']
+        else:
+            open_time = np.array(results['timestamp'], dtype='datetime64[ms]').astype(np.int64)
+        base, base_ends = aggregate_bars(results, columns, open_time, timeframe_ms(timeframes[0]))
+        extra = dict()
+        for timeframe in timeframes[1:]:
+            bars, ends = aggregate_bars(results, columns, open_time, timeframe_ms(timeframe))
+            # 大周期的最后一根1m bar也是某根基础周期bar的最后一根
+            position = np.full(len(base_ends), -1)
+            position[np.searchsorted(base_ends, ends)] = np.arange(len(ends))
+            extra[timeframe] = (bars, position)
+
+        for idx in range(len(base['timestamp'])):
+            pub_data = {col: base[col][idx] for col in columns}
+            finished = {tf: {col: bars[col][position[idx]] for col in columns}
+                        for tf, (bars, position) in extra.items() if position[idx] >= 0}
+            if finished:
+                pub_data[TIMEFRAME_BARS] = finished
+            yield pub_data
+
+    def __publish_funding(self, market_symbol, columns, results):
+        """
+        funding记录按交易所的结算时刻as-of对齐(读取时一次完成), timestamp改成结算时刻, 与bar的timestamp一致
+        只推送结算时刻的funding, 持仓引擎不再检查时间
+        """
+        if 'fundingTime' in results:
+            funding_time = results['fundingTime']
+        else:
+            funding_time = np.array(results['timestamp'], dtype='datetime64[ms]').astype(np.int64)
+        schedule = settlement_schedule(split_symbol(market_symbol)['exchange'], self.config['lookback_time'],
+                                       self.config['end_time'])
+        instants, index = asof_funding(schedule, funding_time)
+        timestamp = np.char.replace(np.datetime_as_string(instants.astype('datetime64[ms]'), unit='s'), 'T', ' ')
+        for idx in range(len(index)):
+            pub_data = {col: results[col][index[idx]] for col in columns}
+            pub_data['timestamp'] = str(timestamp[idx])
+            yield pub_data
+
     def __csv_reader_generator(self, market_symbol):
         """
         Fetch data & generator
@@ -336,12 +417,13 @@ class Exchange_Backtest_Medium_Frequency(ExchangeBase):
                 self.BarData[symbol].high = float(msg[symbol]['high'])
                 self.BarData[symbol].low = float(msg[symbol]['low'])
                 self.BarData[symbol].close = float(msg[symbol]['close'])
-                self.BarData[symbol].volume = float(msg[symbol]['volume'])
+                # 没有订阅的字段为0
+                self.BarData[symbol].volume = float(msg[symbol].get('volume', 0))
 
-                self.BarData[symbol].quote_volume = float(msg[symbol]['quote_volume'])
-                self.BarData[symbol].count = float(msg[symbol]['count'])
-                self.BarData[symbol].taker_buy_volume = float(msg[symbol]['taker_buy_volume'])
-                self.BarData[symbol].taker_buy_quote_volume = float(msg[symbol]['taker_buy_quote_volume'])
+                self.BarData[symbol].quote_volume = float(msg[symbol].get('quote_volume', 0))
+                self.BarData[symbol].count = float(msg[symbol].get('count', 0))
+                self.BarData[symbol].taker_buy_volume = float(msg[symbol].get('taker_buy_volume', 0))
+                self.BarData[symbol].taker_buy_quote_volume = float(msg[symbol].get('taker_buy_quote_volume', 0))
         for symbol in self.funding_symbols:
             if symbol in msg:
                 self.FundingData[symbol].timestamp = msg[symbol]['timestamp']
@@ -0,0 +1,170 @@
+import numpy as np
+
+# 每批打分的信号矩阵(float64, 行数 * 列数)字节数上限, 计算过程中的临时数组约为其数倍
+BATCH_BYTES = 256 << 20
+
+
+def batch_columns(n: int, batch_bytes: int = BATCH_BYTES) -> int:
+    """n行的信号每批最多打分的列数(至少1列)"""
+    return max(1, batch_bytes // (max(n, 1) * np.dtype(np.float64).itemsize))
+
+
+def fill_invalid_2d(values: np.ndarray) -> np.ndarray:
+    """
+    按列将inf替换为NaN后ffill再bfill, 返回新数组; 全部无效的列保持为NaN
+    """
+    n = values.shape[0]
+    invalid = ~np.isfinite(values)
+    if not invalid.any():
+        return values.copy()
+    rows = np.where(invalid, 0, np.arange(n)[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    out = np.take_along_axis(values, rows, axis=0)
+    # ffill之后只有每列开头的无效值, 用第一个有效值填充
+    has_valid = ~invalid.all(axis=0)
+    first = np.argmax(~invalid, axis=0)
+    leading = np.arange(n)[:, None] < first
+    out[leading] = np.broadcast_to(values[first, np.arange(values.shape[1])], values.shape)[leading]
+    out[:, ~has_valid] = np.nan
+    return out
+
+
+def _rows(x: np.ndarray) -> np.ndarray:
+    """
+    (n, k) -> C连续的(k, n)
+    按行(连续内存)归约时每个信号的求和顺序与批内信号个数无关, 同一信号在不同批次中结果完全一致
+    """
+    return np.ascontiguousarray(x.T)
+
+
+def batch_pearson(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    x的每一列与y的Pearson相关系数(与np.corrcoef一致,结果截断到[-1, 1])
+    :param x: (n, k)
+    :param y: (n,)
+    """
+    if x.shape[0] < 2:
+        return np.full(x.shape[1], np.nan)
+    xc = _rows(x)
+    xc -= xc.mean(axis=1, keepdims=True)
+    yc = y - y.mean()
+    with np.errstate(all='ignore'):
+        corr = (xc * yc).sum(axis=1) / np.sqrt((xc * xc).sum(axis=1) * (yc * yc).sum())
+    return np.clip(corr, -1, 1)
+
+
+def lag1_autocorr(x: np.ndarray) -> np.ndarray:
+    """每一列的lag-1自相关系数, 与pd.Series.autocorr(lag=1)一致"""
+    if x.shape[0] < 3:
+        return np.full(x.shape[1], np.nan)
+    xt = _rows(x)
+    a = xt[:, 1:] - xt[:, 1:].mean(axis=1, keepdims=True)
+    b = xt[:, :-1] - xt[:, :-1].mean(axis=1, keepdims=True)
+    with np.errstate(all='ignore'):
+        corr = (a * b).sum(axis=1) / np.sqrt((a * a).sum(axis=1) * (b * b).sum(axis=1))
+    return np.clip(corr, -1, 1)
+
+
+def rolling_corr_2d(x: np.ndarray, y: np.ndarray, window: int) -> np.ndarray:
+    """
+    x的每一列与y的滚动Pearson相关系数(输入不含NaN), 基于累计和的一阶/二阶矩, O(n)
+    前window-1行以及窗口内方差为0的位置为NaN
+    :param x: (n, k)
+    :param y: (n,)
+    :return: (n, k)
+    """
+    n, k = x.shape
+    out = np.full((k, n), np.nan)
+    if n < window:
+        return out.T
+    # 先减去全局均值,减小累计和相减时的精度损失
+    xt = _rows(x)
+    xt -= xt.mean(axis=1, keepdims=True)
+    y = y - y.mean()
+
+    def window_sum(values):
+        c = np.cumsum(values, axis=-1)
+        s = c[..., window - 1:].copy()
+        s[..., 1:] -= c[..., :-window]
+        return s
+
+    sx, sy = window_sum(xt), window_sum(y)
+    sxx, syy, sxy = window_sum(xt * xt), window_sum(y * y), window_sum(xt * y)
+    vx = sxx - sx * sx / window
+    vy = syy - sy * sy / window
+    cov = sxy - sx * sy / window
+    # 相对累计和误差可以忽略的方差视为0
+    degenerate = (vx <= 1e-10 * sxx) | (vy <= 1e-10 * syy)
+    with np.errstate(all='ignore'):
+        corr = cov / np.sqrt(vx * vy)
+    corr[degenerate] = np.nan
+    out[:, window - 1:] = corr
+    return out.T
+
+
+def rolling_corr(x: np.ndarray, y: np.ndarray, window: int) -> np.ndarray:
+    """rolling_corr_2d的一维版本"""
+    return rolling_corr_2d(x[:, None], y, window)[:, 0]
+
+
+def nan_mean_std(x: np.ndarray):
+    """按列忽略NaN的均值和样本标准差(ddof=1), 有效值少于2个时std为NaN"""
+    xt = _rows(x)
+    valid = ~np.isnan(xt)
+    count = valid.sum(axis=1)
+    with np.errstate(all='ignore'):
+        mean = np.where(valid, xt, 0.0).sum(axis=1) / count
+        dev = np.where(valid, xt - mean[:, None], 0.0)
+        std = np.sqrt((dev * dev).sum(axis=1) / (count - 1))
+    std[count < 2] = np.nan
+    return mean, std
+
+
+def score_signals(signals: np.ndarray, returns: np.ndarray, window: int = 20, min_valid: int = 10,
+                  batch_bytes: int = BATCH_BYTES) -> np.ndarray:
+    """
+    批量计算信号得分: tanh(IC) + 0.5 * tanh(IR) - 0.3 * |lag1自相关|
+    IR为rolling(window) IC的均值/标准差; 全部为NaN、常数、有效样本不足或得分为NaN的信号得分为-inf
+    :param signals: (n, k), 每列一个信号
+    :param returns: (n,), 已去除inf并ffill/bfill的未来收益
+    :param batch_bytes: 每批信号矩阵的字节数上限, 分批结果与一次计算完全一致
+    :return: (k,)
+    """
+    n, k = signals.shape
+    scores = np.full(k, -np.inf)
+    if k == 0:
+        return scores
+
+    batch = batch_columns(n, batch_bytes)
+    for start in range(0, k, batch):
+        scores[start:start + batch] = _score_batch(signals[:, start:start + batch], returns, window, min_valid)
+    return scores
+
+
+def _score_batch(signals, returns, window, min_valid):
+    k = signals.shape[1]
+    scores = np.full(k, -np.inf)
+
+    signals = fill_invalid_2d(signals)
+    with np.errstate(all='ignore'):
+        usable = ~np.isnan(signals).any(axis=0)
+        usable &= _rows(signals).std(axis=1, ddof=1) != 0
+        # 常数信号的std可能因舍入不严格为0, 同时检查最大最小值
+        usable &= signals.max(axis=0) != signals.min(axis=0)
+
+    # 未来收益只有全部无效时才会有NaN
+    valid_rows = ~np.isnan(returns)
+    if valid_rows.sum() < min_valid or not usable.any():
+        return scores
+
+    x = signals[:, usable]
+    ic = batch_pearson(x[valid_rows], returns[valid_rows])
+    mean_ic, std_ic = nan_mean_std(rolling_corr_2d(x, returns, window))
+    autocorr = lag1_autocorr(x)
+    penalty = np.where(np.isnan(autocorr), 1.0, np.abs(autocorr))
+
+    with np.errstate(all='ignore'):
+        ir = mean_ic / (std_ic + 1e-8)
+        score = np.tanh(ic) + 0.5 * np.tanh(ir) - 0.3 * penalty
+    scores[usable] = np.where(np.isfinite(score), score, -np.inf)
+    return scores
@@ -0,0 +1,105 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+# 参数顺序不影响结果的运算符,规范化时对参数排序
+COMMUTATIVE_OPERATORS = {'add', 'mul'}
+
+
+def canonicalize(expr):
+    """
+    将表达式树规范化为可hash的tuple
+    特征列 -> 'close', 运算符节点 -> (op, 参数...), 交换律运算符的参数按repr排序
+    """
+    if isinstance(expr, list):
+        args = [canonicalize(arg) for arg in expr[1:]]
+        if expr and expr[0] in COMMUTATIVE_OPERATORS:
+            args = sorted(args, key=repr)
+        return (canonicalize(expr[0]) if expr else None, *args)
+    if isinstance(expr, np.integer):
+        return int(expr)
+    return expr
+
+
+def expression_key(expr) -> str:
+    """规范化表达式树的hash"""
+    return hashlib.sha1(repr(canonicalize(expr)).encode('utf-8')).hexdigest()
+
+
+class ExpressionCache:
+    """
+    子表达式结果缓存: 规范化表达式hash -> ndarray
+    按占用字节数做LRU淘汰; 无效的子表达式(结果为None)也会缓存,避免重复计算
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key):
+        """
+        返回 (是否命中, 缓存值), 缓存值可能为None(无效表达式)
+        """
+        if key in self._data:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, self._data[key]
+        self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        """
+        写入缓存, 超过max_bytes时淘汰最久未使用的结果; 单个结果超过max_bytes时不缓存
+        """
+        size = 0 if value is None else value.nbytes
+        if self.max_bytes <= 0 or size > self.max_bytes:
+            return
+        if value is not None:
+            # 缓存的数组被多个个体共享,禁止原地修改
+            value.flags.writeable = False
+        if key in self._data:
+            old = self._data.pop(key)
+            self.nbytes -= 0 if old is None else old.nbytes
+        self._data[key] = value
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, old = self._data.popitem(last=False)
+            self.nbytes -= 0 if old is None else old.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+        self.nbytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self._data),
+            'bytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+        }
+
+
+def merge_stats(stats: list) -> dict:
+    """
+    合并多个缓存(如并行评估时各worker进程的缓存)的stats(), 计数和占用相加, 命中率按合并后的计数重新计算
+    """
+    merged = {key: sum(item[key] for item in stats) for key in ('hits', 'misses', 'evictions', 'entries', 'bytes')}
+    lookups = merged['hits'] + merged['misses']
+    merged['hit_rate'] = merged['hits'] / lookups if lookups else 0.0
+    merged['max_bytes'] = sum(item['max_bytes'] for item in stats)
+    return merged
@@ -0,0 +1,267 @@
+import numpy as np
+import pandas as pd
+from numbers import Integral, Real
+from scipy.stats import rankdata
+from numpy.lib.stride_tricks import sliding_window_view
+from Research.operators import (rolling_values, _window_argmax, _window_argmin, _window_decay, _window_rank)
+from Research.expression_cache import ExpressionCache, expression_key
+
+UNARY_OPERATORS = {'abs', 'log', 'sign', 'rank', 'zscore', 'sigmoid'}
+BINARY_OPERATORS = {'add', 'sub', 'mul', 'div', 'power'}
+TS_OPERATORS = {'ts_max', 'ts_argmax', 'ts_min', 'ts_argmin', 'ts_rank', 'delay', 'correlation', 'covariance',
+                'variance', 'scale', 'stddev', 'decay_linear', 'delta', 'signedpower', 'prod'}
+# 第二个参数可以是任意实数的时间序列运算符,其余要求整数窗口
+REAL_PARAM_OPERATORS = {'scale', 'signedpower'}
+# 窗口方差按块计算时每块的元素个数上限
+VAR_CHUNK_ELEMENTS = 1 << 20
+
+
+def fill_invalid(values: np.ndarray, copy: bool = True) -> np.ndarray:
+    """
+    inf替换为NaN后先ffill再bfill, 与 replace([inf, -inf], nan).fillna(ffill).fillna(bfill) 一致
+    copy=True时总是返回新数组(调用方可以原地修改), 否则没有无效值时直接返回输入
+    """
+    invalid = ~np.isfinite(values)
+    if not invalid.any():
+        return values.copy() if copy else values
+    positions = np.where(invalid, 0, np.arange(len(values)))
+    np.maximum.accumulate(positions, out=positions)
+    out = values[positions]
+    valid = np.flatnonzero(~invalid)
+    if len(valid) == 0:
+        out[:] = np.nan
+    else:
+        out[:valid[0]] = values[valid[0]]
+    return out
+
+
+def shift(values: np.ndarray, periods: int) -> np.ndarray:
+    """与pd.Series.shift一致, 空出的位置为NaN"""
+    out = np.full(len(values), np.nan)
+    if periods == 0:
+        out[:] = values
+    elif abs(periods) < len(values):
+        if periods > 0:
+            out[periods:] = values[:-periods]
+        else:
+            out[:periods] = values[-periods:]
+    return out
+
+
+def _window_max(values, window):
+    return sliding_window_view(values, window).max(axis=1)
+
+
+def _window_min(values, window):
+    return sliding_window_view(values, window).min(axis=1)
+
+
+def _window_prod(values, window):
+    return sliding_window_view(values, window).prod(axis=1)
+
+
+def _window_var(values, window):
+    # np.var会生成(n, window)的临时数组,分块计算限制内存
+    windows = sliding_window_view(values, window)
+    chunk = max(1, VAR_CHUNK_ELEMENTS // window)
+    return np.concatenate([np.var(windows[i:i + chunk], axis=1, ddof=1) for i in range(0, len(windows), chunk)])
+
+
+def _window_std(values, window):
+    return np.sqrt(_window_var(values, window))
+
+
+ROLLING_KERNELS = {
+    'ts_max': _window_max,
+    'ts_min': _window_min,
+    'ts_argmax': _window_argmax,
+    'ts_argmin': _window_argmin,
+    'ts_rank': _window_rank,
+    'decay_linear': _window_decay,
+    'variance': _window_var,
+    'stddev': _window_std,
+    'prod': _window_prod,
+}
+
+
+class Step:
+    """
+    编译后的一步计算
+    op为None时表示读取特征列(param为列名), 否则args为输入步骤的下标
+    """
+    __slots__ = ('key', 'op', 'args', 'param')
+
+    def __init__(self, key, op, args=(), param=None):
+        self.key = key
+        self.op = op
+        self.args = args
+        self.param = param
+
+    def __repr__(self):
+        return f"Step({self.op or 'column'}, args={self.args}, param={self.param!r})"
+
+
+def compile_expression(expr, columns) -> list:
+    """
+    将表达式树编译成后序的计算步骤列表, 相同的子表达式只计算一次
+    表达式结构不合法(未知运算符/参数个数不对/窗口不是数值/未知特征列)时返回None,
+    与逐节点执行时结果为None的情况一致
+    """
+    steps = []
+    index = dict()
+
+    def visit(node):
+        if isinstance(node, str):
+            if node not in columns:
+                raise ValueError(node)
+            key = ('column', node)
+            if key not in index:
+                index[key] = len(steps)
+                steps.append(Step(None, None, param=node))
+            return index[key]
+
+        if not isinstance(node, list) or not node or not isinstance(node[0], str):
+            raise ValueError(node)
+        op = node[0]
+        if op in UNARY_OPERATORS and len(node) == 2:
+            args, param = (visit(node[1]),), None
+        elif op in BINARY_OPERATORS and len(node) == 3:
+            args, param = (visit(node[1]), visit(node[2])), None
+        elif op in TS_OPERATORS and len(node) >= 3:
+            param = node[2]
+            valid_type = Real if op in REAL_PARAM_OPERATORS else Integral
+            if isinstance(param, bool) or not isinstance(param, valid_type):
+                raise ValueError(node)
+            args = (visit(node[1]),)
+        else:
+            raise ValueError(node)
+
+        key = expression_key(node)
+        if key not in index:
+            index[key] = len(steps)
+            steps.append(Step(key, op, args, param))
+        return index[key]
+
+    try:
+        visit(expr)
+    except (ValueError, TypeError):
+        return None
+    return steps
+
+
+class NumpyExpressionEvaluator:
+    """
+    在float64数组上执行编译后的表达式
+    每个节点的输入先做fill_invalid(得到新的缓冲区), 运算直接写回该缓冲区;
+    运算符节点的结果写入ExpressionCache, 不同个体之间共享
+    """
+
+    def __init__(self, data: pd.DataFrame, cache: ExpressionCache = None):
+        self.data = data
+        self.cache = cache if cache is not None else ExpressionCache(0)
+        self._columns = dict()
+
+    def column(self, name) -> np.ndarray:
+        if name not in self._columns:
+            self._columns[name] = self.data[name].to_numpy(dtype=np.float64)
+        return self._columns[name]
+
+    def evaluate(self, expr):
+        """
+        :return: 与data等长的float64数组, 表达式无效时返回None
+        """
+        steps = compile_expression(expr, self.data.columns)
+        if steps is None:
+            return None
+        return self.run(steps)
+
+    def run(self, steps: list):
+        values = [None] * len(steps)
+        with np.errstate(all='ignore'):
+            for i, step in enumerate(steps):
+                if step.op is None:
+                    try:
+                        values[i] = self.column(step.param)
+                    except (TypeError, ValueError):
+                        return None
+                    continue
+
+                hit, result = self.cache.get(step.key)
+                if not hit:
+                    try:
+                        result = self.compute(step.op, [values[a] for a in step.args], step.param)
+                    except Exception:
+                        result = None
+                    self.cache.put(step.key, result)
+                if result is None:
+                    return None
+                values[i] = result
+        return values[-1]
+
+    @staticmethod
+    def compute(op, args, param):
+        """
+        计算单个节点; 输入全部为NaN时返回None
+        """
+        if any(np.isnan(x).all() for x in args):
+            return None
+
+        if op in UNARY_OPERATORS:
+            x = fill_invalid(args[0], copy=True)
+            if op == 'abs':
+                return np.abs(x, out=x)
+            if op == 'log':
+                np.abs(x, out=x)
+                x += 1e-8
+                return np.log(x, out=x)
+            if op == 'sign':
+                return np.sign(x, out=x)
+            if op == 'rank':
+                if np.isnan(x).any():
+                    return x
+                return rankdata(x) / len(x)
+            if op == 'zscore':
+                mean = x.mean()
+                std = x.std(ddof=1)
+                x -= mean
+                x /= std + 1e-8
+                return x
+            if op == 'sigmoid':
+                np.negative(x, out=x)
+                np.exp(x, out=x)
+                x += 1
+                return np.reciprocal(x, out=x)
+
+        if op in BINARY_OPERATORS:
+            x = fill_invalid(args[0], copy=True)
+            y = fill_invalid(args[1], copy=False)
+            if op == 'add':
+                return np.add(x, y, out=x)
+            if op == 'sub':
+                return np.subtract(x, y, out=x)
+            if op == 'mul':
+                return np.multiply(x, y, out=x)
+            if op == 'div':
+                return np.divide(x, y + 1e-8, out=x)
+            if op == 'power':
+                sign = np.sign(x)
+                np.abs(x, out=x)
+                np.power(x, y, out=x)
+                return np.multiply(x, sign, out=x)
+
+        x = fill_invalid(args[0], copy=False)
+        if op in ROLLING_KERNELS:
+            if param < 1:
+                return None
+            return rolling_values(x, int(param), ROLLING_KERNELS[op])
+        if op == 'delay':
+            return shift(x, int(param))
+        if op == 'delta':
+            return x - shift(x, int(param))
+        if op == 'scale':
+            total = np.nansum(np.abs(x))
+            return x / total * param if total != 0 else np.zeros(len(x))
+        if op == 'signedpower':
+            return np.sign(x) * (np.abs(x) ** param)
+        # correlation/covariance需要两个序列, 表达式中第二个参数是窗口,结果无效
+        return None
@@ -2,10 +2,20 @@ import pandas as pd
 import numpy as np
 
 class FactorBase:
+    # 计算最新一根bar的因子值需要的历史bar数量, 增量更新时向前多取这么多行
+    lookback = 1
+    # 因子值是否只依赖最近lookback根bar(整段归一化之类的因子需要全量重算)
+    incremental = True
+
     def __init__(self, name, df):
         self.name = name
         self.signal_df = df.copy()
         self.signal_df.index = pd.to_datetime(self.signal_df['timestamp'])
         self.signal_df = self.signal_df.resample('1min').last().fillna(method='ffill')
         self.signal_df.time = self.signal_df.index
-        self.signal_df = self.signal_df.reset_index(drop=True)
\ No newline at end of file
+        self.signal_df = self.signal_df.reset_index(drop=True)
+
+    @classmethod
+    def warmup(cls, **params):
+        """给定参数下需要的历史bar数量"""
+        return cls.lookback
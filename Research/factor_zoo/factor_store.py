@@ -0,0 +1,71 @@
+import os
+import json
+import hashlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class ParquetFactorStore(object):
+    """
+    本地parquet因子值存储
+    每组(factor, symbol, params, data_version)对应一个文件: factor=.../symbol=.../{key}.parquet,
+    key为参数和数据版本的hash, 原始的参数和数据版本写在parquet的schema metadata中
+    """
+    METADATA_KEY = b"factor_store"
+
+    def __init__(self, root="./factor_store"):
+        self.root = root
+
+    @staticmethod
+    def make_key(params: dict = None, data_version: str = ""):
+        payload = json.dumps({"params": params or {}, "data_version": data_version}, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+    def path(self, factor, symbol, params=None, data_version=""):
+        return os.path.join(self.root, f"factor={factor}", f"symbol={symbol}",
+                            f"{self.make_key(params, data_version)}.parquet")
+
+    def load(self, factor, symbol, params=None, data_version=""):
+        """
+        :return: 因子值DataFrame, 不存在时返回None
+        """
+        path = self.path(factor, symbol, params, data_version)
+        if not os.path.exists(path):
+            return None
+        # 目录名是hive分区格式, 不能让pyarrow把factor=...解析成分区列
+        return pq.read_table(path, partitioning=None).to_pandas()
+
+    def save(self, factor, symbol, df: pd.DataFrame, params=None, data_version=""):
+        """
+        整体覆盖写入; 先写临时文件再替换,中途失败不会留下不完整的文件
+        :return: 写入的行数
+        """
+        path = self.path(factor, symbol, params, data_version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if "timestamp" in df.columns:
+            df = df.assign(timestamp=df["timestamp"].astype(str))
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        meta = json.dumps({"factor": factor, "symbol": symbol, "params": params or {},
+                           "data_version": data_version}, sort_keys=True, default=str)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), self.METADATA_KEY: meta.encode("utf-8")})
+        tmp_path = f"{path}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+        return table.num_rows
+
+    def entries(self):
+        """
+        列出所有已存储的因子
+        :return: DataFrame(factor, symbol, params, data_version, rows, path)
+        """
+        rows = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in sorted(filenames):
+                if not filename.endswith(".parquet"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                parquet = pq.ParquetFile(path)
+                meta = json.loads(parquet.schema_arrow.metadata[self.METADATA_KEY])
+                rows.append({**meta, "rows": parquet.metadata.num_rows, "path": path})
+        return pd.DataFrame(rows, columns=["factor", "symbol", "params", "data_version", "rows", "path"])
@@ -9,6 +9,8 @@ from Research.factor_zoo.factor_base import FactorBase
 
 #### factors with correlation > 0.07 will be stored here
 class volatility_adjusted_momentum(FactorBase):
+    lookback = 21
+
     def __init__(self, df: pd.DataFrame):
         """
         :param name: volatility_adjusted_momentum
@@ -32,18 +34,22 @@ class time_decay_momentum(FactorBase):
         """
         super().__init__('time_decay_momentum', df)
 
+    @classmethod
+    def warmup(cls, window=30):
+        return window + 1
+
     def calculate_factor(self, window=30):
         weights = np.exp(np.linspace(0, -1, window)) 
         
-        def weighted_ret(series):
-            return (series * weights[::-1]).sum()
-        
-        self.signal_df['factor'] = self.signal_df['close'].pct_change().rolling(window).apply(weighted_ret)
+        # 最新的收益率权重为1, 最旧的为exp(-1)
+        self.signal_df['factor'] = opr.ts_weighted_sum(self.signal_df['close'].pct_change(), weights[::-1])
         
         return self.signal_df[['timestamp', 'factor', 'close']].copy()
 
 
 class abnormal_trade_volume(FactorBase):
+    lookback = 10
+
     def __init__(self, df: pd.DataFrame):
         """
         :param name: abnormal_trade_volume
@@ -67,17 +73,17 @@ class high_vol_time_decay_momentum(FactorBase):
         """
         super().__init__('high_vol_time_decay_momentum', df)
 
+    @classmethod
+    def warmup(cls, window=30):
+        return max(window, 30) + 1
+
     def calculate_factor(self, window=30):
         def time_decay_momentum(df, window=30):
             """时间衰减加权动量"""
-            df = df.copy()
             weights = np.exp(np.linspace(0, -1, window))  # 指数衰减权重
             
             # 计算加权收益率
-            def weighted_ret(series):
-                return (series * weights[::-1]).sum()
-            
-            return df['close'].pct_change().rolling(window).apply(weighted_ret)
+            return opr.ts_weighted_sum(df['close'].pct_change(), weights[::-1])
         
         ret = self.signal_df.close.pct_change()
         vol_ratio = opr.stddev(ret, 5) / opr.stddev(ret, 30)
@@ -97,6 +103,10 @@ class vol_weighted_deviation(FactorBase):
         """
         super().__init__('vol_weighted_deviation', df)
 
+    @classmethod
+    def warmup(cls, window=30):
+        return window
+
     def calculate_factor(self, window=30):
         avg_price = self.signal_df['close'].rolling(window).mean()
         vol_weight = self.signal_df['volume'] / (self.signal_df['volume'].rolling(window).sum() + 1e-6)
@@ -106,6 +116,9 @@ class vol_weighted_deviation(FactorBase):
 
 
 class breakout_strength(FactorBase):
+    # scale按整段数据归一化
+    incremental = False
+
     def __init__(self, df: pd.DataFrame):
         """
         :param name: breakout_strength
@@ -122,6 +135,8 @@ class breakout_strength(FactorBase):
     
 
 class path_efficiency(FactorBase):
+    lookback = 11
+
     def __init__(self, df: pd.DataFrame):
         """
         :param name: path_efficiency
@@ -138,6 +153,8 @@ class path_efficiency(FactorBase):
     
 
 class relative_volatility(FactorBase):
+    incremental = False
+
     def __init__(self, df: pd.DataFrame):
         """
         :param name: relative_volatility
@@ -0,0 +1,114 @@
+import inspect
+import numpy as np
+import pandas as pd
+
+from Research.factor_zoo.factor_base import FactorBase
+from Research.factor_zoo import factors as factor_module
+
+
+class FactorRegistry(object):
+    """
+    因子注册表: 自动发现模块中的FactorBase子类, 按类名计算因子
+    指定ParquetFactorStore和symbol时结果按(factor, symbol, params, data_version)缓存,
+    数据追加新bar后只重算尾部(向前多取warmup根bar), incremental=False的因子全量重算
+    """
+
+    def __init__(self, modules=(factor_module,)):
+        self._factors = dict()
+        for module in modules:
+            self.discover(module)
+
+    def discover(self, module):
+        """注册模块中定义的全部FactorBase子类"""
+        for _, obj in inspect.getmembers(module, inspect.isclass):
+            if issubclass(obj, FactorBase) and obj is not FactorBase and obj.__module__ == module.__name__:
+                self.register(obj)
+        return self
+
+    def register(self, cls):
+        """注册单个因子类, 可以作为装饰器使用"""
+        self._factors[cls.__name__] = cls
+        return cls
+
+    def names(self):
+        return list(self._factors)
+
+    def __contains__(self, name):
+        return name in self._factors
+
+    def __len__(self):
+        return len(self._factors)
+
+    def get(self, name):
+        if name not in self._factors:
+            raise KeyError(f"因子 {name} 未注册")
+        return self._factors[name]
+
+    def default_params(self, name):
+        """calculate_factor的默认参数"""
+        signature = inspect.signature(self.get(name).calculate_factor)
+        return {key: p.default for key, p in signature.parameters.items()
+                if key != 'self' and p.default is not inspect.Parameter.empty}
+
+    def compute(self, name, df, symbol=None, store=None, data_version="", **params):
+        """
+        计算单个因子
+        :param df: 包含timestamp和OHLCV的原始bar
+        :param store: ParquetFactorStore, 为None时不缓存
+        :param data_version: 数据版本, 原始数据被修正(而不只是追加)时需要更换
+        :return: DataFrame(timestamp, factor, close)
+        """
+        cls = self.get(name)
+        params = {**self.default_params(name), **params}
+        if store is None or symbol is None:
+            return cls(df).calculate_factor(**params)
+
+        cached = store.load(name, symbol, params, data_version)
+        if cached is None or len(cached) == 0:
+            result = cls(df).calculate_factor(**params)
+        else:
+            start = self._tail_start(cached, df, cls.warmup(**params))
+            if start is None:
+                return cached
+            if cls.incremental:
+                result = self._merge_tail(cached, cls(df.iloc[start:]).calculate_factor(**params))
+            else:
+                result = cls(df).calculate_factor(**params)
+        store.save(name, symbol, result, params, data_version)
+        return result
+
+    def compute_all(self, df, names=None, symbol=None, store=None, data_version=""):
+        """
+        计算多个因子(默认全部), 每个因子一列, 可以直接传给SignalAnalyzer.analyze_many
+        :return: DataFrame(timestamp, close, 因子名...)
+        """
+        names = self.names() if names is None else list(names)
+        out = None
+        for name in names:
+            result = self.compute(name, df, symbol=symbol, store=store, data_version=data_version)
+            if out is None:
+                out = result[['timestamp', 'close']].copy()
+            out[name] = result['factor'].to_numpy()
+        return out
+
+    @staticmethod
+    def _tail_start(cached, df, warmup):
+        """
+        FactorBase按1min重采样, 第k行对应第一根bar所在分钟之后的第k分钟
+        :return: 重算尾部时df的起始行, 没有新bar时返回None
+        """
+        timestamps = pd.to_datetime(df['timestamp'])
+        next_minute = pd.to_datetime(cached['timestamp'].iloc[0]).floor('1min') + pd.Timedelta(minutes=len(cached))
+        new_rows = np.flatnonzero((timestamps >= next_minute).to_numpy())
+        if len(new_rows) == 0:
+            return None
+        return max(new_rows[0] - warmup, 0)
+
+    @staticmethod
+    def _merge_tail(cached, tail):
+        """按分钟对齐, 只保留tail中缓存之后的行"""
+        first_minute = pd.to_datetime(cached['timestamp'].iloc[0]).floor('1min')
+        tail_minute = pd.to_datetime(tail['timestamp'].iloc[0]).floor('1min')
+        offset = len(cached) - int((tail_minute - first_minute) / pd.Timedelta(minutes=1))
+        tail = tail.iloc[offset:].assign(timestamp=tail['timestamp'].iloc[offset:].astype(str))
+        return pd.concat([cached, tail], ignore_index=True)
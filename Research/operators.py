@@ -1,6 +1,77 @@
 import pandas as pd
 import numpy as np
-from scipy.stats import rankdata
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 窗口不超过该长度时ts_rank直接在sliding window上比较,否则用pandas的滑动排名(跳表, O(n log w))
+RANK_VECTOR_WINDOW = 64
+# 向量化比较时每块处理的行数,限制临时数组大小
+RANK_CHUNK_SIZE = 65536
+
+
+def _invalid_windows(values: np.ndarray, window: int):
+    """
+    与rolling(window).apply的min_periods一致: 前window-1个位置以及窗口内含NaN的位置输出NaN
+    """
+    nan_count = np.concatenate([[0], np.cumsum(np.isnan(values))])
+    invalid = np.ones(len(values), dtype=bool)
+    if len(values) >= window:
+        invalid[window - 1:] = (nan_count[window:] - nan_count[:-window]) > 0
+    return invalid
+
+
+def rolling_values(values: np.ndarray, window: int, func):
+    """
+    在完整窗口上计算func(values, window),返回与values等长的float64数组
+    func返回长度为len(values)-window+1的数组,对应每个窗口的末尾位置
+    """
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        out[window - 1:] = func(values, window)
+        out[_invalid_windows(values, window)] = np.nan
+    return out
+
+
+def _rolling_output(series: pd.Series, window: int, func):
+    """rolling_values的pd.Series版本"""
+    return pd.Series(rolling_values(series.to_numpy(dtype=np.float64), window, func), index=series.index)
+
+
+def _window_argmax(values, window):
+    return (window - 1) - np.argmax(sliding_window_view(values, window), axis=1)
+
+
+def _window_argmin(values, window):
+    return (window - 1) - np.argmin(sliding_window_view(values, window), axis=1)
+
+
+def _window_decay(values, window):
+    # weights[0]对应窗口最旧的值,与np.dot(x, weights)一致
+    weights = np.arange(window, 0, -1, dtype=np.float64)
+    return np.convolve(values, weights[::-1], mode='valid') / weights.sum()
+
+
+def _window_rank(values, window):
+    """
+    当前值在窗口中的平均排名(与rankdata(x)[-1]一致): 小于当前值的个数 + (等于当前值的个数 + 1) / 2
+    """
+    # NaN所在的窗口最终会被置为NaN,这里先替换掉避免破坏排序
+    values = np.where(np.isnan(values), 0.0, values)
+    if window > RANK_VECTOR_WINDOW:
+        ranks = pd.Series(values).rolling(window).rank(method='average').to_numpy()
+        return ranks[window - 1:] / window
+
+    n = len(values) - window + 1
+    less = np.empty(n)
+    equal = np.empty(n)
+    windows = sliding_window_view(values, window)
+    for start in range(0, n, RANK_CHUNK_SIZE):
+        block = windows[start:start + RANK_CHUNK_SIZE]
+        current = block[:, -1:]
+        less[start:start + RANK_CHUNK_SIZE] = (block < current).sum(axis=1)
+        equal[start:start + RANK_CHUNK_SIZE] = (block == current).sum(axis=1)
+
+    return (less + (equal + 1) / 2) / window
+
 
 class OperatorSuite:
     @staticmethod
@@ -10,21 +81,13 @@ class OperatorSuite:
     
     @staticmethod
     def ts_argmax(series: pd.Series, window: int):
-        """最大值位置(距离当前时间)"""
-        def _argmax(x):
-            if len(x) < window:
-                return np.nan
-            idx = np.argmax(x)
-            return (window - 1) - idx  # 0=当前时间,window-1=窗口最旧时间
-        return series.rolling(window).apply(_argmax, raw=True)
+        """最大值位置(距离当前时间), 0=当前时间,window-1=窗口最旧时间"""
+        return _rolling_output(series, window, _window_argmax)
 
     @staticmethod
     def ts_rank(series: pd.Series, window: int):
-        """时间序列百分位排名"""
-        return series.rolling(window).apply(
-            lambda x: rankdata(x)[-1]/window,  # 当前值在窗口中的排名
-            raw=True
-        )
+        """时间序列百分位排名, 当前值在窗口中的排名/window"""
+        return _rolling_output(series, window, _window_rank)
 
     @staticmethod
     def delay(series: pd.Series, periods: int):
@@ -64,11 +127,14 @@ class OperatorSuite:
 
     @staticmethod
     def decay_linear(series: pd.Series, window: int):
-        """线性衰减加权平均"""
-        weights = np.arange(window, 0, -1)
-        def _apply_decay(x):
-            return np.dot(x, weights) / weights.sum()
-        return series.rolling(window).apply(_apply_decay, raw=True)
+        """线性衰减加权平均, 权重window..1对应窗口最旧..当前"""
+        return _rolling_output(series, window, _window_decay)
+
+    @staticmethod
+    def ts_weighted_sum(series: pd.Series, weights):
+        """窗口加权求和, weights[0]对应窗口最旧的值, 与rolling(len(weights)).apply(lambda x: (x * weights).sum())一致"""
+        weights = np.asarray(weights, dtype=np.float64)
+        return _rolling_output(series, len(weights), lambda values, window: np.convolve(values, weights[::-1], mode='valid'))
 
     @staticmethod
     def stddev(series: pd.Series, window: int):
@@ -108,12 +174,7 @@ class OperatorSuite:
     @staticmethod
     def ts_argmin(series: pd.Series, window: int):
         """最小值位置(距离当前时间)"""
-        def _argmin(x):
-            if len(x) < window:
-                return np.nan
-            idx = np.argmin(x)
-            return (window - 1) - idx
-        return series.rolling(window).apply(_argmin, raw=True)
+        return _rolling_output(series, window, _window_argmin)
 
 
 if __name__ == '__main__':
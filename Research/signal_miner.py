@@ -1,27 +1,80 @@
+import os
 import random
 import numpy as np
 import pandas as pd
 from deap import base, creator, tools, algorithms
 from typing import List, Callable, Union, Dict, Set
+from multiprocessing import Pool, shared_memory
 import sys
 sys.path.append("..")  # 添加上级目录到Python路径
 from Research.operators import OperatorSuite
+from Research.expression_cache import ExpressionCache, expression_key, merge_stats
+from Research.expression_compiler import NumpyExpressionEvaluator, fill_invalid
+from Research.batch_scorer import score_signals, rolling_corr, batch_columns
 import warnings
 warnings.filterwarnings("ignore")
 
+# 并行评估时每个worker进程中的SignalMiner, 数据来自共享内存
+_WORKER_MINER = None
+_WORKER_SHM = None
+
+
+def _init_worker(shm_name: str, shape: tuple, columns: List[str], index: pd.Index,
+                 feature_columns: List[str], cache_max_bytes: int, backend: str):
+    """
+    worker进程初始化: 挂载共享内存中的特征矩阵,构造只用于评估的SignalMiner
+    特征数据只在进程启动时挂载一次,不随每个任务pickle
+    """
+    global _WORKER_MINER, _WORKER_SHM
+    # 共享内存由主进程创建和释放, worker只挂载
+    _WORKER_SHM = shared_memory.SharedMemory(name=shm_name)
+    values = np.ndarray(shape, dtype=np.float64, buffer=_WORKER_SHM.buf)
+    data = pd.DataFrame(values, index=index, columns=columns, copy=False)
+    _WORKER_MINER = SignalMiner(data, exclude_columns=set(columns) - set(feature_columns),
+                                cache_max_bytes=cache_max_bytes, backend=backend)
+
+
+def _evaluate_in_worker(exprs: List) -> tuple:
+    """:return: (pid, worker缓存的累计stats, fitness列表)"""
+    fitnesses = _WORKER_MINER._evaluate_population(exprs)
+    return os.getpid(), _WORKER_MINER.expr_cache.stats(), fitnesses
+
+
+def future_returns(close: pd.Series) -> pd.Series:
+    """下一根bar的收益率, 等价于 close.pct_change(1).shift(-1)"""
+    close = close.ffill()
+    return (close / close.shift(1) - 1).shift(-1)
+
+
 class SignalMiner:
-    def __init__(self, data: pd.DataFrame, exclude_columns: Set[str] = {'timestamp'}):
+    def __init__(self, data: pd.DataFrame, exclude_columns: Set[str] = {'timestamp'},
+                 cache_max_bytes: int = 256 * 1024 ** 2, backend: str = 'numpy'):
         """
         初始化信号挖掘器
         
         Args:
             data: 输入数据DataFrame,可以包含OHLCV及其他特征列
             exclude_columns: 不参与特征挖掘的列名集合
+            cache_max_bytes: 子表达式缓存占用的最大字节数, 0表示不缓存
+            backend: 表达式执行方式, 'numpy'编译成float64数组上的kernel调用, 'pandas'逐节点在Series上计算
         """
+        if backend not in ('numpy', 'pandas'):
+            raise ValueError(f"unknown backend: {backend}")
         self.data = data
         self.ops = OperatorSuite()
+        self.backend = backend
+        self.expr_cache = ExpressionCache(cache_max_bytes)
+        self.evaluator = NumpyExpressionEvaluator(data, self.expr_cache)
+        # 最近一次mine_signals的缓存命中情况(并行时包含各worker的缓存)
+        self.cache_stats = None
+        self._worker_cache_stats = dict()
         self.feature_columns = [col for col in data.columns if col not in exclude_columns]
         self.setup_deap()
+
+        # 未来收益只计算一次; 评估时使用去掉inf并ffill/bfill后的数组
+        return_column = 'close' if 'close' in data.columns else self.feature_columns[0]
+        self.future_returns = future_returns(data[return_column])
+        self.eval_returns = fill_invalid(self.future_returns.to_numpy(dtype=np.float64))
         
         # 定义可用的基础运算符
         self.basic_operators = {
@@ -75,6 +128,7 @@ class SignalMiner:
         
         # 注册遗传算法操作符
         self.toolbox.register("evaluate", self._evaluate)
+        self.toolbox.register("map", self._batch_map)
         self.toolbox.register("mate", tools.cxTwoPoint)
         self.toolbox.register("mutate", self._mutate)
         self.toolbox.register("select", tools.selTournament, tournsize=3)
@@ -108,56 +162,75 @@ class SignalMiner:
 
     def _evaluate(self, individual: List) -> tuple:
         """评估信号表达式的性能"""
+        return self._evaluate_population([individual])[0]
+
+    def _signal_values(self, expr: List):
+        """执行表达式, 返回float64数组, 无效表达式返回None"""
         try:
-            signal = self._execute_expression(individual)
-            if signal is None or signal.isnull().all() or signal.isna().all():
-                return (-np.inf,)
-            
-            # 移除无效值
-            signal = signal.replace([np.inf, -np.inf], np.nan)
-            signal = signal.fillna(method='ffill').fillna(method='bfill')
-            
-            if signal.isnull().any() or signal.std() == 0:
-                return (-np.inf,)
-            
-            # 计算信号与未来收益的IC值
-            if 'close' in self.data.columns:
-                future_returns = self.data['close'].pct_change(1).shift(-1)
-            else:
-                future_returns = self.data[self.feature_columns[0]].pct_change(1).shift(-1)
-            
-            # 确保未来收益有效
-            future_returns = future_returns.replace([np.inf, -np.inf], np.nan)
-            future_returns = future_returns.fillna(method='ffill').fillna(method='bfill')
-            
-            # 使用非空值计算相关性
-            valid_mask = ~(signal.isna() | future_returns.isna())
-            if valid_mask.sum() < 10:  # 要求至少10个有效观测
-                return (-np.inf,)
-                
-            ic = signal[valid_mask].corr(future_returns[valid_mask])
-            if np.isnan(ic):
-                return (-np.inf,)
-                
-            # 计算信息比率 (IR)
-            rolling_ic = signal.rolling(20).corr(future_returns)
-            ir = rolling_ic.mean() / (rolling_ic.std() + 1e-8)
-            
-            # 计算信号的自相关性惩罚项
-            autocorr = signal.autocorr(lag=1)
-            penalty = abs(autocorr) if not np.isnan(autocorr) else 1
-            
-            # 综合得分 = IC + IR - 自相关性惩罚
-            # 对所有指标使用 tanh 进行归一化，避免极端值
-            score = np.tanh(ic) + 0.5 * np.tanh(ir) - 0.3 * penalty
-            
-            return (score,)
+            if self.backend == 'numpy':
+                return self.evaluator.evaluate(expr)
+            signal = self._execute_expression(expr)
+            return None if signal is None else signal.to_numpy(dtype=np.float64)
         except Exception as e:
             # print(f"评估出错: {str(e)}")  # 用于调试
-            return (-np.inf,)
+            return None
+
+    def _evaluate_population(self, individuals: List) -> List[tuple]:
+        """
+        批量评估: 一批个体的信号按列堆叠成二维数组,
+        IC/rolling IC/自相关在batch_scorer中对所有列一次计算
+        """
+        fitnesses = [(-np.inf,)] * len(individuals)
+        batch = batch_columns(len(self.data))
+        for start in range(0, len(individuals), batch):
+            columns, positions = [], []
+            for i in range(start, min(start + batch, len(individuals))):
+                signal = self._signal_values(individuals[i])
+                if signal is not None and not np.isnan(signal).all():
+                    columns.append(signal)
+                    positions.append(i)
+            if not columns:
+                continue
+            scores = score_signals(np.column_stack(columns), self.eval_returns, window=20)
+            for i, score in zip(positions, scores):
+                fitnesses[i] = (float(score),)
+        return fitnesses
+
+    def _batch_map(self, func, individuals):
+        """
+        注册到toolbox的map: eaSimple每代用它评估需要重新计算的个体, 整代一起打分
+        """
+        if func is not self.toolbox.evaluate:
+            return list(map(func, individuals))
+        return self._evaluate_population(list(individuals))
 
     def _execute_expression(self, expr: List) -> pd.Series:
-        """执行信号表达式并返回结果"""
+        """
+        执行信号表达式并返回结果
+        种群中大量个体共享相同的子表达式,运算符节点的结果按规范化后的表达式缓存
+        """
+        if self.backend == 'numpy':
+            values = self.evaluator.evaluate(expr)
+            return None if values is None else pd.Series(values, index=self.data.index)
+
+        if isinstance(expr, str) or self.expr_cache.max_bytes <= 0:
+            return self._compute_expression(expr)
+
+        key = expression_key(expr)
+        hit, values = self.expr_cache.get(key)
+        if hit:
+            return None if values is None else pd.Series(values, index=self.data.index)
+
+        result = self._compute_expression(expr)
+        try:
+            self.expr_cache.put(key, None if result is None else result.to_numpy(dtype=np.float64, copy=True))
+        except (TypeError, ValueError):
+            # 非数值结果不缓存
+            pass
+        return result
+
+    def _compute_expression(self, expr: List) -> pd.Series:
+        """计算表达式节点, 子表达式通过_execute_expression计算"""
         try:
             if isinstance(expr, str):  # 基础特征列
                 return self.data[expr]
@@ -233,11 +306,46 @@ class SignalMiner:
             individual[:] = mutate_subexpr(individual[:])
         return individual,
 
+    def _share_data(self):
+        """
+        将评估需要的列复制到共享内存, 返回 (SharedMemory, shape, columns)
+        """
+        columns = list(self.feature_columns)
+        if 'close' in self.data.columns and 'close' not in columns:
+            columns.append('close')
+        values = self.data[columns].to_numpy(dtype=np.float64)
+        shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf)[:] = values
+        return shm, values.shape, columns
+
+    def _parallel_map(self, pool: Pool, n_jobs: int):
+        """
+        生成注册到toolbox的map: 个体转换为普通list后分块发送到worker, 每块在worker中批量打分
+        pool.map保持输入顺序,结果与串行评估一致
+        worker返回的缓存stats是累计值, 每个worker保留查询次数最多的一份
+        """
+        def _map(func, individuals):
+            if func is not self.toolbox.evaluate:
+                return list(map(func, individuals))
+            exprs = [list(ind) for ind in individuals]
+            size = max(1, -(-len(exprs) // (n_jobs * 4)))
+            chunks = [exprs[i:i + size] for i in range(0, len(exprs), size)]
+            fitnesses = []
+            for pid, stats, chunk in pool.map(_evaluate_in_worker, chunks):
+                previous = self._worker_cache_stats.get(pid)
+                if previous is None or previous['hits'] + previous['misses'] < stats['hits'] + stats['misses']:
+                    self._worker_cache_stats[pid] = stats
+                fitnesses.extend(chunk)
+            return fitnesses
+        return _map
+
     def mine_signals(self, 
                     population_size: int = 50, 
                     generations: int = 30, 
                     n_best: int = 3,
-                    verbose: bool = True) -> Dict:
+                    verbose: bool = True,
+                    n_jobs: int = 1,
+                    seed: int = None) -> Dict:
         """
         运行遗传算法挖掘信号
         
@@ -246,10 +354,17 @@ class SignalMiner:
             generations: 迭代代数
             n_best: 保留最优信号的数量
             verbose: 是否打印进度信息
+            n_jobs: 评估个体的进程数, 大于1时使用进程池并行评估(特征数据通过共享内存传给worker)
+            seed: 随机种子, 相同seed下串行和并行的结果一致
             
         Returns:
             dict: 包含最优信号表达式及其性能指标
+            子表达式缓存的命中情况保存在self.cache_stats(并行时合并各worker的缓存)
         """
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed)
+
         pop = self.toolbox.population(n=population_size)
         hof = tools.HallOfFame(n_best)
         
@@ -258,22 +373,43 @@ class SignalMiner:
         stats.register("avg", np.mean)
         stats.register("max", np.max)
         
-        # 运行遗传算法
-        pop, logbook = algorithms.eaSimple(
-            pop, self.toolbox,
-            cxpb=0.7,  # 交叉概率
-            mutpb=0.3,  # 突变概率
-            ngen=generations,
-            stats=stats,
-            halloffame=hof,
-            verbose=verbose
-        )
+        pool = None
+        shm = None
+        self._worker_cache_stats = dict()
+        if n_jobs > 1:
+            shm, shape, columns = self._share_data()
+            pool = Pool(n_jobs, initializer=_init_worker,
+                        initargs=(shm.name, shape, columns, self.data.index,
+                                  self.feature_columns, self.expr_cache.max_bytes, self.backend))
+            self.toolbox.register("map", self._parallel_map(pool, n_jobs))
+
+        try:
+            # 运行遗传算法
+            pop, logbook = algorithms.eaSimple(
+                pop, self.toolbox,
+                cxpb=0.7,  # 交叉概率
+                mutpb=0.3,  # 突变概率
+                ngen=generations,
+                stats=stats,
+                halloffame=hof,
+                verbose=verbose
+            )
+        finally:
+            if pool is not None:
+                self.toolbox.register("map", self._batch_map)
+                pool.close()
+                pool.join()
+                shm.close()
+                shm.unlink()
         
         # 返回最优结果
         best_results = []
         for expr in hof:
             signal = self._execute_expression(expr)
-            future_returns = self.data['close'].pct_change(1).shift(-1) if 'close' in self.data.columns else None
+            if signal is None or not np.isfinite(expr.fitness.values[0]):
+                # 无效表达式(fitness为-inf)也可能进入HallOfFame,不返回
+                continue
+            future_returns = self.future_returns if 'close' in self.data.columns else None
             
             result = {
                 'expression': expr,
@@ -292,7 +428,14 @@ class SignalMiner:
                 })
             
             best_results.append(result)
-        
+
+        # 子表达式缓存命中情况
+        cache_stats = merge_stats([self.expr_cache.stats()] + list(self._worker_cache_stats.values()))
+        self.cache_stats = cache_stats
+        if verbose:
+            print(f"expression cache: hit rate {cache_stats['hit_rate']:.2%}, "
+                  f"{cache_stats['entries']} entries, {cache_stats['bytes'] / 1024 ** 2:.1f} MB")
+
         return best_results
 
     def explain_expression(self, expr: List) -> str:
@@ -1,7 +1,22 @@
+import os
+import warnings
 import pandas as pd
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
-from scipy.stats import pearsonr
+from multiprocessing import Pool
+
+
+def _init_plot_worker():
+    # 子进程只保存图片,不需要交互式后端
+    matplotlib.use('Agg')
+
+
+def _plot_factor(task):
+    freq, roll_window, n_strata, df, intraday_stats, stratified_df, ret_decay, corr_decay, \
+        ret_decay_windows, corr_decay_windows, save_path = task
+    SignalAnalyzer(freq, roll_window, n_strata)._plot_results(df, intraday_stats, stratified_df, ret_decay, corr_decay,
+                                                              ret_decay_windows, corr_decay_windows, save_path)
 
 
 class SignalAnalyzer:
@@ -22,7 +37,7 @@ class SignalAnalyzer:
         self.n_strata = n_strata
         self.strata_labels = [f'Q{i+1}' for i in range(n_strata)]
 
-    def preprocess_data(self, df):
+    def preprocess_data(self, df, factor_columns=('factor',)):
         """高频数据预处理"""
         # 转换为分钟级时间序列
         if not isinstance(df.index, pd.DatetimeIndex):
@@ -30,7 +45,8 @@ class SignalAnalyzer:
         df = df.resample(self.freq).last()
         
         # 处理缺失值
-        df['factor'] = df['factor'].ffill().bfill()
+        for column in factor_columns:
+            df[column] = df[column].ffill().bfill()
         df['close'] = df['close'].ffill().bfill()
         return df
 
@@ -42,16 +58,69 @@ class SignalAnalyzer:
         return df
 
     @staticmethod
-    def _rolling_corr(factor, returns, window):
-        """滚动窗口的Pearson相关系数"""
+    def _rolling_corr(factor, returns, window, min_valid=5):
+        """
+        滚动窗口的Pearson相关系数, 位置i使用[i-window, i)内factor和returns同时有效的样本,
+        有效样本少于min_valid或窗口内方差为0时为NaN
+        基于累计和的一阶/二阶矩, O(n)
+        """
+        factor = np.asarray(factor, dtype=np.float64)
+        returns = np.asarray(returns, dtype=np.float64)
         n = len(factor)
         corr = np.full(n, np.nan)
-        for i in range(window, n):
-            valid = ~np.isnan(factor[i-window:i]) & ~np.isnan(returns[i-window:i])
-            if valid.sum() < 5: continue
-            corr[i] = pearsonr(factor[i-window:i][valid], returns[i-window:i][valid])[0]
+        if n <= window:
+            return corr
+
+        valid = ~np.isnan(factor) & ~np.isnan(returns)
+        if not valid.any():
+            return corr
+        # 先减去有效样本的均值,减小累计和相减时的精度损失
+        x = np.where(valid, factor - factor[valid].mean(), 0.0)
+        y = np.where(valid, returns - returns[valid].mean(), 0.0)
+
+        def window_sum(values):
+            c = np.concatenate([[0.0], np.cumsum(values)])
+            return c[window:n] - c[:n - window]
+
+        count = window_sum(valid.astype(np.float64))
+        sx, sy = window_sum(x), window_sum(y)
+        sxx, syy, sxy = window_sum(x * x), window_sum(y * y), window_sum(x * y)
+        with np.errstate(all='ignore'):
+            vx = sxx - sx * sx / count
+            vy = syy - sy * sy / count
+            cov = sxy - sx * sy / count
+            result = np.clip(cov / np.sqrt(vx * vy), -1, 1)
+        # 常数窗口(相对累计和误差可以忽略的方差)与pearsonr一样返回NaN
+        result[(count < min_valid) | (vx <= 1e-10 * sxx) | (vy <= 1e-10 * syy)] = np.nan
+        corr[window:] = result
         return corr
 
+    @staticmethod
+    def _future_mean_returns(close, windows):
+        """
+        一次计算所有窗口的未来收益, 第j列与get_ret_interval(df, windows[j]).ret一致:
+        ret[i] = mean(close[i+1 : i+win+1]) / close[i] - 1
+        :return: (n, len(windows))
+        """
+        close = np.asarray(close, dtype=np.float64)
+        n = len(close)
+        valid = ~np.isnan(close)
+        c = np.concatenate([[0.0], np.cumsum(np.where(valid, close, 0.0))])
+        c_valid = np.concatenate([[0], np.cumsum(valid)])
+
+        rets = np.full((n, len(windows)), np.nan)
+        for j, win in enumerate(windows):
+            win = int(win)
+            if win < 1 or win >= n:
+                continue
+            m = n - win
+            # 窗口内有NaN时rolling mean为NaN
+            full = (c_valid[win + 1:] - c_valid[1:m + 1]) == win
+            with np.errstate(all='ignore'):
+                mean = (c[win + 1:] - c[1:m + 1]) / win
+                rets[:m, j] = np.where(full, mean / close[:m] - 1, np.nan)
+        return rets
+
     def _stratified_analysis(self, df):
         """执行自动分层测试"""
         df['strata'] = pd.qcut(df['factor'], q=self.n_strata, labels=self.strata_labels)
@@ -66,6 +135,46 @@ class SignalAnalyzer:
             })
         return pd.DataFrame(stats)
 
+    def _stratify_many(self, factors, ret):
+        """
+        多个因子同时分层, 分层边界与pd.qcut一致; 分位数边界重复(因子取值过于集中)时该因子不分层,结果为NaN
+        :param factors: (n, F)
+        :return: 每个因子一个与_stratified_analysis格式相同的DataFrame
+        """
+        with np.errstate(all='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            edges = np.nanquantile(factors, np.linspace(0, 1, self.n_strata + 1), axis=0)
+        usable = (np.diff(edges, axis=0) > 0).all(axis=0)
+
+        # 区间为(e_i, e_i+1], 最小值归入第一层
+        strata = np.zeros(factors.shape, dtype=np.int64)
+        for edge in edges[1:-1]:
+            strata += factors > edge
+        strata[np.isnan(factors)] = -1
+
+        ret_valid = ~np.isnan(ret)[:, None]
+        positive = (ret > 0)[:, None]
+        ret_filled = np.where(ret_valid, ret[:, None], 0.0)
+        mean_ret = np.full((self.n_strata, factors.shape[1]), np.nan)
+        hit_rate = np.full((self.n_strata, factors.shape[1]), np.nan)
+        samples = np.zeros((self.n_strata, factors.shape[1]), dtype=np.int64)
+        with np.errstate(all='ignore'):
+            for k in range(self.n_strata):
+                in_stratum = strata == k
+                samples[k] = in_stratum.sum(axis=0)
+                mean_ret[k] = (in_stratum * ret_filled).sum(axis=0) / (in_stratum & ret_valid).sum(axis=0)
+                hit_rate[k] = (in_stratum & positive).sum(axis=0) / samples[k]
+        mean_ret[:, ~usable] = np.nan
+        hit_rate[:, ~usable] = np.nan
+        samples[:, ~usable] = 0
+
+        return [pd.DataFrame({
+            'Strata': self.strata_labels,
+            'Mean Return': mean_ret[:, j],
+            'Hit Rate': hit_rate[:, j],
+            'Samples': samples[:, j]
+        }) for j in range(factors.shape[1])]
+
     def analyze(self, df, ret_decay_windows=np.linspace(1, 240, 12), corr_decay_windows=np.linspace(1, 240, 12)):
         """执行完整分析"""
         # 数据预处理
@@ -106,9 +215,102 @@ class SignalAnalyzer:
         
         return df, stratified_df
 
+    def analyze_many(self, df, factor_columns, ret_decay_windows=np.linspace(1, 240, 12),
+                     corr_decay_windows=np.linspace(1, 240, 12), plot=False, plot_dir=None, n_jobs=1):
+        """
+        多因子批量分析, 每个因子的结果与单独调用analyze(该列作为factor)一致
+        预处理和未来收益矩阵只计算一次, 收益衰减/相关性衰减/分层对所有因子向量化计算
+
+        参数：
+        factor_columns : list
+            因子列名
+        plot : bool
+            是否画图; 指定plot_dir时每个因子保存为 {plot_dir}/{因子名}.png, 否则直接显示
+        n_jobs : int
+            保存图片时的进程数
+        返回：
+        summary : pd.DataFrame
+            每个因子一行的汇总统计
+        results : dict
+            因子名 -> {'corr', 'stratified', 'ret_decay', 'corr_decay'}
+        """
+        factor_columns = list(factor_columns)
+        df = self.preprocess_data(df, factor_columns)
+        df = self.get_ret_interval(df, interval=10)
+        factors = df[factor_columns].to_numpy(dtype=np.float64)
+        ret = df['ret'].to_numpy(dtype=np.float64)
+
+        corr = np.column_stack([self._rolling_corr(factors[:, j], ret, self.roll_window)
+                                for j in range(len(factor_columns))])
+        ret_decay = self._quantile_ret_decay(factors, df['close'], np.linspace(0, 1, 10), ret_decay_windows)
+        corr_decay = self._corr_decay_many(df, factor_columns, factors, corr, corr_decay_windows)
+        stratified = self._stratify_many(factors, ret)
+
+        results = dict()
+        for j, column in enumerate(factor_columns):
+            results[column] = {
+                'corr': pd.Series(corr[:, j], index=df.index),
+                'stratified': stratified[j],
+                'ret_decay': ret_decay[j],
+                'corr_decay': corr_decay[j],
+            }
+        corr_df = pd.DataFrame(corr, columns=factor_columns)
+        summary = pd.DataFrame({
+            'Mean Correlation': corr_df.mean(),
+            'Corr Std': corr_df.std(),
+            'Long Short Return': [s['Mean Return'].iloc[-1] - s['Mean Return'].iloc[0] for s in stratified],
+            'Total Samples': len(df),
+        })
+        summary.index.name = 'factor'
+
+        if plot:
+            self._plot_many(df.index, results, ret_decay_windows, corr_decay_windows, plot_dir, n_jobs)
+        return summary, results
+
+    def _corr_decay_many(self, df, factor_columns, factors, corr, windows):
+        """
+        与calc_corr_decay一致: 每个因子在(除其他因子列外)没有NaN的行上计算
+        dropna之后行相同的因子共用一份未来收益矩阵
+        :return: (F, len(windows)), 第一个窗口为NaN
+        """
+        shared_valid = df.drop(columns=factor_columns).notna().all(axis=1).to_numpy()
+        valid = shared_valid[:, None] & ~np.isnan(factors) & ~np.isnan(corr)
+        close = df['close'].to_numpy(dtype=np.float64)
+
+        corr_decay = np.full((len(factor_columns), len(windows)), np.nan)
+        groups = dict()
+        for j in range(len(factor_columns)):
+            groups.setdefault(valid[:, j].tobytes(), []).append(j)
+        for columns in groups.values():
+            rows = valid[:, columns[0]]
+            rets = self._future_mean_returns(close[rows], windows[1:])
+            corr_decay[columns, 1:] = self._prefix_corr(factors[rows][:, columns], rets, windows[1:])
+        return corr_decay
+
+    def _plot_many(self, index, results, ret_decay_windows, corr_decay_windows, plot_dir=None, n_jobs=1):
+        """逐因子画图, 保存到文件时可以用进程池并行"""
+        corr = pd.DataFrame({column: result['corr'] for column, result in results.items()}, index=index)
+        intraday = corr.groupby(index.time).agg(['mean', 'count'])
+        tasks = []
+        for column, result in results.items():
+            plot_df = pd.DataFrame({'corr': corr[column], 'cum_corr': corr[column].expanding().sum()})
+            save_path = None if plot_dir is None else os.path.join(plot_dir, f'{column}.png')
+            tasks.append((self.freq, self.roll_window, self.n_strata, plot_df, intraday[column].copy(),
+                          result['stratified'], result['ret_decay'], result['corr_decay'],
+                          ret_decay_windows, corr_decay_windows, save_path))
+
+        if plot_dir is not None:
+            os.makedirs(plot_dir, exist_ok=True)
+        if plot_dir is None or n_jobs <= 1:
+            for task in tasks:
+                _plot_factor(task)
+        else:
+            with Pool(n_jobs, initializer=_init_plot_worker) as pool:
+                pool.map(_plot_factor, tasks)
+
     def _plot_results(self, df, intraday_stats, stratified_df, ret_decay, corr_decay,
-                     ret_decay_windows, corr_decay_windows):
-        """生成可视化图表(整合衰减分析)"""
+                     ret_decay_windows, corr_decay_windows, save_path=None):
+        """生成可视化图表(整合衰减分析), 指定save_path时保存到文件而不显示"""
         plt.figure(figsize=(20, 30))
         
         # 滚动相关性时序图
@@ -184,18 +386,41 @@ class SignalAnalyzer:
         plt.grid(alpha=0.3)
 
         plt.tight_layout()
-        plt.show()
+        if save_path is None:
+            plt.show()
+        else:
+            plt.savefig(save_path)
+            plt.close()
 
     def calc_ret_decay_by_quantile(self, df, quantiles=np.linspace(0, 1, 11), windows=np.linspace(0, 240, 31)):
-        """计算不同时间窗口的分位数收益衰减"""
-        sig_decay = np.zeros((len(windows), len(quantiles)-1))
-        for win_idx, win in enumerate(windows):
-            df_win = self.get_ret_interval(df, interval=win)
-            df_win = df_win.sort_values(by=['factor'])
-            for q_idx in range(len(quantiles)-1):
-                low = int(quantiles[q_idx] * len(df_win))
-                high = int(quantiles[q_idx+1] * len(df_win))
-                sig_decay[win_idx, q_idx] = df_win.iloc[low:high].ret.mean()
+        """
+        计算不同时间窗口的分位数收益衰减
+        因子只排序一次, 所有窗口的未来收益按排序后的累计和一次求出各分位数的均值
+        """
+        factors = df[['factor']].to_numpy(dtype=np.float64)
+        return self._quantile_ret_decay(factors, df['close'], quantiles, windows)[0]
+
+    def _quantile_ret_decay(self, factors, close, quantiles, windows):
+        """
+        多个因子共用一份未来收益矩阵的分位数收益衰减
+        :param factors: (n, F)
+        :return: (F, len(windows), len(quantiles)-1)
+        """
+        rets = self._future_mean_returns(close, windows)
+        n = len(rets)
+        bounds = [int(q * n) for q in quantiles]
+        low, high = np.array(bounds[:-1]), np.array(bounds[1:])
+
+        sig_decay = np.empty((factors.shape[1], len(windows), len(quantiles) - 1))
+        for j in range(factors.shape[1]):
+            order = np.argsort(factors[:, j], kind='stable')  # NaN排在最后
+            sorted_rets = rets[order]
+            valid = ~np.isnan(sorted_rets)
+            ret_sum = np.vstack([np.zeros(len(windows)), np.cumsum(np.where(valid, sorted_rets, 0.0), axis=0)])
+            ret_count = np.vstack([np.zeros(len(windows)), np.cumsum(valid, axis=0)])
+            with np.errstate(all='ignore'):
+                # (len(quantiles)-1, len(windows)) -> (len(windows), len(quantiles)-1)
+                sig_decay[j] = ((ret_sum[high] - ret_sum[low]) / (ret_count[high] - ret_count[low])).T
         return sig_decay
 
     # def calc_corr_decay(self, df, windows=np.linspace(0, 60, 31)):
@@ -208,12 +433,44 @@ class SignalAnalyzer:
     #         corr_decay.append(corr)
     #     return corr_decay
     def calc_corr_decay(self, df, windows=np.linspace(0, 240, 31)):
-        df = df.copy()
+        """
+        计算相关性随时间衰减, 第一个窗口固定为NaN
+        窗口win的相关性使用dropna之后的前 n-win-1 个样本, 所有窗口一次计算
+        """
         df = df.dropna(how='any')
-        corr_decay = [np.nan] + [pearsonr(df.factor[:-int(win)-1], self.get_ret_interval(df, win).ret[:-int(win)-1])[0] \
-                        for win in windows[1:]]
+        factors = df[['factor']].to_numpy(dtype=np.float64)
+        corr = self._prefix_corr(factors, self._future_mean_returns(df['close'], windows[1:]), windows[1:])
+        return [np.nan] + corr[0].tolist()
 
-        return corr_decay
+    @staticmethod
+    def _prefix_corr(factors, rets, windows):
+        """
+        第j个窗口取前 n-windows[j]-1 行, 计算每个因子与rets[:, j]的Pearson相关系数
+        前缀和给出因子的一阶/二阶矩, 交叉项用一次矩阵乘法求出; 样本不足两个或方差为0时为NaN
+        :param factors: (n, F), 不含NaN
+        :param rets: (n, len(windows)), 前缀内不含NaN
+        :return: (F, len(windows))
+        """
+        n = len(factors)
+        lengths = np.clip([n - int(win) - 1 for win in windows], 0, n)
+        mask = np.arange(n)[:, None] < lengths
+
+        # 先减去全局均值,减小前缀和相减时的精度损失
+        x = factors - factors.mean(axis=0) if n else factors
+        cx = np.vstack([np.zeros(x.shape[1]), np.cumsum(x, axis=0)])
+        cxx = np.vstack([np.zeros(x.shape[1]), np.cumsum(x * x, axis=0)])
+        sx, sxx = cx[lengths].T, cxx[lengths].T
+        with np.errstate(all='ignore'):
+            y = np.where(mask, rets, 0.0)
+            y = np.where(mask, y - y.sum(axis=0) / lengths, 0.0)
+            syy = (y * y).sum(axis=0)
+            sy = y.sum(axis=0)
+            vx = sxx - sx * sx / lengths
+            cov = x.T @ y - sx * sy / lengths
+            corr = np.clip(cov / np.sqrt(vx * syy), -1, 1)
+        # 常数因子(相对前缀和误差可以忽略的方差)与pearsonr一样返回NaN
+        corr[(vx <= 1e-10 * sxx) | (syy == 0) | (lengths < 2)] = np.nan
+        return corr
 
     def _print_stats(self, df, stratified_df):
         """打印统计信息"""
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from Research.batch_scorer import (fill_invalid_2d, batch_pearson, lag1_autocorr, rolling_corr_2d, nan_mean_std,
+                                   score_signals, batch_columns)
+from Research.expression_compiler import fill_invalid
+from Research.signal_miner import SignalMiner
+
+
+def make_signals(n=800, k=12, seed=0):
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0, 1e-3, n)
+    signals = rng.normal(size=(n, k)).cumsum(axis=0) + returns[:, None] * np.arange(k) * 50
+    return signals, returns
+
+
+def test_fill_invalid_2d_matches_1d():
+    signals, _ = make_signals()
+    signals[:5, 0] = np.nan
+    signals[100:130, 1] = np.inf
+    signals[:, 2] = np.nan
+    signals[-3:, 3] = -np.inf
+    expected = np.column_stack([fill_invalid(signals[:, j]) for j in range(signals.shape[1])])
+    np.testing.assert_array_equal(fill_invalid_2d(signals), expected)
+
+
+def test_moments_match_pandas():
+    signals, returns = make_signals()
+    df = pd.DataFrame(signals)
+    r = pd.Series(returns)
+
+    np.testing.assert_allclose(batch_pearson(signals, returns), df.corrwith(r).to_numpy(), rtol=1e-10)
+    np.testing.assert_allclose(lag1_autocorr(signals), [df[c].autocorr(lag=1) for c in df], rtol=1e-10)
+
+    expected = np.column_stack([df[c].rolling(20).corr(r).to_numpy() for c in df])
+    rolling = rolling_corr_2d(signals, returns, 20)
+    np.testing.assert_allclose(rolling, expected, rtol=1e-7, atol=1e-9, equal_nan=True)
+
+    mean, std = nan_mean_std(rolling)
+    np.testing.assert_allclose(mean, pd.DataFrame(rolling).mean().to_numpy(), rtol=1e-12)
+    np.testing.assert_allclose(std, pd.DataFrame(rolling).std().to_numpy(), rtol=1e-12)
+
+
+def test_score_signals_matches_single_column_and_batches():
+    signals, returns = make_signals()
+    signals[:, 4] = 1.0  # 常数信号
+    signals[:, 5] = np.nan  # 全部无效
+    scores = score_signals(signals, returns)
+
+    assert scores[4] == -np.inf and scores[5] == -np.inf
+    for j in range(signals.shape[1]):
+        assert score_signals(signals[:, [j]], returns)[0] == scores[j]
+
+    # 分批计算结果与一次计算完全一致
+    np.testing.assert_array_equal(score_signals(signals, returns, batch_bytes=3 * 8 * len(returns)), scores)
+
+
+def test_batch_size_for_a_year_of_minute_bars():
+    n = 365 * 1440
+    # 一年的1m数据每批仍有几十个信号, 30天的数据每批上千个
+    assert batch_columns(n) >= 32
+    assert batch_columns(30 * 1440) >= 500
+
+    signals, returns = make_signals(n=n, k=8)
+    scores = score_signals(signals, returns)
+    np.testing.assert_array_equal(score_signals(signals, returns, batch_bytes=3 * 8 * n), scores)
+    assert np.isfinite(scores).all()
+
+
+def test_score_signals_requires_enough_samples():
+    signals, returns = make_signals(n=9, k=3)
+    assert np.isneginf(score_signals(signals, returns)).all()
+
+
+def test_population_evaluation_matches_individual():
+    rng = np.random.default_rng(2)
+    close = 100 * np.cumprod(1 + rng.normal(0, 0.01, 1000))
+    data = pd.DataFrame({'close': close, 'volume': rng.uniform(1, 2, 1000)})
+    miner = SignalMiner(data)
+    exprs = [['ts_rank', 'volume', 20], ['delta', 'close', 5], ['sign', 'close'], ['add', 'close'],
+             ['zscore', ['ts_max', 'close', 60]], list('close')]
+
+    batch = miner._evaluate_population(exprs)
+    single = [miner._evaluate(expr) for expr in exprs]
+    assert batch == single
+    assert [np.isfinite(f[0]) for f in batch] == [True, True, False, False, True, False]
+
+    # toolbox.map按整代批量评估
+    assert list(miner.toolbox.map(miner.toolbox.evaluate, exprs)) == batch
@@ -0,0 +1,91 @@
+import random
+import numpy as np
+import pandas as pd
+
+from Research.expression_cache import ExpressionCache, canonicalize, expression_key
+from Research.signal_miner import SignalMiner
+
+
+def make_data(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.cumprod(1 + rng.normal(0, 0.01, n))
+    return pd.DataFrame({
+        'close': close,
+        'high': close * 1.01,
+        'low': close * 0.99,
+        'volume': rng.uniform(100, 200, n),
+    }, index=pd.date_range('2024-01-01', periods=n, freq='min'))
+
+
+def test_canonicalize_commutative_operands():
+    a = ['add', ['ts_mean', 'close', 20], 'volume']
+    b = ['add', 'volume', ['ts_mean', 'close', 20]]
+    assert canonicalize(a) == canonicalize(b)
+    assert expression_key(a) == expression_key(b)
+
+    # sub不满足交换律, 窗口不同也不是同一个表达式
+    assert expression_key(['sub', 'close', 'volume']) != expression_key(['sub', 'volume', 'close'])
+    assert expression_key(['ts_max', 'close', 20]) != expression_key(['ts_max', 'close', 30])
+    assert expression_key(['ts_max', 'close', np.int64(20)]) == expression_key(['ts_max', 'close', 20])
+
+
+def test_lru_eviction_bounded_by_bytes():
+    cache = ExpressionCache(max_bytes=3 * 800)
+    for i in range(3):
+        cache.put(str(i), np.zeros(100))
+    assert cache.get('0')[0]  # '0'变为最近使用
+
+    cache.put('3', np.zeros(100))
+    assert '1' not in cache and '0' in cache
+    assert cache.nbytes == 3 * 800
+    assert cache.evictions == 1
+
+    # 超过上限的单个结果不缓存, 无效结果(None)不占字节
+    cache.put('big', np.zeros(1000))
+    cache.put('invalid', None)
+    assert 'big' not in cache
+    assert cache.get('invalid') == (True, None)
+
+    stats = cache.stats()
+    assert stats['hits'] == 2 and stats['entries'] == 4
+    assert not cache.get('0')[1].flags.writeable
+
+
+def test_cached_execution_matches_uncached():
+    data = make_data()
+    cached = SignalMiner(data)
+    uncached = SignalMiner(data, cache_max_bytes=0)
+
+    exprs = [
+        ['add', ['ts_mean', 'close', 20], ['ts_rank', 'volume', 10]],
+        ['add', ['ts_rank', 'volume', 10], ['ts_mean', 'close', 20]],
+        ['div', ['delta', 'close', 5], ['stddev', 'close', 20]],
+        ['zscore', ['decay_linear', ['sub', 'high', 'low'], 10]],
+        ['ts_argmax', 'close', 30],
+        ['correlation', 'close', 10],  # 参数不合法,结果为None
+    ]
+    for _ in range(2):
+        for expr in exprs:
+            expected = uncached._execute_expression(expr)
+            result = cached._execute_expression(expr)
+            if expected is None:
+                assert result is None
+            else:
+                np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), equal_nan=True)
+                assert result.index.equals(data.index)
+
+    stats = cached.expr_cache.stats()
+    assert stats['hits'] > 0
+    assert uncached.expr_cache.stats()['entries'] == 0
+
+
+def test_mine_signals_reports_cache_stats():
+    random.seed(0)
+    miner = SignalMiner(make_data())
+    miner.mine_signals(population_size=20, generations=3, n_best=2, verbose=False)
+
+    stats = miner.cache_stats
+    assert stats == miner.expr_cache.stats()
+    assert stats['hits'] + stats['misses'] > 0
+    assert 0 <= stats['hit_rate'] <= 1
+    assert stats['bytes'] <= stats['max_bytes']
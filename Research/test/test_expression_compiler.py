@@ -0,0 +1,158 @@
+import random
+import numpy as np
+import pandas as pd
+import pytest
+
+from Research.expression_compiler import compile_expression, fill_invalid, shift, NumpyExpressionEvaluator
+from Research.expression_cache import ExpressionCache
+from Research.signal_miner import SignalMiner, rolling_corr
+
+
+def make_data(n=600, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.cumprod(1 + rng.normal(0, 0.01, n))
+    volume = rng.uniform(100, 200, n)
+    volume[rng.choice(n, 10, replace=False)] = np.nan
+    return pd.DataFrame({
+        'close': close,
+        'high': close * 1.01,
+        'low': close * 0.99,
+        'volume': volume,
+        'flag': rng.integers(0, 3, n).astype(float),
+    }, index=pd.date_range('2024-01-01', periods=n, freq='min'))
+
+
+# 原pandas实现的评估逻辑,作为numpy版本的对照
+def reference_score(data, signal):
+    if signal is None or signal.isnull().all():
+        return -np.inf
+    signal = signal.replace([np.inf, -np.inf], np.nan).ffill().bfill()
+    if signal.isnull().any() or signal.std() == 0:
+        return -np.inf
+    future_returns = data['close'].pct_change(1).shift(-1)
+    future_returns = future_returns.replace([np.inf, -np.inf], np.nan).ffill().bfill()
+    valid_mask = ~(signal.isna() | future_returns.isna())
+    if valid_mask.sum() < 10:
+        return -np.inf
+    ic = signal[valid_mask].corr(future_returns[valid_mask])
+    if np.isnan(ic):
+        return -np.inf
+    rolling_ic = signal.rolling(20).corr(future_returns)
+    ir = rolling_ic.mean() / (rolling_ic.std() + 1e-8)
+    autocorr = signal.autocorr(lag=1)
+    penalty = abs(autocorr) if not np.isnan(autocorr) else 1
+    return np.tanh(ic) + 0.5 * np.tanh(ir) - 0.3 * penalty
+
+
+def test_fill_invalid_matches_pandas():
+    values = np.array([np.nan, np.inf, 1.0, np.nan, -np.inf, 3.0, np.nan])
+    expected = pd.Series(values).replace([np.inf, -np.inf], np.nan).ffill().bfill().to_numpy()
+    np.testing.assert_array_equal(fill_invalid(values), expected)
+    assert np.isnan(fill_invalid(np.array([np.nan, np.inf]))).all()
+
+    clean = np.arange(3.0)
+    assert fill_invalid(clean, copy=False) is clean
+    assert fill_invalid(clean) is not clean
+
+
+@pytest.mark.parametrize("periods", [-3, 0, 2, 10])
+def test_shift_matches_pandas(periods):
+    values = np.arange(8.0)
+    np.testing.assert_array_equal(shift(values, periods), pd.Series(values).shift(periods).to_numpy())
+
+
+def test_compile_shares_subexpressions_and_rejects_invalid_trees():
+    columns = ['close', 'volume']
+    steps = compile_expression(['add', ['ts_mean_like', 'close', 5], 'close'], columns)
+    assert steps is None
+
+    steps = compile_expression(['add', ['ts_max', 'close', 5], ['sub', ['ts_max', 'close', 5], 'close']], columns)
+    # close, ts_max, sub, add; ts_max只编译一次
+    assert [s.op for s in steps] == [None, 'ts_max', 'sub', 'add']
+
+    for invalid in (['abs', 'close', 'volume'], ['add', 'close'], ['ts_max', 'close', 'volume'],
+                    ['ts_max', 'close', 2.5], ['add', 'close', 5], ['add', 'close', 'missing'], list('close')):
+        assert compile_expression(invalid, columns) is None
+
+
+def contains(expr, ops):
+    if isinstance(expr, list):
+        return (bool(expr) and expr[0] in ops) or any(contains(e, ops) for e in expr[1:])
+    return False
+
+
+def test_numpy_backend_matches_pandas_backend():
+    data = make_data()
+    numpy_miner = SignalMiner(data, cache_max_bytes=0)
+    pandas_miner = SignalMiner(data, cache_max_bytes=0, backend='pandas')
+
+    random.seed(3)
+    checked = 0
+    for _ in range(300):
+        expr = numpy_miner._generate_expression()
+        # 两遍法方差与pandas滚动方差的舍入误差不同,作为ts_rank/argmax等的输入时会改变并列关系,单独检查
+        if contains(expr, {'variance', 'stddev'}):
+            continue
+        expected = pandas_miner._execute_expression(expr)
+        result = numpy_miner._execute_expression(expr)
+        if expected is None or expected.isnull().all():
+            assert result is None or result.isnull().all()
+            continue
+        checked += 1
+        np.testing.assert_allclose(result.to_numpy(dtype=float), expected.to_numpy(dtype=float),
+                                   rtol=1e-7, atol=1e-9, equal_nan=True, err_msg=str(expr))
+    assert checked > 100
+
+
+@pytest.mark.parametrize("op", ["variance", "stddev"])
+@pytest.mark.parametrize("column", ["close", "volume", "flag"])
+@pytest.mark.parametrize("window", [1, 5, 20, 240])
+def test_rolling_moments_match_pandas(op, column, window):
+    data = make_data()
+    expected = SignalMiner(data, backend='pandas')._execute_expression([op, column, window])
+    result = SignalMiner(data)._execute_expression([op, column, window])
+    np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), rtol=1e-8, atol=1e-10, equal_nan=True)
+
+
+def test_score_matches_pandas_reference():
+    data = make_data(seed=1)
+    miner = SignalMiner(data)
+    exprs = [
+        ['ts_rank', 'volume', 20],
+        ['div', ['delta', 'close', 5], ['stddev', 'close', 20]],
+        ['zscore', ['decay_linear', ['sub', 'high', 'low'], 10]],
+        ['mul', ['ts_argmax', 'close', 30], ['log', 'volume']],
+        ['sign', 'close'],  # 常数信号
+        ['correlation', 'close', 10],  # 无效表达式
+    ]
+    for expr in exprs:
+        expected = reference_score(data, miner._execute_expression(expr))
+        result = miner._evaluate(expr)[0]
+        if np.isinf(expected):
+            assert result == expected
+        else:
+            assert result == pytest.approx(expected, rel=1e-8, abs=1e-10), expr
+
+
+def test_rolling_corr_matches_pandas():
+    rng = np.random.default_rng(0)
+    x = 30000 + rng.normal(size=5000).cumsum()
+    y = rng.normal(size=5000) * 1e-3
+    expected = pd.Series(x).rolling(20).corr(pd.Series(y)).to_numpy()
+    np.testing.assert_allclose(rolling_corr(x, y, 20), expected, rtol=1e-7, atol=1e-9, equal_nan=True)
+
+    # 方差为0的窗口为NaN
+    x[100:200] = 1.0
+    assert np.isnan(rolling_corr(x, y, 20)[120:200]).all()
+
+
+def test_evaluator_buffers_do_not_modify_inputs_or_cache():
+    data = make_data()
+    before = data.copy()
+    evaluator = NumpyExpressionEvaluator(data, ExpressionCache())
+    inner = evaluator.evaluate(['ts_max', 'close', 5]).copy()
+    evaluator.evaluate(['sigmoid', ['add', ['ts_max', 'close', 5], 'volume']])
+    evaluator.evaluate(['abs', ['ts_max', 'close', 5]])
+
+    pd.testing.assert_frame_equal(data, before)
+    np.testing.assert_array_equal(evaluator.evaluate(['ts_max', 'close', 5]), inner)
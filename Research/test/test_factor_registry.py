@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from Research.factor_zoo import factors
+from Research.factor_zoo.registry import FactorRegistry
+from Research.factor_zoo.factor_store import ParquetFactorStore
+
+pytestmark = pytest.mark.filterwarnings('ignore')
+
+
+def make_bars(n=1500, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(rng.normal(0, 2e-3, n).cumsum())
+    spread = np.abs(rng.normal(0, 0.1, n))
+    volume = rng.uniform(10, 100, n)
+    df = pd.DataFrame({
+        'timestamp': pd.date_range('2024-01-01', periods=n, freq='1min').strftime('%Y-%m-%d %H:%M:%S'),
+        'open': close * (1 + rng.normal(0, 1e-3, n)),
+        'high': close + spread,
+        'low': close - spread,
+        'close': close,
+        'volume': volume,
+        'taker_buy_volume': volume * rng.uniform(0, 1, n),
+    })
+    # 中间缺几分钟, 由FactorBase的resample补齐
+    return df.drop(index=range(n // 2, n // 2 + 5)).reset_index(drop=True)
+
+
+def test_discovers_factor_zoo():
+    registry = FactorRegistry()
+    assert set(registry.names()) == {
+        'volatility_adjusted_momentum', 'time_decay_momentum', 'abnormal_trade_volume',
+        'high_vol_time_decay_momentum', 'vol_weighted_deviation', 'breakout_strength',
+        'path_efficiency', 'relative_volatility'}
+    assert registry.default_params('time_decay_momentum') == {'window': 30}
+    with pytest.raises(KeyError):
+        registry.get('not_a_factor')
+
+
+def test_time_decay_momentum_matches_rolling_apply():
+    df = make_bars()
+    window = 30
+    weights = np.exp(np.linspace(0, -1, window))
+    expected = factors.time_decay_momentum(df).signal_df['close'].pct_change().rolling(window).apply(
+        lambda x: (x * weights[::-1]).sum())
+    result = FactorRegistry().compute('time_decay_momentum', df, window=window)
+    np.testing.assert_allclose(result['factor'].to_numpy(), expected.to_numpy(), rtol=1e-10, equal_nan=True)
+
+
+def test_incremental_update_matches_full_compute(tmp_path):
+    registry = FactorRegistry()
+    store = ParquetFactorStore(str(tmp_path))
+    df = make_bars()
+
+    for name in registry.names():
+        registry.compute(name, df.iloc[:1000], symbol='BTCUSDT', store=store, data_version='v1')
+        updated = registry.compute(name, df, symbol='BTCUSDT', store=store, data_version='v1')
+        full = registry.compute(name, df)
+        assert len(updated) == len(full), name
+        assert (updated['timestamp'].astype(str).to_numpy() == full['timestamp'].astype(str).to_numpy()).all(), name
+        np.testing.assert_allclose(updated['factor'].to_numpy(dtype=float), full['factor'].to_numpy(dtype=float),
+                                   rtol=1e-8, atol=1e-12, equal_nan=True, err_msg=name)
+
+    entries = store.entries()
+    assert len(entries) == len(registry)
+    assert (entries['rows'] == len(full)).all()
+
+
+def test_store_keys_and_cache_hit(tmp_path, monkeypatch):
+    registry = FactorRegistry()
+    store = ParquetFactorStore(str(tmp_path))
+    df = make_bars(n=400)
+    registry.compute('time_decay_momentum', df, symbol='ETHUSDT', store=store, data_version='v1')
+    registry.compute('time_decay_momentum', df, symbol='ETHUSDT', store=store, data_version='v1', window=10)
+    registry.compute('time_decay_momentum', df, symbol='ETHUSDT', store=store, data_version='v2')
+    entries = store.entries()
+    assert len(entries) == 3
+    assert sorted(entries['data_version']) == ['v1', 'v1', 'v2']
+
+    # 没有新bar时直接返回缓存,不再计算
+    def fail(self, window=30):
+        raise AssertionError('should not recompute')
+    monkeypatch.setattr(factors.time_decay_momentum, 'calculate_factor', fail)
+    cached = registry.compute('time_decay_momentum', df, symbol='ETHUSDT', store=store, data_version='v1')
+    assert len(cached) == len(store.load('time_decay_momentum', 'ETHUSDT', {'window': 30}, 'v1'))
+
+
+def test_compute_all_columns():
+    registry = FactorRegistry()
+    out = registry.compute_all(make_bars(n=300), names=['path_efficiency', 'breakout_strength'])
+    assert list(out.columns) == ['timestamp', 'close', 'path_efficiency', 'breakout_strength']
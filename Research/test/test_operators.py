@@ -0,0 +1,107 @@
+import pytest
+import pandas as pd
+import numpy as np
+from scipy.stats import rankdata
+
+from Research import operators
+from Research.operators import OperatorSuite
+
+
+# 原rolling.apply实现,作为向量化版本的对照
+def reference_ts_argmax(series, window):
+    def _argmax(x):
+        if len(x) < window:
+            return np.nan
+        return (window - 1) - np.argmax(x)
+    return series.rolling(window).apply(_argmax, raw=True)
+
+
+def reference_ts_argmin(series, window):
+    def _argmin(x):
+        if len(x) < window:
+            return np.nan
+        return (window - 1) - np.argmin(x)
+    return series.rolling(window).apply(_argmin, raw=True)
+
+
+def reference_ts_rank(series, window):
+    return series.rolling(window).apply(lambda x: rankdata(x)[-1] / window, raw=True)
+
+
+def reference_decay_linear(series, window):
+    weights = np.arange(window, 0, -1)
+    return series.rolling(window).apply(lambda x: np.dot(x, weights) / weights.sum(), raw=True)
+
+
+CASES = [
+    ("ts_argmax", reference_ts_argmax),
+    ("ts_argmin", reference_ts_argmin),
+    ("ts_rank", reference_ts_rank),
+    ("decay_linear", reference_decay_linear),
+]
+WINDOWS = [1, 2, 5, 30, 64, 65, 120]
+
+
+def make_series(kind, n=600, seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2024-01-01", periods=n, freq="min")
+    if kind == "random":
+        values = rng.normal(size=n).cumsum()
+    elif kind == "ties":
+        # 大量重复值,检查argmax取第一个以及rank的平均排名
+        values = rng.integers(0, 5, size=n).astype(float)
+    elif kind == "nan":
+        values = rng.normal(size=n)
+        values[rng.choice(n, size=20, replace=False)] = np.nan
+        values[200:240] = np.nan
+    elif kind == "int":
+        return pd.Series(rng.integers(-50, 50, size=n), index=index)
+    else:
+        values = np.full(n, 3.0)
+    return pd.Series(values, index=index)
+
+
+@pytest.mark.parametrize("name,reference", CASES)
+@pytest.mark.parametrize("kind", ["random", "ties", "nan", "int", "constant"])
+@pytest.mark.parametrize("window", WINDOWS)
+def test_parity_with_rolling_apply(name, reference, kind, window):
+    series = make_series(kind)
+    result = getattr(OperatorSuite, name)(series, window)
+    expected = reference(series, window)
+
+    assert result.index.equals(series.index)
+    np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), rtol=1e-10, atol=1e-12, equal_nan=True)
+
+
+@pytest.mark.parametrize("name,reference", CASES)
+def test_series_shorter_than_window(name, reference):
+    series = make_series("random", n=10)
+    result = getattr(OperatorSuite, name)(series, 30)
+    assert len(result) == 10
+    assert result.isna().all()
+    assert reference(series, 30).isna().all()
+
+
+def test_ts_rank_paths_agree(monkeypatch):
+    series = make_series("ties", n=2000, seed=1)
+    vectorized = OperatorSuite.ts_rank(series, 50)
+
+    # 强制使用pandas滑动排名实现,分块大小也设得很小
+    monkeypatch.setattr(operators, "RANK_VECTOR_WINDOW", 0)
+    ordered = OperatorSuite.ts_rank(series, 50)
+    monkeypatch.setattr(operators, "RANK_VECTOR_WINDOW", 64)
+    monkeypatch.setattr(operators, "RANK_CHUNK_SIZE", 7)
+    chunked = OperatorSuite.ts_rank(series, 50)
+
+    np.testing.assert_allclose(vectorized, ordered, equal_nan=True)
+    np.testing.assert_allclose(vectorized, chunked, equal_nan=True)
+
+
+@pytest.mark.parametrize("kind", ["random", "nan", "constant"])
+@pytest.mark.parametrize("window", [1, 5, 30])
+def test_ts_weighted_sum_parity(kind, window):
+    series = make_series(kind)
+    weights = np.exp(np.linspace(0, -1, window))[::-1]
+    expected = series.rolling(window).apply(lambda x: (x * weights).sum(), raw=True)
+    np.testing.assert_allclose(OperatorSuite.ts_weighted_sum(series, weights).to_numpy(), expected.to_numpy(),
+                               rtol=1e-10, atol=1e-12, equal_nan=True)
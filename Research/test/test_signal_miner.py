@@ -167,4 +167,24 @@ def test_signal_miner_error_handling():
     # 检查结果是否正确处理了无效数据
     assert len(results) <= 1, "应该最多返回n_best个结果"
     if len(results) > 0:
-        assert not np.isnan(results[0]['signal']).all(), "不应该返回全是NaN的信号"
\ No newline at end of file
+        assert not np.isnan(results[0]['signal']).all(), "不应该返回全是NaN的信号"
+
+
+def test_parallel_evaluation_matches_serial_under_seed():
+    df = generate_crypto_synthetic_data(symbol=TEST_SYMBOL, start_date="2024-01-01", num_points=800)
+    data = df.fillna(method='ffill')
+    serial_miner = SignalMiner(data, exclude_columns={'timestamp'})
+    serial = serial_miner.mine_signals(population_size=30, generations=3, n_best=3, verbose=False, seed=7)
+    parallel_miner = SignalMiner(data, exclude_columns={'timestamp'})
+    parallel = parallel_miner.mine_signals(population_size=30, generations=3, n_best=3, verbose=False,
+                                           seed=7, n_jobs=2)
+
+    assert [r['expression'] for r in serial] == [r['expression'] for r in parallel]
+    assert [r['fitness'] for r in serial] == [r['fitness'] for r in parallel]
+
+    # 并行时缓存统计包含worker中的评估, 查询次数与串行一致
+    def lookups(stats):
+        return stats['hits'] + stats['misses']
+
+    assert lookups(parallel_miner.cache_stats) == lookups(serial_miner.cache_stats)
+    assert lookups(parallel_miner.cache_stats) > lookups(parallel_miner.expr_cache.stats())
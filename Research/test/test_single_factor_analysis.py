@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import pearsonr
+
+from Research.single_factor_analysis import SignalAnalyzer
+
+
+def make_df(n=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(rng.normal(0, 1e-3, n).cumsum())
+    factor = np.roll(np.diff(close, prepend=close[0]), -3) + rng.normal(0, 0.05, n)
+    index = pd.date_range('2024-01-01', periods=n, freq='1min')
+    return pd.DataFrame({'factor': factor, 'close': close}, index=index)
+
+
+def reference_rolling_corr(factor, returns, window):
+    n = len(factor)
+    corr = np.full(n, np.nan)
+    for i in range(window, n):
+        valid = ~np.isnan(factor[i-window:i]) & ~np.isnan(returns[i-window:i])
+        if valid.sum() < 5:
+            continue
+        corr[i] = pearsonr(factor[i-window:i][valid], returns[i-window:i][valid])[0]
+    return corr
+
+
+def reference_ret_decay(analyzer, df, quantiles, windows):
+    sig_decay = np.zeros((len(windows), len(quantiles)-1))
+    for win_idx, win in enumerate(windows):
+        df_win = analyzer.get_ret_interval(df, interval=win)
+        df_win = df_win.sort_values(by=['factor'], kind='stable')
+        for q_idx in range(len(quantiles)-1):
+            low = int(quantiles[q_idx] * len(df_win))
+            high = int(quantiles[q_idx+1] * len(df_win))
+            sig_decay[win_idx, q_idx] = df_win.iloc[low:high].ret.mean()
+    return sig_decay
+
+
+def reference_corr_decay(analyzer, df, windows):
+    df = df.dropna(how='any')
+    return [np.nan] + [pearsonr(df.factor[:-int(win)-1], analyzer.get_ret_interval(df, win).ret[:-int(win)-1])[0]
+                       for win in windows[1:]]
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_rolling_corr_matches_pearsonr_with_nan():
+    df = SignalAnalyzer().get_ret_interval(make_df(), interval=10)
+    factor = df['factor'].to_numpy().copy()
+    returns = df['ret'].to_numpy().copy()
+    factor[200:290] = np.nan      # 窗口内有效样本不足5个
+    returns[1000:1003] = np.nan
+    factor[1500:1560] = 1.0       # 常数窗口
+    window = 60
+
+    expected = reference_rolling_corr(factor, returns, window)
+    result = SignalAnalyzer._rolling_corr(factor, returns, window)
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+    np.testing.assert_allclose(result, expected, rtol=1e-7, atol=1e-9, equal_nan=True)
+
+
+def test_rolling_corr_short_input():
+    result = SignalAnalyzer._rolling_corr(np.arange(5.0), np.arange(5.0), 10)
+    assert np.isnan(result).all()
+
+
+def test_ret_decay_by_quantile_matches_loop():
+    analyzer = SignalAnalyzer()
+    df = make_df()
+    df.iloc[:7, df.columns.get_loc('factor')] = np.nan
+    quantiles = np.linspace(0, 1, 6)
+    windows = np.linspace(0, 240, 31)
+    np.testing.assert_allclose(analyzer.calc_ret_decay_by_quantile(df, quantiles=quantiles, windows=windows),
+                               reference_ret_decay(analyzer, df, quantiles, windows), rtol=1e-7, atol=1e-12)
+
+
+def test_corr_decay_matches_pearsonr():
+    analyzer = SignalAnalyzer()
+    df = analyzer.get_ret_interval(make_df(), interval=10)
+    windows = np.linspace(1, 240, 12)
+    np.testing.assert_allclose(analyzer.calc_corr_decay(df, windows=windows),
+                               reference_corr_decay(analyzer, df, windows), rtol=1e-7, equal_nan=True)
+
+
+def test_corr_decay_degenerate_windows_are_nan():
+    analyzer = SignalAnalyzer()
+    df = make_df(n=50)
+    df['factor'] = 1.0
+    corr_decay = analyzer.calc_corr_decay(df, windows=np.array([0, 5, 100]))
+    assert len(corr_decay) == 3
+    assert np.isnan(corr_decay).all()
+
+
+def make_zoo_df(n=3000, seed=1):
+    df = make_df(n, seed).reset_index().rename(columns={'index': 'timestamp'})
+    rng = np.random.default_rng(seed)
+    df['noise'] = rng.normal(size=n)
+    df['lagged'] = df['factor'].shift(5)
+    df['coarse'] = np.round(df['factor'] * 20)
+    df = df.drop(index=range(100, 130)).reset_index(drop=True)  # 缺失的分钟由resample补齐
+    return df.rename(columns={'factor': 'momentum'})
+
+
+def test_analyze_many_matches_analyze(monkeypatch):
+    captured = []
+    monkeypatch.setattr(SignalAnalyzer, '_plot_results',
+                        lambda self, df, intraday, strat, ret_decay, corr_decay, *args, **kwargs:
+                        captured.append((ret_decay, corr_decay)))
+    monkeypatch.setattr(SignalAnalyzer, '_print_stats', lambda self, df, strat: None)
+    df = make_zoo_df()
+    columns = ['momentum', 'noise', 'lagged', 'coarse']
+    analyzer = SignalAnalyzer(roll_window=120, n_strata=5)
+
+    summary, results = analyzer.analyze_many(df.copy(), columns)
+    assert list(summary.index) == columns
+
+    for column in columns:
+        single = df[['timestamp', 'close', column]].rename(columns={column: 'factor'})
+        analysis_df, stratified_df = analyzer.analyze(single)
+        ret_decay, corr_decay = captured.pop()
+        result = results[column]
+        np.testing.assert_allclose(result['corr'].to_numpy(), analysis_df['corr'].to_numpy(),
+                                   rtol=1e-7, atol=1e-9, equal_nan=True)
+        np.testing.assert_allclose(result['ret_decay'], ret_decay, rtol=1e-7, atol=1e-12, equal_nan=True)
+        np.testing.assert_allclose(result['corr_decay'], corr_decay, rtol=1e-7, equal_nan=True)
+        pd.testing.assert_frame_equal(result['stratified'].reset_index(drop=True),
+                                      stratified_df.assign(Strata=stratified_df['Strata'].astype(str)),
+                                      check_dtype=False)
+        assert summary.loc[column, 'Mean Correlation'] == pytest.approx(analysis_df['corr'].mean())
+
+
+def test_analyze_many_saves_plots_in_pool(tmp_path):
+    df = make_zoo_df(n=600)
+    analyzer = SignalAnalyzer(roll_window=60)
+    analyzer.analyze_many(df, ['momentum', 'noise'], plot=True, plot_dir=str(tmp_path), n_jobs=2)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['momentum.png', 'noise.png']
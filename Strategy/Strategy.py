@@ -54,21 +54,44 @@ class StrategyTemplate(StrategyBase):
         """
         raise NotImplementedError("function onBar() is not implemented")
 
+    def onWarmup(self, bar):
+        """
+        预热期(lookback_time到start_time)的bar推送, 用于更新指标; 此时不能下单, 持仓和账户引擎还没有开始
+        默认调用onBar, 只需要更新指标的策略可以继承实现以跳过下单逻辑
+        """
+        self.onBar(bar)
+
+    def onTimeframeBar(self, timeframe, bar):
+        """
+        收到额外订阅周期的bar推送(config中timeframes除第一个以外的周期), 按需继承实现
+        timeframe: '15m' / '1h'等, bar: {symbol: BAR}
+        """
+        pass
+
+    def subscriptions(self):
+        """
+        策略订阅的数据(SUBSCRIPTION), 在onInit之后读取; 返回None时订阅全部symbol, 字段和回调
+        """
+        return None
+
     def onOrder(self, orderback):
         """
         收到order回执推送(必须由用户继承实现)
         """
         raise NotImplementedError("function onOrder() is not implemented")
 
-    def onPosition(self, position):
+    def onPosition(self, position, changed=None):
         """
         仓位信息管理(必须由用户继承实现)
+        行情推送引起的变化每个timestamp合并推送一次(在onBar之前), 订单回执引起的变化立即推送
+        changed: 有变化的symbol集合
         """
         raise NotImplementedError("function onPosition() is not implemented")
 
-    def onAccount(self, account):
+    def onAccount(self, account, changed=None):
         """
         仓位信息管理(必须由用户继承实现)
+        推送时机和changed同onPosition
         """
         raise NotImplementedError("function onAccount() is not implemented")
 
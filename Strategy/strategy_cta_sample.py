@@ -118,20 +118,20 @@ class strategy_cta__01(StrategyTemplate):
         """
         self.OrderBack = orderback
 
-    def onAccount(self, account):
+    def onAccount(self, account, changed=None):
         """
-        更新account
+        更新account, 只处理有变化的symbol
         """
         self.account = account
-        for symbol in self.trading_symbols:
+        for symbol in (self.trading_symbols if changed is None else changed):
             self.available_margins[symbol] = account[symbol].margin_available
 
-    def onPosition(self, position):
+    def onPosition(self, position, changed=None):
         """
-        更新position
+        更新position, 只处理有变化的symbol
         """
         self.position = position
-        for symbol in self.trading_symbols:
+        for symbol in (self.trading_symbols if changed is None else changed):
             self.realized_pnls[symbol]['long'] = position[symbol]['long'].tmp_real_pnl
             self.unrealized_pnls[symbol]['long'] = position[symbol]['long'].tmp_unreal_pnl
 
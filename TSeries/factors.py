@@ -0,0 +1,187 @@
+"""
+Research/factor_zoo/factors.py中因子的在线版本
+输入为Bar序列, 每根bar O(1)更新; 预热期(批量版本为NaN的位置)value为None
+批量版本在1min重采样后的连续bar上计算, 在线版本假设bar按分钟连续到达
+breakout_strength / relative_volatility 的批量版本用scale()按整段数据的绝对值之和归一化, 需要未来数据,
+在线版本输出归一化之前的值(只差一个正的常数倍)
+"""
+import math
+
+from TSeries.tseries import TSeries
+from TSeries.bar_series import Bar
+from TSeries.rolling import RollingWindow, RollingExtremum, Lag, DecayWindow
+
+
+def _divide(a, b):
+    """与批量版本(pandas)的除法一致: x/0为±inf, 0/0为NaN, 不抛ZeroDivisionError"""
+    if b == 0:
+        return math.nan if a == 0 or math.isnan(a) else math.copysign(math.inf, a * math.copysign(1, b))
+    return a / b
+
+
+class OnlineFactor(TSeries):
+    def __init__(self, bar_series: Bar, name):
+        super().__init__(name)
+        self.set_inputs(bar_series)
+        self.prev_close = None
+
+    def update(self, timestamp):
+        bar = self.inputs[0].value
+        self.timestamp = timestamp
+        if bar is None:
+            return
+        self.value = self.on_bar(bar)
+        self.prev_close = bar.close
+
+    def pct_change(self, bar):
+        """与close.pct_change()一致, 第一根bar返回None"""
+        return None if self.prev_close is None else bar.close / self.prev_close - 1
+
+    def on_bar(self, bar):
+        raise NotImplementedError(f"on_bar() not implemented in {self.name}")
+
+
+class VolatilityAdjustedMomentum(OnlineFactor):
+    def __init__(self, bar_series: Bar, name=None):
+        super().__init__(bar_series, name or f"volatility_adjusted_momentum({bar_series.name})")
+        self.close_lag = Lag(10)
+        self.ret_window = RollingWindow(20)
+
+    def on_bar(self, bar):
+        self.close_lag.append(bar.close)
+        ret = self.pct_change(bar)
+        if ret is not None:
+            self.ret_window.append(ret)
+        if not (self.close_lag.ready and self.ret_window.ready):
+            return None
+        mom = bar.close / self.close_lag.value - 1
+        return mom / (self.ret_window.std() + 1e-5)
+
+
+class TimeDecayMomentum(OnlineFactor):
+    def __init__(self, bar_series: Bar, window=30, name=None):
+        super().__init__(bar_series, name or f"time_decay_momentum({bar_series.name}, {window})")
+        self.decay = DecayWindow(window)
+
+    def on_bar(self, bar):
+        ret = self.pct_change(bar)
+        if ret is not None:
+            self.decay.append(ret)
+        return self.decay.sum if self.decay.ready else None
+
+
+class AbnormalTradeVolume(OnlineFactor):
+    def __init__(self, bar_series: Bar, name=None):
+        super().__init__(bar_series, name or f"abnormal_trade_volume({bar_series.name})")
+        self.volume_max = RollingExtremum(10, 'max')
+
+    def on_bar(self, bar):
+        self.volume_max.append(bar.volume)
+        if not self.volume_max.ready:
+            return None
+        buy_ratio = _divide(bar.taker_buy_volume, bar.volume)
+        if not math.isfinite(buy_ratio):
+            # 批量版本的两个分支相加时 0 * inf 为NaN
+            return math.nan
+        indicator1 = buy_ratio if buy_ratio >= 0.5 else -(1 - buy_ratio)
+        indicator2 = _divide(abs(bar.high - bar.low), bar.open)
+        return _divide(bar.volume, self.volume_max.value) * indicator1 * indicator2
+
+
+class HighVolTimeDecayMomentum(OnlineFactor):
+    def __init__(self, bar_series: Bar, window=30, name=None):
+        super().__init__(bar_series, name or f"high_vol_time_decay_momentum({bar_series.name}, {window})")
+        self.decay = DecayWindow(window)
+        self.short_vol = RollingWindow(5)
+        self.long_vol = RollingWindow(30)
+
+    def on_bar(self, bar):
+        ret = self.pct_change(bar)
+        if ret is not None:
+            self.decay.append(ret)
+            self.short_vol.append(ret)
+            self.long_vol.append(ret)
+        if not self.decay.ready:
+            return None
+        # 波动率窗口未满时批量版本的比较结果为False
+        high_vol = 0.0
+        if self.short_vol.ready and self.long_vol.ready:
+            short_std, long_std = self.short_vol.std(), self.long_vol.std()
+            if (short_std > 1.5 * long_std) if long_std > 0 else short_std > 0:
+                high_vol = 1.0
+        return self.decay.sum * (1 + high_vol)
+
+
+class VolWeightedDeviation(OnlineFactor):
+    def __init__(self, bar_series: Bar, window=30, name=None):
+        super().__init__(bar_series, name or f"vol_weighted_deviation({bar_series.name}, {window})")
+        self.close_window = RollingWindow(window)
+        self.volume_window = RollingWindow(window)
+
+    def on_bar(self, bar):
+        self.close_window.append(bar.close)
+        self.volume_window.append(bar.volume)
+        if not self.close_window.ready:
+            return None
+        vol_weight = bar.volume / (self.volume_window.total() + 1e-6)
+        return (bar.close - self.close_window.mean()) * vol_weight
+
+
+class BreakoutStrength(OnlineFactor):
+    def __init__(self, bar_series: Bar, name=None):
+        super().__init__(bar_series, name or f"breakout_strength({bar_series.name})")
+        self.high_max = RollingExtremum(30, 'max')
+        self.low_min = RollingExtremum(30, 'min')
+
+    def on_bar(self, bar):
+        self.high_max.append(bar.high)
+        self.low_min.append(bar.low)
+        if not self.high_max.ready:
+            return None
+        high_break = (bar.close - self.high_max.value) / self.high_max.value
+        low_break = (bar.close - self.low_min.value) / self.low_min.value
+        return high_break + low_break
+
+
+class PathEfficiency(OnlineFactor):
+    def __init__(self, bar_series: Bar, name=None):
+        super().__init__(bar_series, name or f"path_efficiency({bar_series.name})")
+        self.high_max = RollingExtremum(10, 'max')
+        self.low_min = RollingExtremum(10, 'min')
+        self.close_lag = Lag(10)
+
+    def on_bar(self, bar):
+        self.high_max.append(bar.high)
+        self.low_min.append(bar.low)
+        self.close_lag.append(bar.close)
+        if not self.close_lag.ready:
+            return None
+        path_length = self.high_max.value - self.low_min.value
+        return (bar.close - self.close_lag.value) / (path_length + 1e-6)
+
+
+class RelativeVolatility(OnlineFactor):
+    def __init__(self, bar_series: Bar, name=None):
+        super().__init__(bar_series, name or f"relative_volatility({bar_series.name})")
+        self.close_max = RollingExtremum(60, 'max')
+        self.ratio_window = RollingWindow(20)
+
+    def on_bar(self, bar):
+        self.close_max.append(bar.close)
+        if not self.close_max.ready:
+            return None
+        self.ratio_window.append(bar.close / self.close_max.value)
+        return self.ratio_window.std() if self.ratio_window.ready else None
+
+
+# 批量因子名 -> 在线版本
+ONLINE_FACTORS = {
+    'volatility_adjusted_momentum': VolatilityAdjustedMomentum,
+    'time_decay_momentum': TimeDecayMomentum,
+    'abnormal_trade_volume': AbnormalTradeVolume,
+    'high_vol_time_decay_momentum': HighVolTimeDecayMomentum,
+    'vol_weighted_deviation': VolWeightedDeviation,
+    'breakout_strength': BreakoutStrength,
+    'path_efficiency': PathEfficiency,
+    'relative_volatility': RelativeVolatility,
+}
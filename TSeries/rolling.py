@@ -0,0 +1,137 @@
+import math
+from collections import deque
+
+import numpy as np
+
+
+class RollingWindow:
+    """
+    固定长度窗口的滑动求和/均值/标准差, 每次更新O(1)
+    累加的是减去参考值之后的偏差, 每window次更新从缓冲区重新求和一次(均摊O(1)),
+    避免长时间运行时加减误差累积以及价格序列平方和相减的精度损失
+    """
+    def __init__(self, window: int):
+        assert isinstance(window, int) and window > 0
+        self.window = window
+        self.buffer = deque(maxlen=window)
+        self.shift = 0.0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self._updates = 0
+
+    def append(self, x):
+        if len(self.buffer) == self.window:
+            old = self.buffer[0] - self.shift
+            self.sum -= old
+            self.sumsq -= old * old
+        self.buffer.append(x)
+        d = x - self.shift
+        self.sum += d
+        self.sumsq += d * d
+        self._updates += 1
+        if self._updates >= self.window:
+            self._resync()
+
+    def _resync(self):
+        self.shift = self.buffer[-1]
+        deviations = [x - self.shift for x in self.buffer]
+        self.sum = math.fsum(deviations)
+        self.sumsq = math.fsum(d * d for d in deviations)
+        self._updates = 0
+
+    @property
+    def ready(self):
+        return len(self.buffer) == self.window
+
+    def total(self):
+        return self.shift * len(self.buffer) + self.sum
+
+    def mean(self):
+        return self.shift + self.sum / len(self.buffer)
+
+    def std(self):
+        """样本标准差(ddof=1), 与pd.Series.rolling().std()一致"""
+        n = len(self.buffer)
+        if n < 2:
+            return float('nan')
+        var = (self.sumsq - self.sum * self.sum / n) / (n - 1)
+        return math.sqrt(var) if var > 0 else 0.0
+
+
+class RollingExtremum:
+    """
+    滑动窗口最大/最小值, 单调队列实现, 均摊O(1)
+    """
+    def __init__(self, window: int, mode: str = 'max'):
+        assert isinstance(window, int) and window > 0
+        assert mode in ('max', 'min')
+        self.window = window
+        self.is_max = mode == 'max'
+        self.queue = deque()  # (序号, 值), 值单调
+        self.count = 0
+
+    def append(self, x):
+        self.count += 1
+        if self.is_max:
+            while self.queue and self.queue[-1][1] <= x:
+                self.queue.pop()
+        else:
+            while self.queue and self.queue[-1][1] >= x:
+                self.queue.pop()
+        self.queue.append((self.count, x))
+        if self.queue[0][0] <= self.count - self.window:
+            self.queue.popleft()
+
+    @property
+    def ready(self):
+        return self.count >= self.window
+
+    @property
+    def value(self):
+        return self.queue[0][1]
+
+
+class Lag:
+    """保存最近periods+1个值, value为periods期之前的值"""
+    def __init__(self, periods: int):
+        self.buffer = deque(maxlen=periods + 1)
+
+    def append(self, x):
+        self.buffer.append(x)
+
+    @property
+    def ready(self):
+        return len(self.buffer) == self.buffer.maxlen
+
+    @property
+    def value(self):
+        return self.buffer[0]
+
+
+class DecayWindow:
+    """
+    指数衰减加权窗口和: 最新值权重为1, 最旧值权重为exp(-1), 权重与np.exp(np.linspace(0, -1, window))一致
+    相邻权重之比固定, 递推更新O(1), 每window次更新按权重重新求和一次
+    """
+    def __init__(self, window: int):
+        assert isinstance(window, int) and window > 0
+        self.window = window
+        self.weights = np.exp(np.linspace(0, -1, window))[::-1]  # 最旧 -> 最新
+        self.ratio = math.exp(-1 / (window - 1)) if window > 1 else 0.0
+        self.buffer = deque(maxlen=window)
+        self.sum = 0.0
+        self._updates = 0
+
+    def append(self, x):
+        oldest = self.buffer[0] if len(self.buffer) == self.window else 0.0
+        self.buffer.append(x)
+        # 窗口整体左移一格: 原有权重乘以ratio, 移出窗口的值权重为exp(-1) * ratio
+        self.sum = self.sum * self.ratio + x - oldest * self.weights[0] * self.ratio
+        self._updates += 1
+        if self._updates >= self.window:
+            self.sum = float(np.dot(np.fromiter(self.buffer, dtype=np.float64), self.weights[-len(self.buffer):]))
+            self._updates = 0
+
+    @property
+    def ready(self):
+        return len(self.buffer) == self.window
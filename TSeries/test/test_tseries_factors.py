@@ -0,0 +1,97 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.lib.stride_tricks import sliding_window_view
+
+from TSeries.bar_series import Bar
+from TSeries.factors import ONLINE_FACTORS
+from TSeries.rolling import RollingWindow, RollingExtremum, DecayWindow
+from TSeries.tseries_graph import tseries_graph
+from Research.factor_zoo.registry import FactorRegistry
+from Utils.DataStructure import BAR
+
+# 批量版本用scale()归一化的因子
+SCALED_FACTORS = {'breakout_strength', 'relative_volatility'}
+
+
+def make_bars(n=800, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 30000 * np.exp(rng.normal(0, 2e-3, n).cumsum())
+    # 中间一段波动放大, 触发high_vol分支
+    close[400:420] *= np.exp(rng.normal(0, 2e-2, 20).cumsum())
+    spread = np.abs(rng.normal(0, 5, n))
+    volume = rng.uniform(10, 100, n)
+    return pd.DataFrame({
+        'timestamp': pd.date_range('2024-01-01', periods=n, freq='1min').strftime('%Y-%m-%d %H:%M:%S'),
+        'open': close * (1 + rng.normal(0, 1e-3, n)),
+        'high': close + spread,
+        'low': close - spread,
+        'close': close,
+        'volume': volume,
+        'taker_buy_volume': volume * rng.uniform(0, 1, n),
+    })
+
+
+def run_online(df, bar_name):
+    bar = Bar(bar_name)
+    nodes = {name: cls(bar) for name, cls in ONLINE_FACTORS.items()}
+    values = {name: [] for name in nodes}
+    for row in df.itertuples():
+        ts = datetime.datetime.strptime(row.timestamp, "%Y-%m-%d %H:%M:%S")
+        bar.update(BAR(symbol="BTCUSDT", timestamp=int(ts.timestamp() * 1000), open=row.open, high=row.high,
+                       low=row.low, close=row.close, volume=row.volume, quote_volume=0, count=1,
+                       taker_buy_volume=row.taker_buy_volume, taker_buy_quote_volume=0), ts)
+        tseries_graph.update_all(ts)
+        for name, node in nodes.items():
+            values[name].append(np.nan if node.value is None else node.value)
+    return {name: np.array(v) for name, v in values.items()}
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_online_factors_match_batch():
+    df = make_bars()
+    online = run_online(df, "factor_bar")
+    registry = FactorRegistry()
+    for name, values in online.items():
+        batch = registry.compute(name, df)['factor'].to_numpy(dtype=float)
+        if name in SCALED_FACTORS:
+            values = values / np.nansum(np.abs(values))
+        np.testing.assert_array_equal(np.isnan(values), np.isnan(batch), err_msg=name)
+        np.testing.assert_allclose(values, batch, rtol=1e-9, atol=1e-12, equal_nan=True, err_msg=name)
+
+
+@pytest.mark.filterwarnings('ignore')
+def test_abnormal_trade_volume_zero_volume_matches_batch():
+    df = make_bars(seed=2)
+    df.loc[20, ['volume', 'taker_buy_volume']] = 0.0
+    df.loc[30:41, ['volume', 'taker_buy_volume']] = 0.0
+    df.loc[45, 'volume'] = 0.0
+    df.loc[50, 'open'] = 0.0
+    online = run_online(df, "zero_volume_bar")['abnormal_trade_volume']
+    batch = FactorRegistry().compute('abnormal_trade_volume', df)['factor'].to_numpy(dtype=float)
+    assert np.isnan(online[[20, 41, 45]]).all() and np.isinf(online[50])
+    np.testing.assert_array_equal(np.isnan(online), np.isnan(batch))
+    np.testing.assert_allclose(online, batch, rtol=1e-9, atol=1e-12, equal_nan=True)
+
+
+def test_rolling_helpers():
+    rng = np.random.default_rng(1)
+    x = 50000 + rng.normal(0, 1, 3000).cumsum()
+    series = pd.Series(x)
+    window, extremum, decay = RollingWindow(20), RollingExtremum(15, 'min'), DecayWindow(30)
+    std, low, weighted = [], [], []
+    for v in x:
+        window.append(v)
+        extremum.append(v)
+        decay.append(v)
+        std.append(window.std() if window.ready else np.nan)
+        low.append(extremum.value if extremum.ready else np.nan)
+        weighted.append(decay.sum if decay.ready else np.nan)
+    # pandas的滑动方差在价格水平较高时有1e-8量级的相对误差, 这里和两遍法的结果比较
+    exact = np.concatenate([np.full(19, np.nan), sliding_window_view(x, 20).std(axis=1, ddof=1)])
+    np.testing.assert_allclose(std, exact, rtol=1e-12, equal_nan=True)
+    np.testing.assert_array_equal(low, series.rolling(15).min())
+    weights = np.exp(np.linspace(0, -1, 30))[::-1]
+    np.testing.assert_allclose(weighted, series.rolling(30).apply(lambda w: (w * weights).sum(), raw=True),
+                               rtol=1e-12, equal_nan=True)
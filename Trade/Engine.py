@@ -5,18 +5,20 @@ Author:Wamnzhen Fu
 Modified: 2025 (removed multithreading for deterministic backtest)
 """
 from abc import ABCMeta, abstractmethod
+import inspect
 from Event_Engine import Event_Engine
 import logging
 
 from Utils.Event import *
-from Data.DataHandlers import MongoDBHandler
+from Data.DataHandlers import MongoDBHandler, MongoBatchWriter, MongoResultStore, ParquetResultStore
 from Utils.Constant import *
 from Utils.DataStructure import POSITION, ACCOUNT
 from Utils.util import *
+from Data.catalog import DataCatalog
+from Data.bar_cache import BarCache
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-import pymongo
 from io import BytesIO
 from datetime import datetime
 import time
@@ -65,6 +67,12 @@ class PositionEngine(EngineBase):
         self.__account_COL = dict()
 
         self.strategy = None
+        self.events = None  # 策略订阅的回调, None表示全部
+        # 行情推送中有变化的symbol, 每个timestamp由flush合并成一次onPosition/onAccount
+        self.changed_positions = set()
+        self.changed_accounts = set()
+        # 需要逐bar估值的symbol: 有持仓, 或订单成交后还没有估值过一次(清零hedge_pnl等字段)
+        self.active_symbols = set()
         self.trading_symbols = self.config['TradingSymbols']
         self.account = dict()  # each symbol has its corresponding sub-account
         self.position = dict()
@@ -73,6 +81,7 @@ class PositionEngine(EngineBase):
         self.last_order_id = None
         self.back_id = None
         self.last_price = dict()
+        self.wall_start = time.time()
 
         self.Connect_MONGO()
         self.init()
@@ -110,14 +119,106 @@ class PositionEngine(EngineBase):
 
     def Connect_MONGO(self):
         """
-        链接数据库
+        链接数据库, 仅在enable_mongodb时链接
         """
+        self.mongo_service = None
+        self.mongo_writer = None
+        self.result_store = None
+        if not self.config.get('enable_mongodb', False):
+            return
+
         self.mongo_service = MongoDBHandler(self.config)
         self.mongo_service.Connect_DB()
 
+        # Mongo_Layout为timeseries时,所有run写入同一个按(run_id, symbol, kind, ts)索引的collection
+        if self.config['DB'].get('Mongo_Layout', 'collection') == 'timeseries':
+            self.run_id = MongoResultStore.make_run_id(self.config['user'], self.config['strategy_name'], self.config['bt_time'])
+            self.result_store = MongoResultStore(self.mongo_service, self.config['DB'].get('RESULT_DB', 'BacktestResult'),
+                                                 self.config['DB'].get('RESULT_COL', 'results'))
+            self.result_store.ensure_collection()
+            self.result_store.register_run(self.run_id, {
+                "user": self.config['user'], "strategy": self.config['strategy_name'], "bt_time": self.config['bt_time'],
+                "start_time": self.config['start_time'], "end_time": self.config['end_time'],
+                "symbols": list(self.trading_symbols), "params": dict(self.kwargs)})
+
+        # position/account在回测过程中由后台线程分批写入
+        self.mongo_writer = MongoBatchWriter(self.mongo_service)
+        self.mongo_writer.start()
+
+    def _result_col(self, col):
+        """
+        本次回测结果对应的collection名
+        """
+        return col + '|' + self.config['user'] + '|' + self.config['strategy_name'] + '|' + self.config['bt_time']
+
+    def _save_to_mongo(self, db, col, symbol, kind, record):
+        """
+        将一条position/account记录放入后台写入队列
+        """
+        if self.result_store is not None:
+            default_ts = MongoResultStore.to_datetime(self.config['lookback_time'])
+            doc = self.result_store.to_document(self.run_id, symbol, kind, record, default_ts)
+            self.mongo_writer.put(self.result_store.db, self.result_store.col, doc)
+        else:
+            self.mongo_writer.put(db, self._result_col(col), dict(record))
+
     def addStrategy(self, strategy):
         self.strategy = strategy
         self.strategy_name = self.config['strategy_name']
+        # 只接收一个参数的onPosition/onAccount(旧的写法)不传changed
+        self.position_takes_changed = self.takes_changed(strategy.onPosition)
+        self.account_takes_changed = self.takes_changed(strategy.onAccount)
+
+    @staticmethod
+    def takes_changed(callback):
+        """
+        回调是否接收第二个参数changed
+        """
+        try:
+            params = inspect.signature(callback).parameters.values()
+        except (TypeError, ValueError):
+            return True
+        if any(p.kind == inspect.Parameter.VAR_POSITIONAL for p in params):
+            return True
+        positional = [p for p in params if p.kind in (inspect.Parameter.POSITIONAL_ONLY,
+                                                      inspect.Parameter.POSITIONAL_OR_KEYWORD)]
+        return len(positional) >= 2
+
+    def notify_position(self, changed):
+        """
+        推送onPosition, changed: 有变化的symbol集合
+        """
+        if self.position_takes_changed:
+            self.strategy.onPosition(self.position, changed)
+        else:
+            self.strategy.onPosition(self.position)
+
+    def notify_account(self, changed):
+        """
+        推送onAccount, changed: 有变化的symbol集合
+        """
+        if self.account_takes_changed:
+            self.strategy.onAccount(self.account, changed)
+        else:
+            self.strategy.onAccount(self.account)
+
+    def subscribed(self, event):
+        """
+        策略是否订阅了该回调('position' / 'account')
+        """
+        return self.events is None or event in self.events
+
+    def flush(self):
+        """
+        推送本timestamp内行情和funding引起的持仓/账户变化, 每种回调只调用一次, 附带有变化的symbol集合
+        由主引擎在onBar之前调用
+        """
+        if self.changed_positions:
+            changed, self.changed_positions = self.changed_positions, set()
+            self.notify_position(changed)
+        if self.changed_accounts:
+            changed, self.changed_accounts = self.changed_accounts, set()
+            self.notify_account(changed)
 
     def update_position(self, event):
         """
@@ -125,11 +226,13 @@ class PositionEngine(EngineBase):
         fee/pnl calculated in BTC, trade unit need to be stated in config document
         """
         global orderBack
+        changed = set()  # 有变化的symbol
         if event.type == Event_Type.EVENT_ORDERBACK:
             
             orderBack = event.data
             price = orderBack.last_price
             symbol = orderBack.symbol
+            changed.add(symbol)
             exchange, signal, contract_type = symbol.split('_')
             
             ### orderBack.fee in trade_unit
@@ -403,9 +506,13 @@ class PositionEngine(EngineBase):
         else:
             self.write_log("not order back", logging.WARNING)
 
+        # 成交后的symbol在下一根bar估值
+        self.active_symbols.update(changed)
+
         # print(orderBack, self.position)
         if self.strategy is not None:
-            self.strategy.onPosition(self.position)
+            if self.subscribed('position'):
+                self.notify_position(changed)
 
             if self.last_order_id == self.back_id and self.back_id is not None:
                 self.strategy.pos_update = 1
@@ -413,10 +520,19 @@ class PositionEngine(EngineBase):
     def update_pnl(self, bar):
         """
         更新position的未实现盈亏, 杠杆率等信息, 由 Exchange Engine的 Feed 触发
+        只估值active_symbols中的symbol, 其它(空仓)symbol只更新价格和时间
         """
         
         price = bar.close
         symbol = bar.symbol
+        if symbol not in self.active_symbols:
+            # 空仓且已经结算过, 估值结果不变, 只记录价格
+            for side in ('long', 'short'):
+                self.position[symbol][side].cur_price = price
+                self.position[symbol][side].timestamp = bar.timestamp
+            self.last_price[symbol] = price
+            return
+
         exchange, signal, contract_type = symbol.split('_')
 
         # long
@@ -449,7 +565,7 @@ class PositionEngine(EngineBase):
             self.position[symbol]['long'].timestamp = bar.timestamp
             self.save_position_info(self.position[symbol]['long'], type='long', source='pnl')
 
-            self.update_account(self.position[symbol])
+            self.update_account(self.position[symbol], deferred=True)
             # account_update = COMMON_ACCOUNTUPDATE_EVENT(self.position[symbol])
             # self.event_manager.send_event(account_update)
 
@@ -481,102 +597,72 @@ class PositionEngine(EngineBase):
             self.position[symbol]['short'].timestamp = bar.timestamp
             self.save_position_info(self.position[symbol]['short'], type='short', source='pnl')
 
-            self.update_account(self.position[symbol])
+            self.update_account(self.position[symbol], deferred=True)
             # account_update = COMMON_ACCOUNTUPDATE_EVENT(self.position[symbol])
             # self.event_manager.send_event(account_update)
 
         self.last_price[symbol] = price
+        if not self.position[symbol]['long'].contracts and not self.position[symbol]['short'].contracts:
+            self.active_symbols.discard(symbol)
 
-        # update pnl
-        self.strategy.onPosition(self.position)
+        # update pnl, 在flush时推送
+        if self.subscribed('position'):
+            self.changed_positions.add(symbol)
 
     def update_funding_pnl(self, bar):
         """
         收到funding数据,更新position的信息
         """
-        symbol = bar.symbol
-        exchange, signal, contract_type = symbol.split('_')
-        funding_rate = bar.funding_rate
-        timestamp = bar.timestamp
-        
-        # price for quanto need to get btc_spot value, for other symbols, price can be get from bar data
-        price = self.last_price[symbol] if self.last_price[symbol] else get_spot_price(exchange, signal, timestamp)
-        dt_time = timestamp[-8:]
-        settlement_time = get_settlement_time(symbol.split('_')[0])
-        if dt_time in settlement_time:
-            # funding交割影响已实现收益
-            if self.position[symbol]['long'].volume != 0:
-                self.position[symbol]['long'].direction = PositionDirection.Long
-                self.position[symbol]['long'].timestamp = timestamp
-                self.position[symbol]['long'].avg_price = self.position[symbol]['long'].avg_price
-
-                self.position[symbol]['long'].contracts = self.position[symbol]['long'].contracts
-                self.position[symbol]['long'].available = self.position[symbol]['long'].available
-                self.position[symbol]['long'].volume = self.position[symbol]['long'].volume
-                ### in trade unit
-                self.position[symbol]['long'].trade_volume += funding_rate * self.position[symbol]['long'].volume
-
-                self.position[symbol]['long'].position_pnl = 0
-                self.position[symbol]['long'].hedge_pnl = 0
-                ### in trade unit
-                funding = funding_rate * self.position[symbol]['long'].volume
-                self.position[symbol]['long'].funding_pnl = -funding
-                self.position[symbol]['long'].profit_real -= funding
-
-                self.position[symbol]['long'].profit_total = self.position[symbol]['long'].profit_real + \
-                                                            self.position[symbol]['long'].profit_unreal
-
-                self.position[symbol]['long'].total_pnl = self.position[symbol]['long'].position_pnl + \
-                                                          self.position[symbol]['long'].hedge_pnl + \
-                                                          self.position[symbol]['long'].funding_pnl
+        self.settle_funding([bar])
 
-                # 储存position
-                self.save_position_info(self.position[symbol]['long'], type='long', source='funding')
+    def settle_funding(self, fundings):
+        """
+        同一结算时刻所有symbol的funding结算(FUNDING列表, symbol不带Funding_前缀)
+        交易所只在结算时刻推送funding(已按结算时刻对齐), 这里不再检查时间
+        只处理有持仓的一侧, 资金费用一次向量化计算, funding影响已实现收益
+        """
+        sides = [(funding, side) for funding in fundings if funding.symbol in self.active_symbols
+                 for side in ('long', 'short') if self.position[funding.symbol][side].volume != 0]
+        if not sides:
+            return
 
-                # 用long,short position更新account
-                self.update_account(self.position[symbol])
-                # account_update = COMMON_ACCOUNTUPDATE_EVENT(self.position[symbol])
-                # self.event_manager.send_event(account_update)
+        ### in trade unit
+        rates = np.array([funding.funding_rate for funding, _ in sides], dtype=float)
+        volumes = np.array([self.position[funding.symbol][side].volume for funding, side in sides], dtype=float)
+        amounts = rates * volumes
+        # 多头支付funding, 空头收取
+        pnls = np.where([side == 'long' for _, side in sides], -amounts, amounts)
 
-            if self.position[symbol]['short'].volume != 0:
-                self.position[symbol]['short'].direction = PositionDirection.Short
-                self.position[symbol]['short'].timestamp = timestamp
-                self.position[symbol]['short'].avg_price = self.position[symbol]['short'].avg_price
-
-                self.position[symbol]['short'].contracts = self.position[symbol]['short'].contracts
-                self.position[symbol]['short'].available = self.position[symbol]['short'].available
-                self.position[symbol]['short'].volume = self.position[symbol]['short'].volume
-                self.position[symbol]['short'].trade_volume += funding_rate * self.position[symbol]['short'].volume
-
-                self.position[symbol]['short'].position_pnl = 0
-                self.position[symbol]['short'].hedge_pnl = 0
-                ### in trade unit
-                funding = funding_rate * self.position[symbol]['short'].volume
-                self.position[symbol]['short'].funding_pnl = funding
-                self.position[symbol]['short'].profit_real += funding
-
-                self.position[symbol]['short'].profit_total = self.position[symbol]['short'].profit_real + \
-                                                             self.position[symbol]['short'].profit_unreal
-
-                self.position[symbol]['short'].total_pnl = self.position[symbol]['short'].position_pnl + \
-                                                           self.position[symbol]['short'].hedge_pnl + \
-                                                           self.position[symbol]['short'].funding_pnl
-                
-                # 储存position
-                self.save_position_info(self.position[symbol]['short'], type='short', source='funding')
+        for (funding, side), amount, pnl in zip(sides, amounts.tolist(), pnls.tolist()):
+            symbol = funding.symbol
+            position = self.position[symbol][side]
+            position.direction = PositionDirection.Long if side == 'long' else PositionDirection.Short
+            position.timestamp = funding.timestamp
+            position.trade_volume += amount
 
-                # 用long,short position更新account
-                self.update_account(self.position[symbol])
-                # account_update = COMMON_ACCOUNTUPDATE_EVENT(self.position[symbol])
-                # self.event_manager.send_event(account_update)
+            position.position_pnl = 0
+            position.hedge_pnl = 0
+            position.funding_pnl = pnl
+            position.profit_real += pnl
+
+            position.profit_total = position.profit_real + position.profit_unreal
+            position.total_pnl = position.position_pnl + position.hedge_pnl + position.funding_pnl
+
+            # 储存position
+            self.save_position_info(position, type=side, source='funding')
+
+            # 用long,short position更新account
+            self.update_account(self.position[symbol], deferred=True)
 
-        # update pnl
-        self.strategy.onPosition(self.position)
+            # update pnl, 在flush时推送
+            if self.subscribed('position'):
+                self.changed_positions.add(symbol)
 
 
-    def update_account(self, event):
+    def update_account(self, event, deferred=False):
         """
         position收到订单回执之后更新,然后发送long short两个position信息到account进行更新
+        deferred: 行情/funding引起的更新, onAccount在flush时合并推送
         """
         positions = event
         long_position: POSITION = positions['long']
@@ -613,7 +699,11 @@ class PositionEngine(EngineBase):
         self.save_account_info(self.account[symbol])
 
         if self.strategy is not None:
-            self.strategy.onAccount(self.account)
+            if self.subscribed('account'):
+                if deferred:
+                    self.changed_accounts.add(symbol)
+                else:
+                    self.notify_account({symbol})
 
             if self.last_order_id == self.back_id and self.back_id is not None:
                 self.strategy.acc_update = 1
@@ -648,6 +738,10 @@ class PositionEngine(EngineBase):
         elif type == 'short':
             self.save_position[symbol]['short'].append(position)
 
+        if self.mongo_writer is not None:
+            col = self.__position_COL_List[symbol]['Long' if type == 'long' else 'Short']
+            self._save_to_mongo(self.__position_DB, col, symbol, type, position)
+
         # Data = None
         # position = {"symbol": pos.symbol, "timestamp": pos.timestamp, "volume": pos.volume,
         #             "contracts": pos.contracts, "trade_volume": pos.trade_volume, "cur_price": pos.cur_price,
@@ -683,6 +777,9 @@ class PositionEngine(EngineBase):
                    "lever_rate": acc.lever_rate}
         self.save_account[symbol].append(account)
 
+        if self.mongo_writer is not None:
+            self._save_to_mongo(self.__account_DB, self.__account_COL[symbol], symbol, 'account', account)
+
         # symbol = acc.symbol
         # Data = None
         #
@@ -705,12 +802,19 @@ class PositionEngine(EngineBase):
         
         self.analyze_position_sources()
         
-        for symbol in self.trading_symbols:
+        if self.mongo_writer is not None:
+            # save to db: 回测过程中已经分批写入,这里写完队列中剩余的数据
+            inserted = self.mongo_writer.close()
+            if self.mongo_writer.errors:
+                self.write_log(f"fail to insert {len(self.mongo_writer.errors)} position/account records to MongoDB", logging.ERROR)
+            self.write_log(f"{inserted} position/account records saved to MongoDB", logging.INFO)
+        elif self.config.get('result_store', 'csv') == 'parquet':
+            self.save_parquet()
+        else:
             # save to csv
-            if not self.config['enable_mongodb']:
-                out_dir = f"./bt_result/{self.config['user']}/{self.config['bt_time']}"
-                os.makedirs(out_dir, exist_ok=True)
-
+            out_dir = f"./bt_result/{self.config['user']}/{self.config['bt_time']}"
+            os.makedirs(out_dir, exist_ok=True)
+            for symbol in self.trading_symbols:
                 long_df = pd.DataFrame(self.save_position[symbol]['long'])
                 long_df.to_csv(os.path.join(out_dir, f"{symbol}_long.csv"), index=False)
 
@@ -721,39 +825,28 @@ class PositionEngine(EngineBase):
                 account_df = pd.DataFrame(self.save_account[symbol])
                 account_df.to_csv(os.path.join(out_dir, f"{symbol}_account.csv"), index=False)
 
-            else:
-                # save to db
-                Data = None
-                Info = {'req': 'insert', 'data': self.save_position[symbol]['long']}
-                col = self.__position_COL_List[symbol]['Long'] + '|' + self.config['user'] + '|' + self.strategy_name + '|' + self.config['bt_time'] 
-
-                mongo = MONGODATA(DB=self.__position_DB, COL=col, Data=Data, Info=Info)
-                fl = self.mongo_service.on_insert_many(mongo)
-                if not fl:
-                    self.write_log("fail to insert long position info to MongoDB", logging.ERROR)
-
-                Info = {'req': 'insert', 'data': self.save_position[symbol]['short']}
-                col = self.__position_COL_List[symbol]['Short'] + '|' + self.config['user'] + '|' + self.strategy_name + '|' + self.config['bt_time'] 
-
-                mongo = MONGODATA(DB=self.__position_DB, COL=col, Data=Data, Info=Info)
-                fl = self.mongo_service.on_insert_many(mongo)
-                if not fl:
-                    self.write_log("fail to insert long position info to MongoDB", logging.ERROR)
-
-                Info = {"req": "insert", "data": self.save_account[symbol]}
-
-                col = self.__account_COL[symbol] + '|' + self.config['user'] + '|' + self.strategy_name + '|' + self.config['bt_time'] 
-
-                MongoData = MONGODATA(DB=self.__account_DB, COL=col, Data=Data, Info=Info)
-
-                fl = self.mongo_service.on_insert_many(MongoData)
-                if not fl:
-                    self.write_log("fail to insert account info to MongoDB", logging.ERROR)
-
         event = PLOT_EVENT()
         self.event_manager.send_event(event)
         
 
+    def save_parquet(self):
+        """
+        按run_id/symbol/kind分区写入本地parquet结果库, 并在catalog中记录本次run
+        """
+        store = ParquetResultStore(self.config.get('result_dir', './bt_result/store'))
+        run_id = ParquetResultStore.make_run_id(self.config['user'], self.config['strategy_name'], self.config['bt_time'])
+        frames = dict()
+        for symbol in self.trading_symbols:
+            frames[(symbol, 'long')] = self.save_position[symbol]['long']
+            frames[(symbol, 'short')] = self.save_position[symbol]['short']
+            frames[(symbol, 'account')] = self.save_account[symbol]
+
+        rows = store.write_run(run_id, frames)
+        metrics = ParquetResultStore.compute_metrics(frames)
+        store.register_run(run_id, self.config, params=dict(self.kwargs), metrics=metrics,
+                           wall_time=time.time() - self.wall_start)
+        self.write_log(f"{rows} position/account records saved to {store.root}, run_id: {run_id}", logging.INFO)
+
     def write_log(self, msg: str, level: int = logging.INFO):
         """
         打印信息
@@ -766,7 +859,8 @@ class PositionEngine(EngineBase):
 
     def close(self, event):
         if event.type == Event_Type.EVENT_STOP:
-            self.mongo_service.disconnected()
+            if self.mongo_service is not None:
+                self.mongo_service.disconnected()
 
             self.write_log(msg="End Position Engine")
             # self.write_log(msg=event.data['info'])
@@ -822,8 +916,12 @@ class OrderEngine(EngineBase):
 
     def Connect_MONGO(self):
         """
-        Connect to MongoDB
+        Connect to MongoDB only when enable_mongodb is set
         """
+        self.mongo_service = None
+        if not self.config.get('enable_mongodb', False):
+            return
+
         self.mongo_service = MongoDBHandler(self.config)
         self.mongo_service.Connect_DB()
 
@@ -1060,13 +1158,27 @@ class PlotEngine(EngineBase):
 
     def Connect_MONGO(self):
         """
-        链接数据库
+        链接数据库, 仅在enable_mongodb时链接, 使用进程内共享的client
         """
-        self.client = pymongo.MongoClient(host=self.host,
-                                          port=self.port)
+        self.client = None
+        self.my_db = None
+        self.position_db = None
+        self.result_store = None
+        if not self.config.get('enable_mongodb', False):
+            return
+
+        mongo_service = MongoDBHandler(self.config)
+        mongo_service.Connect_DB()
+        self.client = mongo_service.client
         self.my_db = self.client[self.__account_DB]
         self.position_db = self.client[f"{self.config['user']}_PositionInfo-{self.config['strategy_name']}"]
 
+        if self.config['DB'].get('Mongo_Layout', 'collection') == 'timeseries':
+            self.run_id = MongoResultStore.make_run_id(self.config['user'], self.config['strategy_name'], self.config['bt_time'])
+            self.result_store = MongoResultStore(mongo_service, self.config['DB'].get('RESULT_DB', 'BacktestResult'),
+                                                 self.config['DB'].get('RESULT_COL', 'results'))
+            self.result_store.ensure_collection()
+
     def addStrategy(self, strategy):
         self.strategy = strategy
         self.strategy_name = self.config['strategy_name']
@@ -1089,7 +1201,12 @@ class PlotEngine(EngineBase):
         # print(self.position_db[f"{symbol}_{}"])
         for symbol in self.trading_symbols:
             for direction in ['long', 'short']:
-                if self.config['enable_mongodb']:
+                if self.result_store is not None:
+                    pnl_columns = ["timestamp", "hedge_pnl", "position_pnl", "funding_pnl", "total_pnl"]
+                    symbol_result[f"{symbol}_{direction}"] = self.result_store.query(
+                        run_ids=[self.run_id], symbols=[symbol], kinds=[direction], fields=pnl_columns)[pnl_columns]
+
+                elif self.config['enable_mongodb']:
                     symbol_result[f"{symbol}_{direction}"] = dict()
 
                     symbol_table = self.position_db[f"{symbol}_{direction}|{self.config['user']}|{self.strategy_name}|{self.config['bt_time']}"]
@@ -1112,6 +1229,13 @@ class PlotEngine(EngineBase):
 
                     symbol_result[f"{symbol}_{direction}"] = pd.DataFrame(symbol_result[f"{symbol}_{direction}"])
 
+                elif self.config.get('result_store', 'csv') == 'parquet':
+                    pnl_columns = ["timestamp", "hedge_pnl", "position_pnl", "funding_pnl", "total_pnl"]
+                    store = ParquetResultStore(self.config.get('result_dir', './bt_result/store'))
+                    run_id = ParquetResultStore.make_run_id(self.config['user'], self.strategy_name, self.config['bt_time'])
+                    symbol_result[f"{symbol}_{direction}"] = store.scan(
+                        run_ids=[run_id], symbols=[symbol], kinds=[direction], columns=pnl_columns)[pnl_columns].iloc[1:]
+
                 else:
                     symbol_result[f"{symbol}_{direction}"] = pd.read_csv(f"./bt_result/{self.config['user']}/{self.config['bt_time']}/{symbol}_{direction}.csv").iloc[1:]
 
@@ -1182,37 +1306,37 @@ class PlotEngine(EngineBase):
         # original_threads = pa.get_cpu_count()
         pa.set_cpu_count(1)  # 强制单线程模式
 
+        catalog = DataCatalog.from_config(self.config)
+        bar_cache = BarCache.from_config(self.config, catalog)
         for symbol in self.trading_symbols:
             try:
                 symbol_result[symbol] = pd.DataFrame()
-                parse_symbol = split_symbol(symbol)
-                file_path = f"/srv/data/{parse_symbol['exchange']}/klines/1m/{parse_symbol['pair']}/{symbol}.parquet"
-                # 关键修复：使用正确的数据访问方式
-                with open(file_path, 'rb') as f:
-                    buf = f.read()
-                    reader = pq.ParquetFile(BytesIO(buf))
-                    arrow_table = reader.read(use_threads=False)  # 获取完整Arrow Table
-                    
+                if bar_cache is not None:
+                    _, results = bar_cache.window(symbol, self.config['lookback_time'], self.config['end_time'])
+                else:
+                    # 关键修复：使用正确的数据访问方式(路径由catalog解析, 只读取与回测区间重叠的row group)
+                    arrow_table = catalog.read_table(symbol, self.config['lookback_time'],
+                                                     self.config['end_time'])  # 获取Arrow Table
                     results = parse_pyarrow_table(arrow_table)
-                    timestamp_col = results['timestamp']
+                timestamp_col = results['timestamp']
 
-                    results['timestamp'] = timestamp_col
-                    # 预计算有效索引(避免循环内判断)
-                    mask = (timestamp_col >= self.config['lookback_time']) & \
-                        (timestamp_col <= self.config['end_time'])
-                    valid_indices = np.where(mask)[0]
+                results['timestamp'] = timestamp_col
+                # 预计算有效索引(避免循环内判断)
+                mask = (timestamp_col >= self.config['lookback_time']) & \
+                    (timestamp_col <= self.config['end_time'])
+                valid_indices = np.where(mask)[0]
                     
-                    # 关键修复7：使用原生Python类型存储
-                    symbol_result[symbol] = pd.DataFrame({
-                        'timestamp': results['timestamp'][valid_indices],
-                        'high': results['high'][valid_indices].astype('float'),
-                        'low': results['low'][valid_indices].astype('float'),
-                        'open': results['open'][valid_indices].astype('float'),
-                        'close': results['close'][valid_indices].astype('float'),
-                        'volume': results['volume'][valid_indices].astype('float')
-                    }, columns=['timestamp', 'high', 'low', 'open', 'close', 'volume'])
-                    symbol_result[symbol].set_index('timestamp', inplace=True)
-                    print(f"Successfully loaded market data for {symbol}: {len(symbol_result[symbol])} rows")
+                # 关键修复7：使用原生Python类型存储
+                symbol_result[symbol] = pd.DataFrame({
+                    'timestamp': results['timestamp'][valid_indices],
+                    'high': results['high'][valid_indices].astype('float'),
+                    'low': results['low'][valid_indices].astype('float'),
+                    'open': results['open'][valid_indices].astype('float'),
+                    'close': results['close'][valid_indices].astype('float'),
+                    'volume': results['volume'][valid_indices].astype('float')
+                }, columns=['timestamp', 'high', 'low', 'open', 'close', 'volume'])
+                symbol_result[symbol].set_index('timestamp', inplace=True)
+                print(f"Successfully loaded market data for {symbol}: {len(symbol_result[symbol])} rows")
             except Exception as e:
                 print(f"Error loading market data for {symbol}: {e}")
                 symbol_result[symbol] = pd.DataFrame()  # Create empty DataFrame for failed symbols
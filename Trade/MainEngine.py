@@ -5,6 +5,7 @@ Date: 7-20
 """
 import logging
 from Trade.Engine import *
+from Data.DataHandlers import MongoDBHandler, close_mongo_clients
 from Event_Engine import Event_Engine
 from Utils.Event import *
 from Utils.Constant import *
@@ -35,11 +36,18 @@ class MainEngine(EngineBase):
 
         self.trading_symbols = self.config['TradingSymbols']  # 交易的品种
         self.funding_symbols = self.config['FundingSymbols']  # funding结算
+        self.signal_symbols = self.config.get('SignalSymbols', [])  # 只作为信号输入, 不交易
+        # fast_warmup打开时预热期(lookback_time到start_time)的行情只推送给策略的onWarmup, 不经过持仓/账户引擎
+        self.warmup = self.config.get('fast_warmup', False)
+        # 策略订阅的数据, addStrategy时按策略的subscriptions()更新
+        self.subscription = resolve_subscription(None, self.config)
 
         # bar数据
         self.BAR = dict()
         # funding数据
         self.FUNDING = dict()
+        # 额外订阅周期的bar数据, {timeframe: {symbol: BAR}}
+        self.TIMEFRAME_BAR = dict()
 
         self.init()
         self.Connect_MONGO()
@@ -77,8 +85,12 @@ class MainEngine(EngineBase):
 
     def Connect_MONGO(self):
         """
-        链接数据库
+        链接数据库, 仅在enable_mongodb时链接
         """
+        self.mongo_service = None
+        if not self.config.get('enable_mongodb', False):
+            return
+
         self.mongo_service = MongoDBHandler(self.config)
         self.mongo_service.Connect_DB()
 
@@ -92,7 +104,12 @@ class MainEngine(EngineBase):
 
         self.strategy.onInit(**self.kwargs)
 
+        # 交易所只读取订阅的信号品种和字段, position engine只推送订阅的回调
+        self.subscription = resolve_subscription(self.strategy.subscriptions(), self.config)
+        self.exchange.subscribe(subscribed_market_data(self.subscription, self.config), self.subscription.fields)
+
         self.position_manager.addStrategy(self.strategy)
+        self.position_manager.events = self.subscription.events
         self.plot_manager.addStrategy(self.strategy)
         self.order_manager.addStrategy(self.strategy)
 
@@ -104,40 +121,122 @@ class MainEngine(EngineBase):
         """
         try:
             data = event.data
-            
+            subscription = self.subscription
+
+            if self.warmup:
+                if next(iter(data.values()))['timestamp'] < self.config['start_time']:
+                    self.process_warmup_data(data)
+                    return
+                self.warmup = False
+
             for symbol in data.keys():
                 if symbol in self.funding_symbols:
                     funding = FUNDING(symbol=symbol, funding_rate=float(data[symbol]['fundingRate']), timestamp=data[symbol]['timestamp'])
                     self.timestamp = data[symbol]['timestamp']
                     self.FUNDING[symbol] = funding
-                    # update unrealized pnl
                     funding.symbol = funding.symbol.replace('Funding_', '')
-                    self.position_manager.update_funding_pnl(funding)
 
                 if symbol in self.trading_symbols:
                     self.timestamp = data[symbol]['timestamp']
-                    self.BAR[symbol] = BAR(symbol=symbol, timestamp=data[symbol]['timestamp'], open=float(data[symbol]['open']), 
-                                           high=float(data[symbol]['high']), low=float(data[symbol]['low']), close=float(data[symbol]['close']),
-                                           volume=float(data[symbol]['volume']), quote_volume=float(data[symbol]['quote_volume']), 
-                                           count=float(data[symbol]['count']), taker_buy_volume=float(data[symbol]['taker_buy_volume']), 
-                                           taker_buy_quote_volume=float(data[symbol]['taker_buy_quote_volume']))
+                    bar = self.make_bar(symbol, data[symbol])
+
+                    self.position_manager.update_pnl(bar)
 
-                    self.position_manager.update_pnl(self.BAR[symbol])
+                    if symbol in subscription.symbols:
+                        self.BAR[symbol] = bar
+                        self.collect_timeframe_bars(symbol, data[symbol])
+
+                elif symbol in subscription.symbols:
+                    # 信号品种只推送给策略, 不估值持仓
+                    self.timestamp = data[symbol]['timestamp']
+                    self.BAR[symbol] = self.make_bar(symbol, data[symbol])
+                    self.collect_timeframe_bars(symbol, data[symbol])
 
             if len(self.FUNDING) > 0:
-                self.strategy.onFunding(self.FUNDING)
+                # 同一结算时刻的funding一次结算
+                self.position_manager.settle_funding(list(self.FUNDING.values()))
+
+            # 本timestamp内的持仓/账户变化合并推送一次, 在onFunding/onBar之前
+            self.position_manager.flush()
+
+            if len(self.FUNDING) > 0:
+                if 'funding' in subscription.events:
+                    self.strategy.onFunding(self.FUNDING)
 
                 self.FUNDING = dict()
 
             if len(self.BAR) > 0:
                 # 调用策略处理数据
-                self.strategy.onBar(self.BAR)
+                if 'bar' in subscription.events:
+                    self.strategy.onBar(self.BAR)
 
                 self.BAR = dict()
+
+            if len(self.TIMEFRAME_BAR) > 0:
+                # 大周期bar在其最后一根基础周期bar之后推送
+                if 'timeframe' in subscription.events:
+                    for timeframe, bars in self.TIMEFRAME_BAR.items():
+                        self.strategy.onTimeframeBar(timeframe, bars)
+
+                self.TIMEFRAME_BAR = dict()
                     
         except ValueError as e:
             self.write_log(f'trading data wrong, {symbol}, {self.timestamp}, error: {str(e)}', logging.ERROR)
 
+    def process_warmup_data(self, data):
+        """
+        预热期的行情: 只构建订阅的bar和funding推送给策略更新指标(此时不能下单, 持仓都是空仓),
+        不估值持仓, 不结算funding, 不写持仓/账户记录
+        """
+        subscription = self.subscription
+        for symbol in data.keys():
+            if symbol in self.funding_symbols:
+                self.timestamp = data[symbol]['timestamp']
+                self.FUNDING[symbol] = FUNDING(symbol=symbol.replace('Funding_', ''), timestamp=self.timestamp,
+                                               funding_rate=float(data[symbol]['fundingRate']))
+
+            elif symbol in subscription.symbols:
+                self.timestamp = data[symbol]['timestamp']
+                self.BAR[symbol] = self.make_bar(symbol, data[symbol])
+                self.collect_timeframe_bars(symbol, data[symbol])
+
+        if len(self.FUNDING) > 0:
+            if 'funding' in subscription.events:
+                self.strategy.onFunding(self.FUNDING)
+
+            self.FUNDING = dict()
+
+        if len(self.BAR) > 0:
+            if 'bar' in subscription.events:
+                self.strategy.onWarmup(self.BAR)
+
+            self.BAR = dict()
+
+        if len(self.TIMEFRAME_BAR) > 0:
+            if 'timeframe' in subscription.events:
+                for timeframe, bars in self.TIMEFRAME_BAR.items():
+                    self.strategy.onTimeframeBar(timeframe, bars)
+
+            self.TIMEFRAME_BAR = dict()
+
+    @staticmethod
+    def make_bar(symbol, data):
+        """
+        行情数据 -> BAR, 没有订阅的字段为0
+        """
+        return BAR(symbol=symbol, timestamp=data['timestamp'], open=float(data['open']),
+                   high=float(data['high']), low=float(data['low']), close=float(data['close']),
+                   volume=float(data.get('volume', 0)), quote_volume=float(data.get('quote_volume', 0)),
+                   count=float(data.get('count', 0)), taker_buy_volume=float(data.get('taker_buy_volume', 0)),
+                   taker_buy_quote_volume=float(data.get('taker_buy_quote_volume', 0)))
+
+    def collect_timeframe_bars(self, symbol, data):
+        """
+        收集行情数据中附带的其它周期bar
+        """
+        for timeframe, bar in data.get(TIMEFRAME_BARS, {}).items():
+            self.TIMEFRAME_BAR.setdefault(timeframe, dict())[symbol] = self.make_bar(symbol, bar)
+
     # def process_funding_data(self, event):
     #     """
     #     处理收到的funding数据
@@ -225,7 +324,8 @@ class MainEngine(EngineBase):
         # 避免重复调用
         if event.type != Event_Type.EVENT_STOP:
             return
-        # 退出程序
+        # 关闭共享的数据库链接并退出程序
+        close_mongo_clients()
         import sys
         sys.exit(0)
 
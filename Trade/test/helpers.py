@@ -0,0 +1,103 @@
+"""
+Trade/test中多个测试文件共用的配置, 数据和桩对象
+"""
+import json
+from uuid import UUID
+
+import numpy as np
+import pandas as pd
+
+from Data.catalog import to_ms
+
+hardcoded_uuid = UUID("123e4567-e89b-12d3-a456-426614174000")
+
+CONFIG = {
+    "coin": "btc",
+    "user": "yc",
+    "start_time": "2024-01-10 00-10-00",
+    "end_time": "2024-01-10 00-30-00",
+    "lookback_time": "2024-01-01 00-10-00",
+    'bt_time': "20250419120000",
+    "strategy_name": "test_strategy",
+    'is_windows': False,
+    "TradingSymbols": ["BinanceU_BTCUSDT_perp"],
+    "FundingSymbols": ["Funding_BinanceU_BTCUSDT_perp"],
+    "MARKET_DATA": ["BinanceU_BTCUSDT_perp", "Funding_BinanceU_BTCUSDT_perp"],
+    "DB": {
+        "Mongo_Host": "localhost",
+        "Mongo_Port": "27017",
+        "ACCOUNT_DB": "test_AccountInfo-test_strategy",
+        "ACCOUNT_COL": {"BinanceU_BTCUSDT_perp": "BinanceU_BTCUSDT_perp"},
+        "POSITION_DB": "test_PositionInfo-test_strategy",
+        "POSITION_COL": {"BinanceU_BTCUSDT_perp": {"Long": "BinanceU_BTCUSDT_perp_long", "Short": "BinanceU_BTCUSDT_perp_short"}},
+        "ORDER_DB": "test_OrderInfo-test_strategy",
+        "ORDER_COL": {"BinanceU_BTCUSDT_perp": {"Long": "BinanceU_BTCUSDT_perp_long", "Short": "BinanceU_BTCUSDT_perp_short"}},
+    },
+    "init_account": "300",
+    "Trade_Unit": "COIN",
+    "Min_Unit": "0.01",
+    "Fee_Type": "taker",
+    "Slippage": "0.0005"
+}
+
+with open("cfg.json", 'r') as f:
+    CFG = json.load(f)
+
+
+def minute_bars(n, start="2024-01-01 00:00:00", skip=()):
+    rng = np.random.default_rng(0)
+    minutes = np.array([m for m in range(n) if m not in skip], dtype=np.int64)
+    open_time = to_ms(start) + minutes * 60000
+    close = 100 + np.cumsum(rng.normal(size=len(minutes)))
+    return pd.DataFrame({
+        "open_time": open_time, "open": close - 0.1, "high": close + rng.random(len(minutes)),
+        "low": close - 1 - rng.random(len(minutes)), "close": close, "volume": rng.random(len(minutes)),
+        "close_time": open_time + 59999, "quote_volume": rng.random(len(minutes)),
+        "count": rng.integers(1, 100, len(minutes)), "taker_buy_volume": rng.random(len(minutes)),
+        "taker_buy_quote_volume": rng.random(len(minutes)), "ignore": 0,
+        "timestamp": pd.to_datetime(open_time, unit="ms").astype(str)})
+
+
+class FakeEventEngine:
+    def register(self, *args):
+        pass
+
+    def send_event(self, event):
+        pass
+
+
+class MarkingStub:
+    def __init__(self):
+        self.marked = []
+
+    def update_pnl(self, bar):
+        self.marked.append(bar.timestamp)
+
+    def flush(self):
+        pass
+
+
+class Event:
+    def __init__(self, data):
+        self.data = data
+
+
+class RecordingStrategy:
+    """按调用顺序记录策略回调: (回调名, 参数摘要)"""
+    def __init__(self):
+        self.calls = []
+
+    def onBar(self, bar):
+        self.calls.append(("bar", sorted(bar)))
+
+    def onTimeframeBar(self, timeframe, bar):
+        self.calls.append((timeframe, {s: b.close for s, b in bar.items()}))
+
+    def onFunding(self, funding):
+        self.calls.append(("funding", sorted(funding)))
+
+    def onPosition(self, position, changed=None):
+        self.calls.append(("position", sorted(changed)))
+
+    def onAccount(self, account, changed=None):
+        self.calls.append(("account", sorted(changed)))
@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from Data.catalog import default_path, to_ms
+from Exchange.Exchange import Exchange_Backtest_Medium_Frequency
+from Trade.Engine import PositionEngine
+from Trade.test.helpers import CFG, CONFIG, FakeEventEngine, RecordingStrategy, hardcoded_uuid
+from Utils.Constant import OrderType, OrderAction, OrderOffset, OrderStatus
+from Utils.DataStructure import FUNDING, ORDERBACK
+from Utils.Event import ORDERBACK_EVENT
+from Utils.util import asof_funding, settlement_schedule
+
+SYMBOL = "BinanceU_BTCUSDT_perp"
+FUNDING_SYMBOL = "Funding_BinanceU_BTCUSDT_perp"
+
+
+def test_settlement_schedule_and_asof_join():
+    schedule = settlement_schedule("BinanceU", "2024-01-01 03:00:00", "2024-01-02 08:00:00")
+    assert list(pd.to_datetime(schedule, unit="ms").strftime("%H:%M")) == ["08:00", "16:00", "00:00", "08:00"]
+    assert list(settlement_schedule("BitMEX", "2024-01-01 00:00:00", "2024-01-01 12:00:00") % 86400000 // 3600000) \
+        == [4, 12]
+
+    # 晚几毫秒的记录对齐到结算时刻, 缺失的时刻不沿用旧的funding
+    funding_time = np.array([schedule[0] + 5, schedule[1] - 100, schedule[2] - 2 * 60000, schedule[3]])
+    instants, index = asof_funding(schedule, funding_time)
+    np.testing.assert_array_equal(instants, schedule[[0, 1, 3]])
+    np.testing.assert_array_equal(index, [0, 1, 3])
+
+
+def test_exchange_publishes_funding_at_settlement_instants(tmp_path):
+    path = default_path(FUNDING_SYMBOL, str(tmp_path))
+    os.makedirs(os.path.dirname(path))
+    funding_time = to_ms("2024-01-01 00:00:00") + np.arange(6, dtype=np.int64) * 8 * 3600 * 1000 + 7
+    funding_time[2] -= 4 * 3600 * 1000  # 不在结算时刻的记录
+    pd.DataFrame({"symbol": "BTCUSDT", "fundingTime": funding_time,
+                  "fundingRate": ["0.0001", "0.0002", "0.0003", "0.0004", "0.0005", "0.0006"],
+                  "timestamp": pd.to_datetime(funding_time, unit="ms").strftime("%Y-%m-%d %H:%M:%S")}
+                 ).to_parquet(path, index=False)
+    config = {"MARKET_DATA": [FUNDING_SYMBOL], "TradingSymbols": [], "FundingSymbols": [FUNDING_SYMBOL],
+              "Slippage": 0, "data_root": str(tmp_path), "bar_cache_dir": None, "Timeframes": None,
+              "lookback_time": "2024-01-01 00:00:00", "end_time": "2024-01-02 16:00:00"}
+    exchange = Exchange_Backtest_Medium_Frequency(FakeEventEngine(), False, config, {"CONTRACT_TYPE": {"SPOT": "spot"}})
+    rows = list(exchange._Exchange_Backtest_Medium_Frequency__parquet_reader_generator(FUNDING_SYMBOL))
+    assert [row["timestamp"] for row in rows] == ["2024-01-01 00:00:00", "2024-01-01 08:00:00",
+                                                  "2024-01-02 00:00:00", "2024-01-02 08:00:00",
+                                                  "2024-01-02 16:00:00"]
+    assert [row["fundingRate"] for row in rows] == ["0.0001", "0.0002", "0.0004", "0.0005", "0.0006"]
+
+
+def test_settle_funding_applies_to_open_positions():
+    symbols = [SYMBOL, "BinanceU_ETHUSDT_perp", "BinanceU_SOLUSDT_perp"]
+    pos_col = {s: {"Long": f"{s}_long", "Short": f"{s}_short"} for s in symbols}
+    config = dict(CONFIG, TradingSymbols=symbols, MARKET_DATA=symbols,
+                  DB=dict(CONFIG["DB"], ACCOUNT_COL=dict(zip(symbols, symbols)), POSITION_COL=pos_col))
+    pe = PositionEngine(FakeEventEngine(), config, CFG)
+    strategy = RecordingStrategy()
+    pe.addStrategy(strategy)
+
+    for s, direction in [(symbols[0], OrderAction.Buy), (symbols[1], OrderAction.Sell)]:
+        pe.update_position(ORDERBACK_EVENT(data=ORDERBACK(
+            timestamp="2024-01-10 00:10:00", symbol=s, volume=0.5, volume_in_contract=0.5, price=100.0,
+            orderType=OrderType.Market, direction=direction, order_id=hardcoded_uuid, trade_volume=0.5,
+            trade_volume_in_contract=0.5, traded_avg_price=100.0, fee=0, offset=OrderOffset.Open, last_price=100.0,
+            status=OrderStatus.AllTraded)))
+    strategy.calls = []
+    long, short = pe.position[symbols[0]]['long'], pe.position[symbols[1]]['short']
+    real_long, real_short = long.profit_real, short.profit_real
+
+    pe.settle_funding([FUNDING(timestamp="2024-01-10 16:00:00", symbol=s, funding_rate=0.001) for s in symbols])
+    assert long.funding_pnl == -0.001 * long.volume and long.profit_real == real_long - 0.001 * long.volume
+    assert short.funding_pnl == 0.001 * short.volume and short.profit_real == real_short + 0.001 * short.volume
+    assert long.total_pnl == long.funding_pnl and short.timestamp == "2024-01-10 16:00:00"
+    assert pe.position[symbols[2]]['long'].funding_pnl == 0
+    pe.flush()
+    assert strategy.calls == [("position", symbols[:2]), ("account", symbols[:2])]
@@ -1,50 +1,15 @@
 import pytest
-import json
-from uuid import UUID
 
 from Trade.Engine import PositionEngine
+from Trade.test.helpers import CFG, CONFIG, RecordingStrategy, hardcoded_uuid
 from Event_Engine import Event_Engine
 from Utils.Constant import OrderType, OrderAction, OrderOffset, OrderStatus
-from Utils.DataStructure import POSITION, ACCOUNT, ORDERBACK
+from Utils.DataStructure import POSITION, ACCOUNT, ORDERBACK, BAR
 from Utils.Event import ORDERBACK_EVENT
 
 
-hardcoded_uuid = UUID("123e4567-e89b-12d3-a456-426614174000")
-
-CONFIG = {
-    "coin": "btc",
-    "user": "yc",
-    "start_time": "2024-01-10 00-10-00",
-    "end_time": "2024-01-10 00-30-00",
-    "lookback_time": "2024-01-01 00-10-00",
-    'bt_time': "20250419120000",
-    "strategy_name": "test_strategy",
-    'is_windows': False,
-    "TradingSymbols": ["BinanceU_BTCUSDT_perp"],
-    "FundingSymbols": ["Funding_BinanceU_BTCUSDT_perp"],
-    "MARKET_DATA": ["BinanceU_BTCUSDT_perp", "Funding_BinanceU_BTCUSDT_perp"],
-    "DB": {
-        "Mongo_Host": "localhost",
-        "Mongo_Port": "27017",
-        "ACCOUNT_DB": "test_AccountInfo-test_strategy",
-        "ACCOUNT_COL": {"BinanceU_BTCUSDT_perp": "BinanceU_BTCUSDT_perp"},
-        "POSITION_DB": "test_PositionInfo-test_strategy",
-        "POSITION_COL": {"BinanceU_BTCUSDT_perp": {"Long": "BinanceU_BTCUSDT_perp_long", "Short": "BinanceU_BTCUSDT_perp_short"}},
-        "ORDER_DB": "test_OrderInfo-test_strategy",
-        "ORDER_COL": {"BinanceU_BTCUSDT_perp": {"Long": "BinanceU_BTCUSDT_perp_long", "Short": "BinanceU_BTCUSDT_perp_short"}},
-    },
-    "init_account": "300",
-    "Trade_Unit": "COIN",
-    "Min_Unit": "0.01",
-    "Fee_Type": "taker",
-    "Slippage": "0.0005"
-}
-
 symbol = CONFIG['TradingSymbols'][0]
 
-with open("cfg.json", 'r') as f:
-    CFG = json.load(f)
-
 @pytest.fixture(scope="module")
 def event_engine():
     return Event_Engine()
@@ -97,4 +62,102 @@ def test_orderback_event(position_engine):
     assert position_engine.position[symbol]['long'].avg_price == 0
     assert position_engine.position[symbol]['long'].volume == 0.0
     assert position_engine.position[symbol]['long'].trade_volume == 1.0
-    assert position_engine.position[symbol]['long'].profit_real == 0.014925373134328358
\ No newline at end of file
+    assert position_engine.position[symbol]['long'].profit_real == 0.014925373134328358
+
+def test_mark_to_market_callbacks_are_coalesced(event_engine):
+    symbols = ["BinanceU_BTCUSDT_perp", "BinanceU_ETHUSDT_perp"]
+    pos_col = {s: {"Long": f"{s}_long", "Short": f"{s}_short"} for s in symbols}
+    config = dict(CONFIG, TradingSymbols=symbols, MARKET_DATA=symbols,
+                  DB=dict(CONFIG["DB"], ACCOUNT_COL=dict(zip(symbols, symbols)), POSITION_COL=pos_col))
+    pe = PositionEngine(event_engine, config, CFG)
+    strategy = RecordingStrategy()
+    pe.addStrategy(strategy)
+
+    for s in symbols:
+        orderback = ORDERBACK(timestamp="2024-01-10 00:10:00", symbol=s, volume=0.5, volume_in_contract=0.5,
+                              price=100.0, orderType=OrderType.Market, direction=OrderAction.Buy,
+                              order_id=hardcoded_uuid, trade_volume=0.5, trade_volume_in_contract=0.5,
+                              traded_avg_price=100.0, fee=0, offset=OrderOffset.Open, last_price=100.0,
+                              status=OrderStatus.AllTraded)
+        pe.update_position(ORDERBACK_EVENT(data=orderback))
+    # 订单回执立即推送
+    assert strategy.calls == [("account", [symbols[0]]), ("position", [symbols[0]]),
+                              ("account", [symbols[1]]), ("position", [symbols[1]])]
+
+    strategy.calls = []
+    for s in symbols:
+        pe.update_pnl(BAR(symbol=s, timestamp="2024-01-10 00:11:00", open=101, high=101, low=101, close=101,
+                          volume=0, quote_volume=0, count=0, taker_buy_volume=0, taker_buy_quote_volume=0))
+    assert strategy.calls == []
+    pe.flush()
+    assert strategy.calls == [("position", symbols), ("account", symbols)]
+    assert pe.position[symbols[1]]['long'].cur_price == 101
+    pe.flush()
+    assert len(strategy.calls) == 2
+
+
+def make_bar(s, timestamp, close):
+    return BAR(symbol=s, timestamp=timestamp, open=close, high=close, low=close, close=close,
+               volume=0, quote_volume=0, count=0, taker_buy_volume=0, taker_buy_quote_volume=0)
+
+
+def test_flat_positions_skip_marking(event_engine):
+    pe = PositionEngine(event_engine, CONFIG, CFG)
+    strategy = RecordingStrategy()
+    pe.addStrategy(strategy)
+
+    pe.update_pnl(make_bar(symbol, "2024-01-10 00:10:00", 100.0))
+    pe.flush()
+    assert strategy.calls == [] and pe.last_price[symbol] == 100.0
+    assert pe.position[symbol]['long'] == POSITION(symbol=symbol, cur_price=100.0, timestamp="2024-01-10 00:10:00")
+
+    def fill(direction, offset, price):
+        pe.update_position(ORDERBACK_EVENT(data=ORDERBACK(
+            timestamp="2024-01-10 00:11:00", symbol=symbol, volume=0.5, volume_in_contract=0.5, price=price,
+            orderType=OrderType.Market, direction=direction, order_id=hardcoded_uuid, trade_volume=0.5,
+            trade_volume_in_contract=0.5, traded_avg_price=price, fee=0.001, offset=offset, last_price=price,
+            status=OrderStatus.AllTraded)))
+
+    fill(OrderAction.Buy, OrderOffset.Open, 101.0)
+    pe.update_pnl(make_bar(symbol, "2024-01-10 00:12:00", 102.0))
+    long = pe.position[symbol]['long']
+    assert long.cur_price == 102.0 and long.position_pnl != 0
+
+    # 平仓后估值一次清零hedge_pnl等字段, 之后只记录价格
+    fill(OrderAction.Sell, OrderOffset.Close, 103.0)
+    assert long.hedge_pnl == -0.001 and symbol in pe.active_symbols
+    pe.update_pnl(make_bar(symbol, "2024-01-10 00:13:00", 104.0))
+    assert long.hedge_pnl == 0 and long.total_pnl == 0 and symbol not in pe.active_symbols
+    pe.flush()
+    strategy.calls = []
+    pe.update_pnl(make_bar(symbol, "2024-01-10 00:14:00", 105.0))
+    pe.flush()
+    assert strategy.calls == [] and long.cur_price == 105.0 and pe.last_price[symbol] == 105.0
+    assert long.timestamp == "2024-01-10 00:14:00" and pe.position[symbol]['short'].cur_price == 105.0
+
+
+class LegacyStrategy:
+    def __init__(self):
+        self.calls = []
+
+    def onPosition(self, position):
+        self.calls.append("position")
+
+    def onAccount(self, account):
+        self.calls.append("account")
+
+
+def test_single_argument_callbacks_still_supported(event_engine):
+    pe = PositionEngine(event_engine, CONFIG, CFG)
+    strategy = LegacyStrategy()
+    pe.addStrategy(strategy)
+    assert not pe.position_takes_changed and not pe.account_takes_changed
+
+    fill = ORDERBACK(timestamp="2024-01-10 00:11:00", symbol=symbol, volume=0.5, volume_in_contract=0.5, price=100.0,
+                     orderType=OrderType.Market, direction=OrderAction.Buy, order_id=hardcoded_uuid, trade_volume=0.5,
+                     trade_volume_in_contract=0.5, traded_avg_price=100.0, fee=0, offset=OrderOffset.Open,
+                     last_price=100.0, status=OrderStatus.AllTraded)
+    pe.update_position(ORDERBACK_EVENT(data=fill))
+    pe.update_pnl(make_bar(symbol, "2024-01-10 00:12:00", 101.0))
+    pe.flush()
+    assert strategy.calls == ["account", "position", "position", "account"]
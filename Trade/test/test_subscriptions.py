@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+from Data.catalog import default_path
+from Exchange.Exchange import Exchange_Backtest_Medium_Frequency
+from Trade.MainEngine import MainEngine
+from Trade.test.helpers import Event, FakeEventEngine, MarkingStub, RecordingStrategy, minute_bars
+from Utils.DataStructure import SUBSCRIPTION
+from Utils.util import resolve_subscription, subscribed_market_data, PRICE_FIELDS
+
+TRADED = "BinanceU_BTCUSDT_perp"
+SIGNAL = "BinanceU_ETHUSDT_perp"
+UNUSED = "BinanceU_SOLUSDT_perp"
+FUNDING = "Funding_BinanceU_BTCUSDT_perp"
+CONFIG = {"TradingSymbols": [TRADED], "SignalSymbols": [SIGNAL, UNUSED], "FundingSymbols": [FUNDING],
+          "MARKET_DATA": [TRADED, SIGNAL, UNUSED, FUNDING]}
+
+
+def test_resolve_subscription_defaults_to_everything():
+    subscription = resolve_subscription(None, CONFIG)
+    assert subscription.symbols == {TRADED, SIGNAL, UNUSED}
+    assert subscription.fields is None
+    assert subscription.events == {"bar", "timeframe", "funding", "position", "account"}
+    assert subscribed_market_data(subscription, CONFIG) == CONFIG["MARKET_DATA"]
+
+
+def test_unsubscribed_signals_are_not_read():
+    subscription = resolve_subscription(SUBSCRIPTION(symbols=[TRADED, SIGNAL], fields=["volume"],
+                                                     events={"bar"}), CONFIG)
+    # 交易品种和funding总是读取
+    assert subscribed_market_data(subscription, CONFIG) == [TRADED, SIGNAL, FUNDING]
+    assert subscription.fields == list(PRICE_FIELDS) + ["volume"]
+    for bad in [SUBSCRIPTION(symbols=["BinanceU_XRPUSDT_perp"]), SUBSCRIPTION(fields=["vwap"]),
+                SUBSCRIPTION(events={"tick"})]:
+        with pytest.raises(ValueError):
+            resolve_subscription(bad, CONFIG)
+
+
+def test_exchange_publishes_subscribed_fields(tmp_path):
+    path = default_path(TRADED, str(tmp_path))
+    os.makedirs(os.path.dirname(path))
+    minute_bars(10).to_parquet(path, index=False)
+    config = dict(CONFIG, Slippage=0, data_root=str(tmp_path), bar_cache_dir=None, Timeframes=None,
+                  lookback_time="2024-01-01 00:00:00", end_time="2024-01-01 02:00:00")
+    exchange = Exchange_Backtest_Medium_Frequency(FakeEventEngine(), False, config, {"CONTRACT_TYPE": {"SPOT": "spot"}})
+    exchange.subscribe([TRADED, FUNDING], ["open", "high", "low", "close", "volume"])
+    assert exchange.market_data_symbols == [TRADED, FUNDING]
+
+    rows = list(exchange._Exchange_Backtest_Medium_Frequency__parquet_reader_generator(TRADED))
+    assert len(rows) == 10
+    assert "volume" in rows[0] and "timestamp" in rows[0] and "open_time" in rows[0]
+    assert "quote_volume" not in rows[0] and "taker_buy_volume" not in rows[0]
+    exchange.on_init()
+    exchange.update_bar_data({TRADED: rows[0]})
+    assert exchange.BarData[TRADED].volume == rows[0]["volume"] and exchange.BarData[TRADED].quote_volume == 0
+
+
+def make_engine(subscription):
+    engine = MainEngine.__new__(MainEngine)
+    engine.trading_symbols, engine.funding_symbols = [TRADED], [FUNDING]
+    engine.BAR, engine.FUNDING, engine.TIMEFRAME_BAR = dict(), dict(), dict()
+    engine.strategy, engine.position_manager = RecordingStrategy(), MarkingStub()
+    engine.position_manager.settle_funding = lambda fundings: engine.position_manager.marked.extend(f.symbol for f in fundings)
+    engine.subscription = resolve_subscription(subscription, CONFIG)
+    engine.warmup = False
+    return engine
+
+
+def test_signal_symbols_skip_position_marking():
+    engine = make_engine(None)
+    row = minute_bars(1).iloc[0].to_dict()
+    engine.process_bar_data(Event({TRADED: row, SIGNAL: row}))
+    assert engine.strategy.calls == [("bar", [TRADED, SIGNAL])]
+    # 只有交易品种估值持仓
+    assert engine.position_manager.marked == [row["timestamp"]]
+
+
+def test_unsubscribed_events_are_not_dispatched():
+    engine = make_engine(SUBSCRIPTION(symbols=[SIGNAL], events={"bar"}))
+    row = minute_bars(1).iloc[0].to_dict()
+    funding = {"fundingRate": "0.0001", "timestamp": row["timestamp"]}
+    engine.process_bar_data(Event({TRADED: row, SIGNAL: row, FUNDING: funding}))
+    # 交易品种仍然估值和结算funding, 但不推送给策略
+    assert engine.position_manager.marked == [row["timestamp"], TRADED]
+    assert engine.strategy.calls == [("bar", [SIGNAL])]
+    assert engine.BAR == dict() and engine.FUNDING == dict()
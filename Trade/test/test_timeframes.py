@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Data.catalog import default_path
+from Exchange.Exchange import Exchange_Backtest_Medium_Frequency
+from Trade.MainEngine import MainEngine
+from Trade.test.helpers import Event, FakeEventEngine, MarkingStub, RecordingStrategy, minute_bars
+from Utils.util import aggregate_bars, parse_timeframes, resolve_subscription, timeframe_ms, TIMEFRAME_BARS
+
+SYMBOL = "BinanceU_BTCUSDT_perp"
+COLUMNS = ["open_time", "open", "high", "low", "close", "volume", "close_time", "quote_volume", "count",
+           "taker_buy_volume", "taker_buy_quote_volume", "ignore", "timestamp"]
+
+
+def test_aggregate_bars_matches_pandas_resample():
+    df = minute_bars(200, start="2024-01-01 00:07:00", skip={30, 31, 32, 33, 34, 35, 36, 37, 38, 39, 40})
+    results = {c: df[c].to_numpy() for c in COLUMNS}
+    bars, ends = aggregate_bars(results, COLUMNS, results["open_time"], timeframe_ms("15m"))
+
+    expected = df.set_index(pd.to_datetime(df["open_time"], unit="ms")).resample("15min").agg({
+        "open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum", "count": "sum",
+        "taker_buy_quote_volume": "sum"}).dropna()
+    assert len(bars["open"]) == len(expected)
+    np.testing.assert_array_equal(bars["open_time"], expected.index.astype("int64") // 10 ** 6)
+    for col in ["open", "high", "low", "close", "volume", "taker_buy_quote_volume"]:
+        np.testing.assert_allclose(bars[col], expected[col].to_numpy())
+    np.testing.assert_array_equal(bars["count"], expected["count"].to_numpy())
+    # timestamp/close_time由周期计算, 00:30-00:45周期缺少最后几分钟时仍为00:44
+    finished = expected.index + pd.Timedelta("14min")
+    np.testing.assert_array_equal(bars["timestamp"], finished.strftime("%Y-%m-%d %H:%M:%S"))
+    np.testing.assert_array_equal(bars["close_time"], (expected.index.astype("int64") // 10 ** 6) + 15 * 60000 - 1)
+    # 第一根聚合bar不完整(从00:07开始), 在00:14完成
+    assert bars["timestamp"][0] == "2024-01-01 00:14:00" and ends[0] == 7
+
+
+def test_parse_timeframes():
+    assert parse_timeframes(None, [SYMBOL]) == dict()
+    assert parse_timeframes(["1m"], [SYMBOL]) == dict()
+    assert parse_timeframes(["1h", "15m"], [SYMBOL]) == {SYMBOL: ["15m", "1h"]}
+    assert parse_timeframes({SYMBOL: "5m"}, [SYMBOL]) == {SYMBOL: ["5m"]}
+    with pytest.raises(ValueError):
+        parse_timeframes(["15m", "20m"], [SYMBOL])
+    with pytest.raises(ValueError):
+        timeframe_ms("15x")
+
+
+def make_exchange(tmp_path, timeframes, bar_cache_dir=None):
+    config = {"MARKET_DATA": [SYMBOL], "TradingSymbols": [SYMBOL], "FundingSymbols": [], "Slippage": 0,
+              "data_root": str(tmp_path), "bar_cache_dir": bar_cache_dir, "Timeframes": timeframes,
+              "lookback_time": "2024-01-01 00:00:00", "end_time": "2024-01-01 02:00:00"}
+    return Exchange_Backtest_Medium_Frequency(FakeEventEngine(), False, config, {"CONTRACT_TYPE": {"SPOT": "spot"}})
+
+
+@pytest.mark.parametrize("use_cache", [False, True])
+def test_exchange_publishes_subscribed_timeframes(tmp_path, use_cache):
+    path = default_path(SYMBOL, str(tmp_path))
+    os.makedirs(os.path.dirname(path))
+    df = minute_bars(180)
+    df.to_parquet(path, index=False)
+    exchange = make_exchange(tmp_path, ["5m", "15m"], str(tmp_path / "cache") if use_cache else None)
+    rows = list(exchange._Exchange_Backtest_Medium_Frequency__parquet_reader_generator(SYMBOL))
+
+    # 00:00 - 02:00 共121根1m bar -> 25根5m bar(最后一根只有02:00)
+    assert len(rows) == 25
+    assert rows[0]["timestamp"] == "2024-01-01 00:04:00"
+    assert rows[0]["high"] == df["high"][:5].max() and rows[0]["close"] == df["close"][4]
+    assert rows[0]["volume"] == pytest.approx(df["volume"][:5].sum())
+    with_15m = [row for row in rows if TIMEFRAME_BARS in row]
+    assert [row["timestamp"] for row in with_15m][:2] == ["2024-01-01 00:14:00", "2024-01-01 00:29:00"]
+    bar = with_15m[0][TIMEFRAME_BARS]["15m"]
+    assert bar["open"] == df["open"][0] and bar["close"] == df["close"][14]
+    assert bar["low"] == df["low"][:15].min()
+
+
+def test_symbols_with_missing_minutes_publish_together(tmp_path):
+    other = "BinanceU_ETHUSDT_perp"
+    for symbol, skip in [(SYMBOL, ()), (other, {14, 28, 29})]:
+        path = default_path(symbol, str(tmp_path))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        minute_bars(60, skip=skip).to_parquet(path, index=False)
+    exchange = make_exchange(tmp_path, {SYMBOL: ["15m"], other: ["15m"]})
+    generator = exchange._Exchange_Backtest_Medium_Frequency__parquet_reader_generator
+    complete, gapped = list(generator(SYMBOL)), list(generator(other))
+    # 周期最后一分钟缺失的symbol也在同一时刻推送
+    assert [row["timestamp"] for row in gapped] == [row["timestamp"] for row in complete]
+    assert gapped[0]["timestamp"] == "2024-01-01 00:14:00"
+
+
+def test_exchange_without_timeframes_publishes_minutes(tmp_path):
+    path = default_path(SYMBOL, str(tmp_path))
+    os.makedirs(os.path.dirname(path))
+    minute_bars(30).to_parquet(path, index=False)
+    rows = list(make_exchange(tmp_path, None)._Exchange_Backtest_Medium_Frequency__parquet_reader_generator(SYMBOL))
+    assert len(rows) == 30 and TIMEFRAME_BARS not in rows[0]
+
+
+def test_main_engine_dispatches_timeframe_bars():
+    engine = MainEngine.__new__(MainEngine)
+    engine.trading_symbols, engine.funding_symbols = [SYMBOL], []
+    engine.BAR, engine.FUNDING, engine.TIMEFRAME_BAR = dict(), dict(), dict()
+    engine.strategy, engine.position_manager = RecordingStrategy(), MarkingStub()
+    engine.subscription = resolve_subscription(None, {"TradingSymbols": [SYMBOL]})
+    engine.warmup = False
+
+    row = minute_bars(1).iloc[0].to_dict()
+    row[TIMEFRAME_BARS] = {"1h": dict(row, close=123.0)}
+
+    engine.process_bar_data(Event({SYMBOL: row}))
+    assert engine.strategy.calls == [("bar", [SYMBOL]), ("1h", {SYMBOL: 123.0})]
+    assert engine.position_manager.marked == [row["timestamp"]]
+    assert engine.TIMEFRAME_BAR == dict()
@@ -0,0 +1,47 @@
+from Trade.MainEngine import MainEngine
+from Trade.test.helpers import Event, MarkingStub, minute_bars
+from Utils.util import resolve_subscription
+
+SYMBOL = "BinanceU_BTCUSDT_perp"
+FUNDING = "Funding_BinanceU_BTCUSDT_perp"
+CONFIG = {"TradingSymbols": [SYMBOL], "FundingSymbols": [FUNDING], "start_time": "2024-01-01 00:03:00"}
+
+
+class WarmupStrategy:
+    def __init__(self):
+        self.calls = []
+
+    def onWarmup(self, bar):
+        self.calls.append(("warmup", bar[SYMBOL].timestamp))
+
+    def onBar(self, bar):
+        self.calls.append(("bar", bar[SYMBOL].timestamp))
+
+    def onFunding(self, funding):
+        self.calls.append(("funding", sorted(funding)))
+
+
+def test_warmup_bars_bypass_position_engine():
+    engine = MainEngine.__new__(MainEngine)
+    engine.config = CONFIG
+    engine.trading_symbols, engine.funding_symbols = [SYMBOL], [FUNDING]
+    engine.BAR, engine.FUNDING, engine.TIMEFRAME_BAR = dict(), dict(), dict()
+    engine.strategy, engine.position_manager = WarmupStrategy(), MarkingStub()
+    engine.position_manager.settle_funding = lambda fundings: engine.position_manager.marked.append("funding")
+    engine.subscription = resolve_subscription(None, CONFIG)
+    engine.warmup = True
+
+    rows = minute_bars(5).to_dict("records")
+    for row in rows:
+        data = {SYMBOL: row}
+        if row["timestamp"].endswith("00:00:00"):
+            data[FUNDING] = {"fundingRate": "0.0001", "timestamp": row["timestamp"]}
+        engine.process_bar_data(Event(data))
+
+    timestamps = [row["timestamp"] for row in rows]
+    # 预热期的funding也推送给策略, 但不结算
+    assert engine.strategy.calls == [("funding", [FUNDING])] + [("warmup", ts) for ts in timestamps[:3]] + \
+        [("bar", ts) for ts in timestamps[3:]]
+    # 持仓引擎从start_time开始
+    assert engine.position_manager.marked == timestamps[3:]
+    assert engine.warmup is False and engine.timestamp == timestamps[-1]
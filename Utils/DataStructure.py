@@ -58,6 +58,19 @@ class FUNDING(BaseDataStructure):
     funding_rate: float
 
 
+@dataclass
+class SUBSCRIPTION(BaseDataStructure):
+    """
+    策略订阅的数据, None表示不限制
+    symbols: 推送给onBar的symbol(TradingSymbols和SignalSymbols中的), 没有订阅的信号品种不读取
+    fields: bar中用到的字段, 其它字段不推送(open/high/low/close用于撮合和估值, 总是保留)
+    events: 需要的回调, 'bar' / 'timeframe' / 'funding' / 'position' / 'account'
+    """
+    symbols: list = None
+    fields: list = None
+    events: set = None
+
+
 @dataclass
 class REALTIMEDATA(BaseDataStructure):
     """
@@ -179,15 +179,48 @@ def get_contract_multiplier(exchange, symbol, contract_type):
         print('{} not implemented.'.format(exchange))
 
 
+# 各交易所每天的funding结算时刻(UTC), 只在导入时生成一次
+SETTLEMENT_TIMES = {
+    CFG["EXCHANGE"]["BITMEX"]: ('04:00:00', '12:00:00', '20:00:00'),
+    CFG["EXCHANGE"]["HUOBISWAP"]: ('00:00:00', '08:00:00', '16:00:00'),
+    CFG["EXCHANGE"]["HUOBI"]: ('00:00:00', '08:00:00', '16:00:00'),
+    CFG["EXCHANGE"]["OKEXSWAP"]: ('00:00:00', '08:00:00', '16:00:00'),
+    CFG["EXCHANGE"]["BINANCEC"]: ('00:00:00', '08:00:00', '16:00:00'),
+    CFG["EXCHANGE"]["BINANCEU"]: ('00:00:00', '08:00:00', '16:00:00'),
+}
+FUNDING_TOLERANCE_MS = 60 * 1000  # funding记录的时间与结算时刻的最大偏差(fundingTime通常晚几毫秒)
+
 def get_settlement_time(exchange):
-    if exchange == CFG["EXCHANGE"]["BITMEX"]:
-        return ['04:00:00', '12:00:00', '20:00:00']
-    elif exchange == CFG["EXCHANGE"]["HUOBISWAP"] or exchange == CFG["EXCHANGE"]["HUOBI"]:
-        return ['00:00:00', '08:00:00', '16:00:00']
-    elif exchange == CFG["EXCHANGE"]["OKEXSWAP"]:
-        return ['00:00:00', '08:00:00', '16:00:00']
-    elif exchange == CFG["EXCHANGE"]["BINANCEC"] or exchange == CFG["EXCHANGE"]["BINANCEU"]:
-        return ['00:00:00', '08:00:00', '16:00:00']
+    return SETTLEMENT_TIMES.get(exchange)
+
+def settlement_schedule(exchange, start, end):
+    """
+    [start, end]内exchange的所有funding结算时刻
+    :param start, end: 'YYYY-mm-dd HH:MM:SS'
+    :return: 有序的int64毫秒时间戳
+    """
+    times = get_settlement_time(exchange)
+    if not times:
+        raise ValueError(f"settlement time of {exchange} is not defined")
+    offsets = np.array([pd.Timedelta(t).value // 10 ** 6 for t in times], dtype=np.int64)
+    start_ms, end_ms = pd.Timestamp(start).value // 10 ** 6, pd.Timestamp(end).value // 10 ** 6
+    day_ms = 86400 * 1000
+    days = np.arange(start_ms // day_ms * day_ms, end_ms + 1, day_ms, dtype=np.int64)
+    schedule = np.sort((days[:, None] + offsets[None, :]).ravel())
+    return schedule[(schedule >= start_ms) & (schedule <= end_ms)]
+
+def asof_funding(schedule, funding_time, tolerance=FUNDING_TOLERANCE_MS):
+    """
+    funding记录按时间as-of对齐到结算时刻: 每个结算时刻取时间不晚于(时刻 + tolerance)的最后一条记录,
+    记录的时间早于(时刻 - tolerance)时视为该时刻没有funding
+    :param funding_time: 有序的int64毫秒时间戳
+    :return: (有funding的结算时刻, 对应记录的下标)
+    """
+    funding_time = np.asarray(funding_time, dtype=np.int64)
+    index = np.searchsorted(funding_time, schedule + tolerance, side='right') - 1
+    valid = index >= 0
+    valid[valid] = funding_time[index[valid]] >= schedule[valid] - tolerance
+    return schedule[valid], index[valid]
 
 
 def get_contract_forward(exchange, symbol, contract_type):
@@ -461,6 +494,115 @@ def parse_pyarrow_table(arrow_table):
         result[col] = arrow_table[col].to_numpy()
     return result
 
+TIMEFRAME_UNITS_MS = {'m': 60 * 1000, 'h': 3600 * 1000, 'd': 86400 * 1000}
+BAR_SUM_COLUMNS = ('volume', 'quote_volume', 'count', 'taker_buy_volume', 'taker_buy_quote_volume')
+TIMEFRAME_BARS = 'timeframes'  # 行情数据中附带的其它周期bar: {timeframe: bar}
+
+def timeframe_ms(timeframe):
+    """'1m' / '15m' / '1h' / '1d' -> 毫秒"""
+    unit, count = timeframe[-1:], timeframe[:-1]
+    if unit not in TIMEFRAME_UNITS_MS or not count.isdigit() or int(count) <= 0:
+        raise ValueError(f"invalid timeframe: {timeframe}")
+    return int(count) * TIMEFRAME_UNITS_MS[unit]
+
+def parse_timeframes(timeframes, symbols):
+    """
+    config中的timeframes: None(全部1m) / 列表(所有symbol相同) / {symbol: 列表}
+    :return: {symbol: 按周期从小到大排列的列表}, 只包含不是单一1m的symbol
+    第一个周期驱动该symbol的行情推送(onBar, 持仓估值, 撮合), 其它周期必须是它的整数倍, 通过onTimeframeBar推送
+    """
+    if not timeframes:
+        return dict()
+    if not isinstance(timeframes, dict):
+        timeframes = {symbol: timeframes for symbol in symbols}
+    result = dict()
+    for symbol, frames in timeframes.items():
+        frames = sorted(set([frames] if isinstance(frames, str) else frames), key=timeframe_ms)
+        base = timeframe_ms(frames[0])
+        for frame in frames[1:]:
+            if timeframe_ms(frame) % base != 0:
+                raise ValueError(f"{symbol}: timeframe {frame} is not a multiple of {frames[0]}")
+        if frames != ['1m']:
+            result[symbol] = frames
+    return result
+
+def aggregate_bars(results, columns, open_time, period_ms, bar_ms=60 * 1000):
+    """
+    把按时间排序的1m bar聚合成period_ms周期的bar(向量化), 按UTC时间对齐
+    open取第一根, high/low取最大/最小, close取最后一根, 成交量类字段求和, open_time为周期起点, 其它列取最后一根
+    聚合bar的timestamp由周期计算(周期起点 + period - bar_ms), 即该bar完成的时刻; 周期末尾缺数据时也与其它symbol一致
+    close_time为周期终点 - 1ms
+    :param open_time: int64毫秒时间戳
+    :return: ({列: 数组}, 每根聚合bar对应的最后一根1m bar的下标)
+    """
+    open_time = np.asarray(open_time, dtype=np.int64)
+    bucket = open_time // period_ms
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]]) if len(bucket) else np.zeros(0, dtype=np.int64)
+    ends = np.r_[starts[1:], len(bucket)] - 1 if len(bucket) else starts
+    aggregated = dict()
+    for col in columns:
+        values = results[col]
+        if not len(starts):
+            aggregated[col] = values[:0]
+        elif col == 'open':
+            aggregated[col] = values[starts]
+        elif col == 'high':
+            aggregated[col] = np.maximum.reduceat(values, starts)
+        elif col == 'low':
+            aggregated[col] = np.minimum.reduceat(values, starts)
+        elif col in BAR_SUM_COLUMNS:
+            aggregated[col] = np.add.reduceat(values, starts)
+        elif col == 'open_time':
+            aggregated[col] = bucket[starts] * period_ms
+        elif col == 'close_time':
+            aggregated[col] = (bucket[starts] + 1) * period_ms - 1
+        elif col == 'timestamp':
+            finished = ((bucket[starts] + 1) * period_ms - bar_ms).astype('datetime64[ms]')
+            timestamp = np.char.replace(np.datetime_as_string(finished, unit='s'), 'T', ' ')
+            aggregated[col] = timestamp.astype(values.dtype) if values.dtype.kind in 'OU' else timestamp
+        else:
+            aggregated[col] = values[ends]
+    return aggregated, ends
+
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'quote_volume', 'count', 'taker_buy_volume',
+              'taker_buy_quote_volume')
+PRICE_FIELDS = ('open', 'high', 'low', 'close')  # 撮合和估值需要, 总是推送
+SUBSCRIPTION_EVENTS = ('bar', 'timeframe', 'funding', 'position', 'account')
+
+def resolve_subscription(subscription, config):
+    """
+    策略的SUBSCRIPTION -> symbols/events为集合, fields为列表或None(全部字段)的SUBSCRIPTION
+    :raise ValueError: 订阅了config中没有的symbol, 未知的字段或回调
+    """
+    from Utils.DataStructure import SUBSCRIPTION
+    subscription = subscription or SUBSCRIPTION()
+    bar_symbols = list(config['TradingSymbols']) + list(config.get('SignalSymbols', []))
+
+    symbols = set(bar_symbols if subscription.symbols is None else subscription.symbols)
+    unknown = symbols.difference(bar_symbols)
+    if unknown:
+        raise ValueError(f"subscribed symbols not in futures/signals: {sorted(unknown)}")
+
+    fields = None
+    if subscription.fields is not None:
+        unknown = set(subscription.fields).difference(BAR_FIELDS)
+        if unknown:
+            raise ValueError(f"unknown bar fields: {sorted(unknown)}")
+        fields = [f for f in BAR_FIELDS if f in PRICE_FIELDS or f in subscription.fields]
+
+    events = set(SUBSCRIPTION_EVENTS if subscription.events is None else subscription.events)
+    unknown = events.difference(SUBSCRIPTION_EVENTS)
+    if unknown:
+        raise ValueError(f"unknown events: {sorted(unknown)}")
+    return SUBSCRIPTION(symbols=symbols, fields=fields, events=events)
+
+def subscribed_market_data(subscription, config):
+    """
+    交易所需要读取的symbol: 交易品种(撮合和持仓估值)和funding(结算)总是读取, 信号品种只读取订阅的
+    """
+    return [symbol for symbol in config['MARKET_DATA']
+            if symbol not in config.get('SignalSymbols', []) or symbol in subscription.symbols]
+
 def calculate_daily_returns(account_value):
     """从账户价值计算日收益率"""
     return account_value.pct_change().dropna()
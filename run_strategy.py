@@ -32,7 +32,10 @@ def build_config(config_path: str = "./config.json") -> tuple:
     coin = cfg['coin']
     user = cfg['user']
     symbols = cfg['futures']
+    # 只作为信号输入(不交易)的品种, 不估值持仓
+    signals = cfg.get('signals', [])
     market_data = symbols.copy()
+    market_data.extend(signals)
     market_data.extend(cfg['funding'])
 
     pos_list = []
@@ -52,12 +55,27 @@ def build_config(config_path: str = "./config.json") -> tuple:
         "strategy_name": strategy_name,
         'is_windows': cfg['is_windows'],
         "enable_mongodb": cfg['enable_mongodb'],
+        "result_store": cfg.get('result_store', 'csv'),
+        "result_dir": cfg.get('result_dir', './bt_result/store'),
+        "data_root": cfg.get('data_root', '/srv/data'),
+        "data_catalog": cfg.get('data_catalog', None),
+        "bar_cache_dir": cfg.get('bar_cache_dir', None),
         "TradingSymbols": symbols,
+        "SignalSymbols": signals,
         "FundingSymbols": cfg['funding'],
+        "Timeframes": cfg.get('timeframes', None),
+        "fast_warmup": cfg.get('fast_warmup', False),
         "MARKET_DATA": market_data,
         "DB": {
             "Mongo_Host": "localhost",
             "Mongo_Port": "27017",
+            "Mongo_Batch_Size": cfg.get('mongo_batch_size', 1000),
+            "Mongo_Queue_Size": cfg.get('mongo_queue_size', 10000),
+            "Mongo_Max_Pool_Size": cfg.get('mongo_max_pool_size', 50),
+            "Mongo_Min_Pool_Size": cfg.get('mongo_min_pool_size', 0),
+            "Mongo_Layout": cfg.get('mongo_layout', 'collection'),
+            "RESULT_DB": "BacktestResult",
+            "RESULT_COL": "results",
             "ACCOUNT_DB": f"{user}_AccountInfo-{strategy_name}",
             "ACCOUNT_COL": dict(zip(symbols, symbols)),
             "POSITION_DB": f"{user}_PositionInfo-{strategy_name}",